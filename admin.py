@@ -0,0 +1,327 @@
+"""
+Админ-панель: /admin, /backup, статистика и выгрузки. bot.py импортирует модуль
+лениво, при первом обращении админа, — отчёты и копия базы не нужны для старта polling.
+"""
+import os
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import ANALYTICS_DB_PATH, LOCAL_FEATURES
+from utils import utc_date_str
+from http_session import pool_stats_text
+from logging_conf import log_stats_text
+from retry_queue import retry_counts
+from outbound import request_priority, queue_stats_text, ADMIN
+from analytics import refresh_snapshot_async, ensure_snapshot, staleness_text
+
+# Статистика, выгрузки, /backup и история рассылок читают локальный SQLite (копию DB_PATH).
+# С postgres пользователи в общей базе, а эта у каждого экземпляра своя — цифры были бы неверны
+LOCAL_ONLY_TEXT = "ℹ️ Отчёты и выгрузки работают только с SQLite: с STORAGE_BACKEND=postgres смотрите общую базу"
+
+# Админ-панель клавиатура
+admin_kb = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text="📊 Статистика за сегодня", callback_data="stats_today"),
+        InlineKeyboardButton(text="📈 За неделю", callback_data="stats_week")
+    ],
+    [
+        InlineKeyboardButton(text="📅 За месяц", callback_data="stats_month"),
+        InlineKeyboardButton(text="📋 За весь период", callback_data="stats_all")
+    ],
+    [
+        InlineKeyboardButton(text="💾 Скачать базу SQLite", callback_data="download_db"),
+        InlineKeyboardButton(text="📄 Экспорт в TXT", callback_data="export_txt")
+    ],
+    [
+        InlineKeyboardButton(text="📊 Экспорт в CSV", callback_data="export_csv"),
+        InlineKeyboardButton(text="📜 Рассылки", callback_data="stats_runs")
+    ]
+])
+
+
+async def cmd_backup_db(message: Message):
+    # ПРОВЕРКА НА АДМИНА: каждый /backup снимает полную копию базы
+    try:
+        from config import ADMIN_IDS
+        if message.from_user.id not in ADMIN_IDS:
+            await message.answer("❌ У вас нет прав доступа")
+            return
+    except ImportError:
+        await message.answer("❌ Админ-панель не настроена")
+        return
+
+    request_priority.set(ADMIN)
+    if not LOCAL_FEATURES:
+        await message.answer(LOCAL_ONLY_TEXT)
+        return
+    try:
+        from aiogram.types import FSInputFile
+        
+        # Согласованная копия через backup API, а не живой файл, в который идёт запись
+        await refresh_snapshot_async()
+        db_file = FSInputFile(ANALYTICS_DB_PATH, filename="users_backup.db")
+        await message.answer_document(
+            db_file,
+            caption=f"📁 Резервная копия базы данных\n📅 {utc_date_str()}\n💾 Размер: {os.path.getsize(ANALYTICS_DB_PATH)} байт"
+        )
+        
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}")
+
+async def cmd_admin(message: Message):
+    # ПРОВЕРКА НА АДМИНА
+    try:
+        from config import ADMIN_IDS
+        if message.from_user.id not in ADMIN_IDS:
+            await message.answer("❌ У вас нет прав доступа к админ-панели")
+            return
+    except ImportError:
+        # Если ADMIN_IDS не настроены, запрети всем
+        await message.answer("❌ Админ-панель не настроена")
+        return
+    
+    request_priority.set(ADMIN)
+    retries = retry_counts()
+    await message.answer(
+        "🔧 <b>Админ-панель</b>\n\n"
+        f"{pool_stats_text(message.bot)}\n"
+        f"🔁 Повторы отправки: ждут {retries.get('pending', 0)}, списано {retries.get('dead', 0)}\n"
+        f"{queue_stats_text()}\n"
+        f"{log_stats_text()}\n"
+        f"{staleness_text() if LOCAL_FEATURES else LOCAL_ONLY_TEXT}\n\n"
+        "Выберите действие:",
+        reply_markup=admin_kb
+    )
+
+async def admin_callback_handler(callback: CallbackQuery):
+    # ПРОВЕРКА НА АДМИНА
+    try:
+        from config import ADMIN_IDS
+        if callback.from_user.id not in ADMIN_IDS:
+            await callback.answer("❌ У вас нет прав доступа", show_alert=True)
+            return
+    except ImportError:
+        await callback.answer("❌ Админ-панель не настроена", show_alert=True)
+        return
+    
+    request_priority.set(ADMIN)
+    action = callback.data
+    if not LOCAL_FEATURES:
+        await callback.answer(LOCAL_ONLY_TEXT, show_alert=True)
+        return
+    
+    if action == "stats_today":
+        await show_stats(callback, "today")
+    elif action == "stats_week":
+        await show_stats(callback, "week")
+    elif action == "stats_month":
+        await show_stats(callback, "month")
+    elif action == "stats_all":
+        await show_stats(callback, "all")
+    elif action == "stats_runs":
+        await show_broadcast_runs(callback)
+    elif action == "download_db":
+        await download_database(callback)
+    elif action == "export_txt":
+        await export_users_txt(callback)
+    elif action == "export_csv":
+        await export_users_csv(callback)
+
+async def show_stats(callback: CallbackQuery, period: str):
+    try:
+        # Отчёты читают копию базы, а не рабочую
+        from analytics import get_analytics_conn as get_conn
+        from datetime import datetime, timedelta
+        await ensure_snapshot()
+        
+        now = datetime.now()
+        
+        # Определяем период
+        if period == "today":
+            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            title = "📊 Статистика за сегодня"
+        elif period == "week":
+            start_date = now - timedelta(days=7)
+            title = "📈 Статистика за неделю"
+        elif period == "month":
+            start_date = now - timedelta(days=30)
+            title = "📅 Статистика за месяц"
+        else:  # all
+            start_date = datetime(2020, 1, 1)  # Очень старая дата
+            title = "📋 Статистика за весь период"
+        
+        start_timestamp = int(start_date.timestamp())
+        
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            
+            # Общее количество пользователей
+            cursor.execute("SELECT COUNT(*) FROM users")
+            total_users = cursor.fetchone()[0]
+            
+            # Новые пользователи за период
+            cursor.execute("""
+                SELECT COUNT(*) FROM users 
+                WHERE last_request_at >= ? OR start_date >= ?
+            """, (start_timestamp, start_date.strftime('%Y-%m-%d')))
+            new_users = cursor.fetchone()[0]
+            
+            # Активные пользователи за период
+            cursor.execute("""
+                SELECT COUNT(*) FROM users 
+                WHERE last_request_at >= ? AND status = 'active'
+            """, (start_timestamp,))
+            active_users = cursor.fetchone()[0]
+            
+            # Статистика по уровням
+            cursor.execute("""
+                SELECT level, COUNT(*) FROM users 
+                WHERE (last_request_at >= ? OR start_date >= ?) AND status = 'active'
+                GROUP BY level
+            """, (start_timestamp, start_date.strftime('%Y-%m-%d')))
+            level_stats = cursor.fetchall()
+            
+            # Средний прогресс
+            cursor.execute("""
+                SELECT AVG(lesson_index) FROM users 
+                WHERE (last_request_at >= ? OR start_date >= ?) AND status = 'active'
+            """, (start_timestamp, start_date.strftime('%Y-%m-%d')))
+            avg_progress = cursor.fetchone()[0] or 0
+
+            # Частота рассылки (см. models.update_engagement_tiers)
+            cursor.execute("SELECT tier, COUNT(*) FROM users WHERE eligible = 1 GROUP BY tier")
+            tier_counts = cursor.fetchall()
+        
+        # Формируем сообщение
+        stats_text = [
+            f"<b>{title}</b>",
+            "",
+            f"👥 Всего пользователей: <b>{total_users}</b>",
+            f"🆕 Новых за период: <b>{new_users}</b>",
+            f"🟢 Активных за период: <b>{active_users}</b>",
+            f"📚 Средний прогресс: <b>{avg_progress:.1f}</b> урока",
+            "",
+            "<b>📊 По уровням:</b>"
+        ]
+        
+        for level, count in level_stats:
+            stats_text.append(f"  • {level}: <b>{count}</b> чел.")
+
+        from models import estimate_daily_savings
+        tier_names = {"daily": "каждый день", "few_days": "раз в 3 дня", "weekly": "раз в неделю"}
+        stats_text.append("")
+        stats_text.append("<b>📬 Частота рассылки:</b>")
+        for tier, count in tier_counts:
+            stats_text.append(f"  • {tier_names.get(tier, tier)}: <b>{count}</b> чел.")
+        stats_text.append(f"💡 Экономия: ~<b>{estimate_daily_savings(tier_counts):.0f}</b> отправок в день")
+        stats_text.append("")
+        stats_text.append(staleness_text())
+        
+        await callback.message.edit_text(
+            "\n".join(stats_text),
+            reply_markup=admin_kb
+        )
+        await callback.answer()
+        
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+async def show_broadcast_runs(callback: CallbackQuery):
+    try:
+        # Маленькая таблица с только что записанными отчётами — читаем рабочую базу, не копию
+        from broadcast_report import history_text
+        await callback.message.edit_text(history_text(), reply_markup=admin_kb)
+        await callback.answer()
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+async def download_database(callback: CallbackQuery):
+    try:
+        from aiogram.types import FSInputFile
+        
+        await refresh_snapshot_async()
+        db_file = FSInputFile(ANALYTICS_DB_PATH, filename="users_backup.db")
+        await callback.message.answer_document(
+            db_file,
+            caption=f"📁 База данных SQLite\n📅 {utc_date_str()}"
+        )
+        await callback.answer("✅ База отправлена!")
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+async def export_users_txt(callback: CallbackQuery):
+    try:
+        from analytics import get_analytics_conn as get_conn
+        from aiogram.types import BufferedInputFile
+        await ensure_snapshot()
+        
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id, username, full_name, level, lesson_index, start_date, status 
+                FROM users ORDER BY user_id
+            """)
+            users = cursor.fetchall()
+        
+        text_lines = [
+            f"📊 Экспорт пользователей - {utc_date_str()}",
+            f"Всего: {len(users)} пользователей",
+            "",
+            "ID | Username | Имя | Уровень | Урок | Дата старта | Статус",
+            "-" * 70
+        ]
+        
+        for user in users:
+            user_id, username, full_name, level, lesson_idx, start_date, status = user
+            username_display = f"@{username}" if username else "—"
+            full_name_display = full_name if full_name else "—"
+            text_lines.append(f"{user_id} | {username_display} | {full_name_display} | {level} | {lesson_idx} | {start_date} | {status}")
+        
+        text_file = BufferedInputFile(
+            "\n".join(text_lines).encode('utf-8'),
+            filename=f"users_{utc_date_str()}.txt"
+        )
+        
+        await callback.message.answer_document(
+            text_file,
+            caption=f"📄 Экспорт в TXT\n👥 {len(users)} пользователей"
+        )
+        await callback.answer("✅ TXT файл отправлен!")
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+
+async def export_users_csv(callback: CallbackQuery):
+    try:
+        from analytics import get_analytics_conn as get_conn
+        from aiogram.types import BufferedInputFile
+        await ensure_snapshot()
+        
+        with get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id, level, lesson_index, manual_lessons_today,
+                       start_date, last_sent_lesson_at, last_request_at, status 
+                FROM users ORDER BY user_id
+            """)
+            users = cursor.fetchall()
+        
+        # CSV формат
+        csv_lines = [
+            "user_id,level,lesson_index,manual_today,start_date,last_sent,last_request,status"
+        ]
+        
+        for user in users:
+            csv_lines.append(",".join([str(field) if field is not None else "" for field in user]))
+        
+        csv_content = "\n".join(csv_lines)
+        csv_file = BufferedInputFile(
+            csv_content.encode('utf-8'),
+            filename=f"users_export_{utc_date_str()}.csv"
+        )
+        
+        await callback.message.answer_document(
+            csv_file,
+            caption=f"📊 Экспорт в CSV\n👥 {len(users)} пользователей\n💡 Можно открыть в Excel"
+        )
+        await callback.answer("✅ CSV файл отправлен!")
+    except Exception as e:
+        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
@@ -0,0 +1,90 @@
+"""
+Копия базы для админских отчётов. Статистика и выгрузки читают отдельный файл
+ANALYTICS_DB_PATH, который периодически пересоздаётся через SQLite backup API,
+поэтому тяжёлые сканы не держат блокировки рабочей базы. Рабочая база в режиме
+WAL (models.init_db), так что само снятие копии читает снимок и не мешает записи.
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+from config import ANALYTICS_DB_PATH
+from models import get_conn
+
+# Планировщик, /backup и выгрузка могут снимать копию одновременно (каждый в своём потоке)
+_refresh_lock = threading.Lock()
+
+
+def refresh_snapshot() -> int:
+    """
+    Снимает согласованную копию рабочей базы и атомарно подменяет ею старую.
+    Блокирующая: из event loop вызывать через asyncio.to_thread. Одновременные
+    вызовы выполняются по очереди, у каждого свой временный файл рядом с копией.
+    """
+    with _refresh_lock:
+        fd, tmp = tempfile.mkstemp(
+            prefix=os.path.basename(ANALYTICS_DB_PATH) + ".", suffix=".tmp",
+            dir=os.path.dirname(os.path.abspath(ANALYTICS_DB_PATH)),
+        )
+        os.close(fd)
+        taken_at = int(time.time())
+        try:
+            src = get_conn()
+            dst = sqlite3.connect(tmp)
+            try:
+                src.backup(dst)
+                # Копия — обычный файл без -wal рядом: её отдают админу и открывают только на чтение
+                dst.execute("PRAGMA journal_mode=DELETE")
+                dst.execute("CREATE TABLE IF NOT EXISTS snapshot_meta (taken_at INTEGER)")
+                dst.execute("DELETE FROM snapshot_meta")
+                dst.execute("INSERT INTO snapshot_meta (taken_at) VALUES (?)", (taken_at,))
+                dst.commit()
+            finally:
+                dst.close()
+                src.close()
+            os.replace(tmp, ANALYTICS_DB_PATH)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return taken_at
+
+
+async def refresh_snapshot_async() -> int:
+    return await asyncio.to_thread(refresh_snapshot)
+
+
+async def ensure_snapshot():
+    """Снимает копию, если её ещё нет (первый отчёт до первого запуска планировщика)."""
+    if not os.path.exists(ANALYTICS_DB_PATH):
+        await refresh_snapshot_async()
+
+
+def get_analytics_conn() -> sqlite3.Connection:
+    """
+    Соединение только на чтение к копии. Копию не снимает: это блокирующий backup,
+    из event loop перед чтением вызывается await ensure_snapshot().
+    """
+    return sqlite3.connect(f"file:{ANALYTICS_DB_PATH}?mode=ro", uri=True)
+
+
+def snapshot_taken_at() -> Optional[int]:
+    if not os.path.exists(ANALYTICS_DB_PATH):
+        return None
+    try:
+        with get_analytics_conn() as conn:
+            row = conn.execute("SELECT taken_at FROM snapshot_meta").fetchone()
+            return row[0] if row else None
+    except sqlite3.Error:
+        return None
+
+
+def staleness_text() -> str:
+    taken_at = snapshot_taken_at()
+    if taken_at is None:
+        return "🗂 Копия для отчётов ещё не снята"
+    minutes = (int(time.time()) - taken_at) // 60
+    return f"🗂 Данные отчётов на {time.strftime('%H:%M', time.localtime(taken_at))} ({minutes} мин назад)"
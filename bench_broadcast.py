@@ -0,0 +1,166 @@
+"""
+Бенчмарк утренней рассылки против фейкового Telegram Bot API на localhost.
+
+    python bench_broadcast.py --users 5000 --lessons 3
+
+Поднимает aiohttp-сервер, который отвечает "ok" на sendMessage/copyMessage и
+считает байты запросов, заполняет временную БД и прогоняет broadcast() в двух
+режимах: обычный send_message и fan-out через copyMessage. Печатает число
+запросов, байты и задержку запросов для каждого режима.
+
+С --flood-every N каждый N-й запрос отвечает 429 с retry_after=--flood-retry-after;
+тогда печатается, сколько запросов пришло, пока флуд-лимит ещё действовал
+(только те, что уже были в полёте до ответа 429: пауза останавливает все
+отправки, а не одного пользователя).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp(prefix="bench_broadcast_")
+os.environ["DB_PATH"] = os.path.join(_tmp, "users.db")
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("LOG_FILE", os.path.join(_tmp, "bot.log"))
+
+from aiohttp import web  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+
+import daily_send  # noqa: E402
+from http_session import TunedAiohttpSession  # noqa: E402
+from models import init_db, get_conn  # noqa: E402
+
+STAGING_CHAT = -100500
+
+
+class FakeTelegram:
+    def __init__(self, delay: float, flood_every: int = 0, flood_retry_after: int = 1):
+        self.delay = delay
+        self.flood_every = flood_every
+        self.flood_retry_after = flood_retry_after
+        self.requests = {}
+        self.bytes = 0
+        self._next_id = 1
+        self.flood_until = 0.0
+        self.during_flood = 0
+        self.floods = 0
+
+    async def handle(self, request: web.Request):
+        body = await request.read()
+        method = request.match_info["method"]
+        self.requests[method] = self.requests.get(method, 0) + 1
+        self.bytes += len(body)
+        now = time.monotonic()
+        if now < self.flood_until:
+            self.during_flood += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self._next_id += 1
+        if self.flood_every and self._next_id % self.flood_every == 0:
+            self.floods += 1
+            self.flood_until = time.monotonic() + self.flood_retry_after
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.flood_retry_after}",
+                "parameters": {"retry_after": self.flood_retry_after},
+            })
+        if method == "copyMessage":
+            return web.json_response({"ok": True, "result": {"message_id": self._next_id}})
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._next_id, "date": int(time.time()),
+            "chat": {"id": 1, "type": "private"}, "text": "ok",
+        }})
+
+    def reset(self):
+        self.requests = {}
+        self.bytes = 0
+        self.flood_until = 0.0
+        self.during_flood = 0
+        self.floods = 0
+
+
+def seed_users(count: int, lessons: int):
+    levels = list(daily_send.lesson_mgr.data.keys())
+    rows = [
+        (uid, levels[uid % len(levels)], uid % lessons, "2024-01-01", int(time.time()))
+        for uid in range(1, count + 1)
+    ]
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM users")
+        c.executemany("""
+            INSERT INTO users (user_id, level, lesson_index, start_date, last_request_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+
+
+async def run_mode(name: str, fake: FakeTelegram, url: str, users: int, lessons: int, fanout: bool):
+    seed_users(users, lessons)
+    fake.reset()
+    daily_send.FANOUT_CHAT_ID = STAGING_CHAT if fanout else 0
+
+    latencies = []
+
+    session = TunedAiohttpSession(api=TelegramAPIServer.from_base(url))
+
+    @session.middleware
+    async def timing(make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    bot = Bot(os.environ["BOT_TOKEN"], session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    started = time.perf_counter()
+    await daily_send.broadcast(bot)
+    wall = time.perf_counter() - started
+    print(f"{name:<10} pool {session.pool_stats()}")
+    await session.close()
+
+    total = sum(fake.requests.values())
+    lat_ms = sorted(x * 1000 for x in latencies) or [0.0]
+    print(
+        f"{name:<10} requests={total:<6} {fake.requests} bytes={fake.bytes:<10} "
+        f"bytes/req={fake.bytes // max(total, 1):<6} wall={wall:.2f}s "
+        f"lat p50={statistics.median(lat_ms):.1f}ms p95={lat_ms[int(len(lat_ms) * 0.95) - 1]:.1f}ms"
+    )
+    if fake.flood_every:
+        print(f"{name:<10} 429: {fake.floods}, запросов во время флуд-лимита: {fake.during_flood}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--lessons", type=int, default=3, help="сколько разных уроков среди пользователей")
+    parser.add_argument("--delay-ms", type=float, default=0, help="искусственная задержка ответа API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--flood-every", type=int, default=0, help="каждый N-й запрос отвечает 429")
+    parser.add_argument("--flood-retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    init_db()
+    fake = FakeTelegram(args.delay_ms / 1000, args.flood_every, args.flood_retry_after)
+    app = web.Application(client_max_size=10 * 1024 * 1024)
+    app.router.add_post("/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        await run_mode("send", fake, url, args.users, args.lessons, fanout=False)
+        await run_mode("fan-out", fake, url, args.users, args.lessons, fanout=True)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,113 @@
+"""
+Пиковая память утренней рассылки на большой базе.
+
+    python bench_memory.py --users 1000000 --seconds 20
+
+Заполняет временную базу, затем в отдельном процессе запускает broadcast() против
+фейкового Bot API на --seconds секунд (рассылку миллиону за это время не отправить,
+но вся подготовка — выборка пользователей и постановка отправок — успевает пройти)
+и печатает RSS процесса до рассылки, пиковый RSS (ru_maxrss) и число отправок.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed_users(count: int):
+    from models import init_db, get_conn
+    init_db()
+    now = int(time.time())
+    with get_conn() as conn:
+        conn.execute("DELETE FROM users")
+        conn.executemany(
+            "INSERT INTO users (user_id, level, lesson_index, start_date, last_request_at) VALUES (?, 'A1', 0, ?, ?)",
+            ((uid, "2024-01-01", now) for uid in range(1, count + 1))
+        )
+        conn.commit()
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def child(seconds: float, port: int):
+    from aiohttp import web
+    import daily_send
+    from http_session import create_bot
+
+    sent = 0
+
+    async def handle(request: web.Request):
+        nonlocal sent
+        method = request.match_info["method"]
+        if method == "sendMessage":
+            sent += 1
+            return web.json_response({"ok": True, "result": {
+                "message_id": sent, "date": int(time.time()), "chat": {"id": 1, "type": "private"}, "text": "ok",
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    bot = create_bot()
+    before = rss_mb()
+    try:
+        await asyncio.wait_for(daily_send.broadcast(bot), seconds)
+    except asyncio.TimeoutError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    await bot.session.close()
+    await runner.cleanup()
+    print(f"rss before broadcast {before:.0f} MB, peak {peak:.0f} MB (+{peak - before:.0f} MB), "
+          f"sent in {seconds:.0f}s: {sent}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8791)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args.seconds, args.port))
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench_memory_")
+    env = dict(
+        os.environ,
+        DB_PATH=os.path.join(tmp, "users.db"),
+        BOT_TOKEN=os.environ.get("BOT_TOKEN", "42:bench"),
+        LOG_FILE=os.path.join(tmp, "bot.log"),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{args.port}",
+        OUTBOUND_RATE="1000",
+        OUTBOUND_BURST="100",
+    )
+    os.environ.update(env)
+    seed_users(args.users)
+    print(f"{args.users} users seeded")
+    subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", "--seconds", str(args.seconds),
+         "--port", str(args.port)],
+        cwd=HERE, env=env, check=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
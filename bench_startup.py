@@ -0,0 +1,129 @@
+"""
+Бенчмарк холодного старта: от запуска `python bot.py` до первого getUpdates.
+
+    python bench_startup.py --runs 5 --users 200000
+
+Поднимает фейковый Bot API на localhost (getMe/deleteWebhook/getUpdates),
+заполняет временную базу и несколько раз запускает bot.py с TELEGRAM_API_URL,
+замеряя время до первого запроса getUpdates. С --importtime дополнительно
+печатает самые тяжёлые импорты модуля bot (python -X importtime).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp(prefix="bench_startup_")
+os.environ["DB_PATH"] = os.path.join(_tmp, "users.db")
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("LOG_FILE", os.path.join(_tmp, "bot.log"))
+
+from aiohttp import web  # noqa: E402
+from models import init_db, get_conn  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakePolling:
+    def __init__(self):
+        self.first_update = asyncio.Event()
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        if method == "getUpdates":
+            self.first_update.set()
+            await asyncio.sleep(0.5)
+            return web.json_response({"ok": True, "result": []})
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+
+def seed_users(count: int):
+    init_db()
+    with get_conn() as conn:
+        conn.execute("DELETE FROM users")
+        conn.executemany(
+            "INSERT INTO users (user_id, level, lesson_index, start_date, last_request_at) VALUES (?, ?, ?, ?, ?)",
+            ((uid, "A1" if uid % 2 else "A2", uid % 40, "2024-01-01", int(time.time())) for uid in range(1, count + 1))
+        )
+        conn.commit()
+
+
+async def one_run(port: int) -> float:
+    fake = FakePolling()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    env = dict(os.environ, TELEGRAM_API_URL=f"http://127.0.0.1:{port}")
+    started = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(HERE, "bot.py"), cwd=HERE, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    exited = asyncio.ensure_future(proc.wait())
+    try:
+        await asyncio.wait(
+            [asyncio.ensure_future(fake.first_update.wait()), exited],
+            timeout=120, return_when=asyncio.FIRST_COMPLETED,
+        )
+        if not fake.first_update.is_set():
+            err = (await proc.stderr.read()).decode(errors="replace")
+            raise RuntimeError(f"bot.py не дошёл до getUpdates:\n{err[-2000:]}")
+        return time.perf_counter() - started
+    finally:
+        if proc.returncode is None:
+            proc.terminate()
+        await exited
+        await runner.cleanup()
+
+
+def import_profile(top: int):
+    env = dict(os.environ)
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import bot"],
+        cwd=HERE, env=env, capture_output=True, text=True,
+    )
+    rows = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cum_us), int(self_us), name.strip()))
+    total = next((cum for cum, _, name in rows if name == "bot"), 0)
+    print(f"import bot: {total / 1000:.0f} ms")
+    for cum, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cum / 1000:8.1f} ms  (self {self_us / 1000:6.1f})  {name}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--port", type=int, default=8771)
+    parser.add_argument("--importtime", action="store_true")
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    if args.importtime:
+        import_profile(15)
+    times = []
+    for _ in range(args.runs):
+        times.append(await one_run(args.port))
+    print(
+        f"start → first getUpdates ({args.users} users): "
+        f"median {statistics.median(times) * 1000:.0f} ms, min {min(times) * 1000:.0f} ms, "
+        f"runs {', '.join(f'{t * 1000:.0f}' for t in times)}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,199 @@
+"""
+Проверка нескольких экземпляров bot.py на одной базе: рассылка ровно один раз.
+
+    python bench_workers.py --workers 3 --users 300
+
+Поднимает фейковый Bot API, заполняет временную базу и запускает несколько bot.py
+в режиме webhook с BROADCAST_CRON раз в минуту. Проверяет, что:
+  - каждый экземпляр принимает обновления (/start на свой порт);
+  - первая рассылка отправила каждому пользователю ровно одно сообщение;
+  - после kill -9 лидера аренду забирает другой экземпляр и его рассылка
+    не шлёт повторно тем, кто уже получил урок.
+Код возврата 1, если что-то из этого не выполнено. Занимает около двух минут:
+рассылки идут по границам минут.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import signal
+import sys
+import tempfile
+import time
+
+_tmp = tempfile.mkdtemp(prefix="bench_workers_")
+os.environ["DB_PATH"] = os.path.join(_tmp, "users.db")
+os.environ.setdefault("BOT_TOKEN", "42:bench")
+os.environ.setdefault("LOG_FILE", os.path.join(_tmp, "bench.log"))
+
+from aiohttp import ClientSession, ClientError, web  # noqa: E402
+from models import init_db, get_conn  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WEBHOOK_USER_BASE = 10_000_000
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.sent = collections.Counter()
+        self._next_id = 1
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        form = await request.post()
+        self._next_id += 1
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+            }})
+        if method == "sendMessage":
+            chat_id = int(form["chat_id"])
+            self.sent[chat_id] += 1
+            return web.json_response({"ok": True, "result": {
+                "message_id": self._next_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": "ok",
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+
+def seed_users(count: int):
+    init_db()
+    with get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, level, lesson_index, start_date, last_request_at) VALUES (?, 'A1', 0, ?, ?)",
+            ((uid, "2024-01-01", int(time.time())) for uid in range(1, count + 1))
+        )
+        conn.commit()
+
+
+def lease_owner() -> str | None:
+    with get_conn() as conn:
+        row = conn.execute("SELECT owner, expires_at FROM leases WHERE name='scheduler'").fetchone()
+    return row[0] if row and row[1] >= time.time() else None
+
+
+async def wait_for(predicate, timeout: float, step: float = 0.5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(step)
+    return predicate()
+
+
+async def post_start(port: int, user_id: int) -> bool:
+    update = {
+        "update_id": user_id,
+        "message": {
+            "message_id": 1, "date": int(time.time()), "text": "/start",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Worker"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+    try:
+        async with ClientSession() as s:
+            async with s.post(f"http://127.0.0.1:{port}/webhook", json=update) as r:
+                return r.status == 200
+    except ClientError:
+        return False
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--port", type=int, default=8781, help="фейковый Bot API; экземпляры слушают port+1..")
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    fake = FakeTelegram()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    procs = {}
+    for i in range(args.workers):
+        name = f"w{i}"
+        env = dict(
+            os.environ,
+            TELEGRAM_API_URL=f"http://127.0.0.1:{args.port}",
+            WEBHOOK_URL="http://127.0.0.1",
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_PORT=str(args.port + 1 + i),
+            INSTANCE_ID=name,
+            BROADCAST_CRON="* * * * *",
+            LEADER_LEASE_TTL="6",
+            LEADER_RENEW_INTERVAL="1",
+            OUTBOUND_RATE="500",
+            OUTBOUND_BURST="50",
+            LOG_FILE=os.path.join(_tmp, f"{name}.log"),
+        )
+        stderr = open(os.path.join(_tmp, f"{name}.err"), "wb")
+        procs[name] = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(HERE, "bot.py"), cwd=HERE, env=env,
+            stdout=asyncio.subprocess.DEVNULL, stderr=stderr,
+        )
+
+    failures = []
+    try:
+        # Все экземпляры принимают обновления
+        webhook_users = {}
+        for i, name in enumerate(procs):
+            uid = WEBHOOK_USER_BASE + i
+            deadline = time.monotonic() + 30
+            while not await post_start(args.port + 1 + i, uid) and time.monotonic() < deadline:
+                await asyncio.sleep(0.5)
+            webhook_users[name] = uid
+        registered = lambda: all(fake.sent[uid] >= 1 for uid in webhook_users.values())  # noqa: E731
+        if not await wait_for(registered, 30):
+            failures.append(f"не все экземпляры ответили на /start: {dict((n, fake.sent[u]) for n, u in webhook_users.items())}")
+
+        seeded = range(1, args.users + 1)
+        print("Ждём первую рассылку (граница минуты)...")
+        if not await wait_for(lambda: all(fake.sent[uid] >= 1 for uid in seeded), 120):
+            failures.append(f"первая рассылка дошла до {sum(1 for u in seeded if fake.sent[u])}/{args.users}")
+        await asyncio.sleep(3)
+        first_leader = lease_owner()
+        print(f"Лидер: {first_leader}; kill -9")
+        if first_leader in procs:
+            procs[first_leader].send_signal(signal.SIGKILL)
+            await procs[first_leader].wait()
+        if not await wait_for(lambda: lease_owner() not in (None, first_leader), 30):
+            failures.append("аренду никто не забрал после падения лидера")
+        new_leader = lease_owner()
+        print(f"Новый лидер: {new_leader}; ждём его рассылку...")
+        new_log = os.path.join(_tmp, f"{new_leader}.log")
+        ran = lambda: os.path.exists(new_log) and "Broadcast:" in open(new_log, encoding="utf-8").read()  # noqa: E731
+        if not await wait_for(ran, 75):
+            failures.append(f"новый лидер {new_leader} не запустил рассылку")
+        await asyncio.sleep(3)
+    finally:
+        for proc in procs.values():
+            if proc.returncode is None:
+                proc.terminate()
+        await asyncio.gather(*(p.wait() for p in procs.values()))
+        await runner.cleanup()
+
+    dup = {uid: n for uid in range(1, args.users + 1) if (n := fake.sent[uid]) != 1}
+    if dup:
+        failures.append(f"не ровно одно сообщение у {len(dup)} пользователей, напр. {list(dup.items())[:5]}")
+    with get_conn() as conn:
+        bad_index = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE user_id <= ? AND lesson_index != 1", (args.users,)
+        ).fetchone()[0]
+    if bad_index:
+        failures.append(f"lesson_index != 1 у {bad_index} пользователей")
+
+    print(f"Экземпляров: {args.workers}, пользователей: {args.users}, сообщений рассылки: "
+          f"{sum(fake.sent[uid] for uid in range(1, args.users + 1))}; логи в {_tmp}")
+    for f in failures:
+        print("FAIL:", f)
+    print("OK" if not failures else "FAILED")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
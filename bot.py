@@ -1,37 +1,28 @@
 import asyncio
-import os
 import logging
-from aiogram import Bot, Dispatcher, F
+import random
+import secrets
+from datetime import datetime
+from aiogram import Dispatcher, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import Command
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-
-from config import BOT_TOKEN, MAX_MANUAL_PER_DAY, DEFAULT_LEVEL, DB_PATH
-from logging_conf import setup_logging
-
-# Scheduler imports
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-from daily_send import broadcast
-
-from models import (
-    init_db,
-    register_user,
-    get_user,
-    set_level,
-    increment_lesson,
-    set_last_request,
-    increment_manual,
-    can_take_manual,
-    reset_manual_if_new_day,
-    set_last_sent,
-    get_progress_text,
-    reactivate_if_blocked,
-    reset_progress_to_first,
+
+from config import (
+    BOT_TOKEN, MAX_MANUAL_PER_DAY, DEFAULT_LEVEL, ANALYTICS_REFRESH_MINUTES, BROADCAST_CRON,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, LOCAL_FEATURES,
 )
-from lesson_manager import LessonManager
+from logging_conf import setup_logging, run_stats_logger, log_stats
+from http_session import create_bot
+
+from models import event_log
+from storage import get_storage
+from lesson_manager import get_lesson_manager, esc
 from utils import utc_date_str
+from srs import (
+    add_lesson_cards, seed_once, next_due_card, get_card, count_due, grade_card,
+    GRADE_AGAIN, GRADE_HARD, GRADE_GOOD,
+)
+from quiz import quiz_pairs, make_question, question_rng, answer_buffer, weakest_words, RESULT_OK, RESULT_WRONG
 
 # Initialize logging
 setup_logging()
@@ -40,45 +31,40 @@ logger = logging.getLogger(__name__)
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN не задан")
 
-lesson_mgr = LessonManager()
+lesson_mgr = get_lesson_manager()
+db = get_storage()
 
-# Основная клавиатура с кнопками навигации по урокам
+# Основная клавиатура с кнопками навигации по урокам.
+# Повторение и квиз живут в локальном SQLite — с postgres их нет (config.LOCAL_FEATURES)
 kb = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="📘 Следующий урок")],
-        [KeyboardButton(text="🔁 Повторить все"), KeyboardButton(text="📈 Прогресс")],
+        [KeyboardButton(text="🔁 Повторить все"), KeyboardButton(text="🧠 Повторение")] if LOCAL_FEATURES
+        else [KeyboardButton(text="🔁 Повторить все")],
+        [KeyboardButton(text="🎯 Квиз"), KeyboardButton(text="📈 Прогресс")] if LOCAL_FEATURES
+        else [KeyboardButton(text="📈 Прогресс")],
         [KeyboardButton(text="🏁 Начать с первого урока")],
         [KeyboardButton(text="🗑️ Удалить мои данные")],
     ],
     resize_keyboard=True,
 )
 
-# Inline-клавиатура для выбора уровня
-level_kb = InlineKeyboardMarkup(inline_keyboard=[
-    [
-        InlineKeyboardButton(text="🚀 Уровень A1", callback_data="set_level:A1"),
-        InlineKeyboardButton(text="🚀🚀 Уровень A2", callback_data="set_level:A2")
-    ]
-])
+# Inline-клавиатура для выбора уровня: строится по метаданным уровней из lessons.json
+# и пересобирается, только когда уроки перезагружены (lesson_mgr.version)
+_level_kb: tuple[int, InlineKeyboardMarkup] | None = None
 
-# Админ-панель клавиатура
-admin_kb = InlineKeyboardMarkup(inline_keyboard=[
-    [
-        InlineKeyboardButton(text="📊 Статистика за сегодня", callback_data="stats_today"),
-        InlineKeyboardButton(text="📈 За неделю", callback_data="stats_week")
-    ],
-    [
-        InlineKeyboardButton(text="📅 За месяц", callback_data="stats_month"),
-        InlineKeyboardButton(text="📋 За весь период", callback_data="stats_all")
-    ],
-    [
-        InlineKeyboardButton(text="💾 Скачать базу SQLite", callback_data="download_db"),
-        InlineKeyboardButton(text="📄 Экспорт в TXT", callback_data="export_txt")
-    ],
-    [
-        InlineKeyboardButton(text="📊 Экспорт в CSV", callback_data="export_csv")
-    ]
-])
+
+def level_kb() -> InlineKeyboardMarkup:
+    global _level_kb
+    if _level_kb is None or _level_kb[0] != lesson_mgr.version:
+        buttons = [
+            InlineKeyboardButton(text=lesson_mgr.meta[lvl]["button"], callback_data=f"set_level:{lvl}")
+            for lvl in lesson_mgr.levels
+        ]
+        _level_kb = (lesson_mgr.version, InlineKeyboardMarkup(
+            inline_keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        ))
+    return _level_kb[1]
 
 # Универсальное приветственное сообщение
 def build_start_text() -> str:
@@ -94,58 +80,70 @@ async def cmd_start(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
     full_name = f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip()
-    register_user(user_id, utc_date_str(), username, full_name)
-    reactivate_if_blocked(user_id)
-    await message.answer(build_start_text(), reply_markup=level_kb)
+    await db.register_user(user_id, utc_date_str(), username, full_name)
+    await db.reactivate_if_blocked(user_id)
+    await message.answer(build_start_text(), reply_markup=level_kb())
     await message.answer("Главное меню:", reply_markup=kb)
 
-    row = get_user(user_id)
+    row = await db.get_user(user_id)
     level = row[1]
     current_lesson_index = row[2]  # Берём ТЕКУЩИЙ индекс из базы
     current_text = lesson_mgr.current_or_end(level, current_lesson_index)
     await message.answer(f"<b>🌅 Ваш текущий урок</b>\n\n{current_text}")
-    set_last_request(user_id)
-    increment_lesson(user_id)
-    increment_manual(user_id)
-    set_last_sent(user_id)
+    add_lesson_cards(user_id, level, current_lesson_index, lesson_mgr.get_lesson_obj(level, current_lesson_index))
+    await db.set_last_request(user_id)
+    await db.increment_lesson(user_id)
+    await db.increment_manual(user_id)
+    await db.set_last_sent(user_id)
     await message.answer(
         "🔔 Ежедневная утренняя рассылка активирована!\n"
         "Каждое утро вы будете получать новый урок."
     )
 
 async def set_level_callback_handler(callback: CallbackQuery):
-    new_level = callback.data.split(":")[1]
+    new_level = callback.data.split(":", 1)[1]
     user_id = callback.from_user.id
+    if new_level not in lesson_mgr.meta:
+        # Кнопка из старого сообщения, а уровень с тех пор убрали из lessons.json
+        await callback.answer("Такого уровня больше нет, отправьте /start.", show_alert=True)
+        return
+    name = esc(lesson_mgr.name(new_level))
 
-    row = get_user(user_id)
+    row = await db.get_user(user_id)
     if not row:
         await callback.answer("Сначала /start", show_alert=True)
         return
 
     current_level = row[1]
     if current_level == new_level and row[2] > 0:
-        await callback.answer(f"Уровень {new_level} уже активен.", show_alert=True)
+        await callback.answer(f"Уровень {lesson_mgr.name(new_level)} уже активен.", show_alert=True)
         return
 
-    set_level(user_id, new_level)
-    await callback.answer(f"Уровень {new_level} установлен!", show_alert=True)
+    await db.set_level(user_id, new_level)
+    await callback.answer(f"Уровень {lesson_mgr.name(new_level)} установлен!", show_alert=True)
     await callback.message.answer(
-        f"✅ Уровень изменён на <b>{new_level}</b>.\n"
+        f"✅ Уровень изменён на <b>{name}</b>.\n"
         "Нажмите «📘 Следующий урок», чтобы получить новый урок по выбранному уровню."
     )
 
 async def cmd_progress(message: Message):
-    row = get_user(message.from_user.id)
+    row = await db.get_user(message.from_user.id)
     if not row:
         await message.answer("Сначала /start")
         return
     _, level, lesson_index, *_ = row
     total = lesson_mgr.total(level)
-    await message.answer(get_progress_text(message.from_user.id, total))
+    text = await db.get_progress_text(message.from_user.id, total)
+    weak = weakest_words(message.from_user.id)
+    if weak:
+        text += "\n\n📉 Слабые слова:\n" + "\n".join(
+            f"• <code>{esc(token)}</code> — ошибок {wrong} из {answered}" for token, wrong, answered in weak
+        )
+    await message.answer(text)
 
 async def repeat_all_handler(message: Message):
     user_id = message.from_user.id
-    row = get_user(user_id)
+    row = await db.get_user(user_id)
     if not row:
         await message.answer("Сначала /start")
         return
@@ -159,57 +157,179 @@ async def repeat_all_handler(message: Message):
     for part in parts:
         await message.answer(part)
 
-async def next_lesson_handler(message: Message):
+# -------- Интервальное повторение --------
+
+def srs_show_kb(card_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="👀 Показать ответ", callback_data=f"srs:show:{card_id}")]
+    ])
+
+
+# Оценки, которые предлагают кнопки srs_grade_kb; другие из callback_data не принимаются
+SRS_GRADES = (GRADE_AGAIN, GRADE_HARD, GRADE_GOOD)
+
+
+def srs_grade_kb(card_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="❌ Не помню", callback_data=f"srs:grade:{card_id}:{GRADE_AGAIN}"),
+        InlineKeyboardButton(text="🤔 Трудно", callback_data=f"srs:grade:{card_id}:{GRADE_HARD}"),
+        InlineKeyboardButton(text="✅ Помню", callback_data=f"srs:grade:{card_id}:{GRADE_GOOD}"),
+    ]])
+
+
+def srs_card_text(front: str, left: int) -> str:
+    return f"<b>🧠 Повторение</b> (осталось: {left})\n\n<code>{esc(front)}</code>"
+
+
+async def srs_review_handler(message: Message):
     user_id = message.from_user.id
-    row = get_user(user_id)
+    row = await db.get_user(user_id)
     if not row:
         await message.answer("Сначала /start")
         return
 
-    (
-        _uid, level, lesson_index, _manual_today, _start_date,
-        _last_sent, _last_req, status, _reactivated_at,
-    ) = row
+    _, level, lesson_index, *_ = row
+    # Пользователь мог пройти уроки до появления повторения — один раз заводим карточки по прогрессу
+    seed_once(user_id, level, lesson_index, lesson_mgr.data.get(level, []))
 
-    if status != "active":
-        await message.answer("Статус не active. Напиши /start для реактивации.")
+    card = next_due_card(user_id)
+    if not card:
+        await message.answer("✅ На сегодня повторять нечего. Возвращайтесь завтра!")
         return
+    card_id, front, _back = card
+    await message.answer(srs_card_text(front, count_due(user_id)), reply_markup=srs_show_kb(card_id))
 
-    reset_manual_if_new_day(user_id)
-    total = lesson_mgr.total(level)
-    if lesson_index >= total:
-        await message.answer(lesson_mgr.end_message(level))
+
+async def srs_callback_handler(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    parts = callback.data.split(":")
+    # callback_data приходит от клиента: оценка идёт в интервалы SM-2, поэтому принимаем только свои кнопки
+    try:
+        action, card_id = parts[1], int(parts[2])
+        grade = int(parts[3]) if action == "grade" else None
+    except (IndexError, ValueError):
+        grade, action = None, None
+    if action not in ("show", "grade") or (action == "grade" and grade not in SRS_GRADES):
+        await callback.answer("Неизвестная кнопка", show_alert=True)
+        return
+
+    if action == "show":
+        card = get_card(card_id, user_id)
+        if not card:
+            await callback.answer("Карточка не найдена", show_alert=True)
+            return
+        _, front, back = card
+        await callback.message.edit_text(
+            f"<b>🧠 Повторение</b>\n\n<code>{esc(front)}</code>\n— {esc(back)}\n\nНасколько легко вспомнили?",
+            reply_markup=srs_grade_kb(card_id)
+        )
+        await callback.answer()
+        return
+
+    grade_card(card_id, user_id, grade)
+    card = next_due_card(user_id)
+    if not card:
+        await callback.message.edit_text("🎉 Все карточки на сегодня повторены!")
+    else:
+        next_id, front, _back = card
+        await callback.message.edit_text(srs_card_text(front, count_due(user_id)), reply_markup=srs_show_kb(next_id))
+    await callback.answer()
+
+
+# -------- Квиз --------
+
+async def send_quiz_question(message: Message, user_id: int, edit: bool = False, prefix: str = ""):
+    row = await db.get_user(user_id)
+    if not row:
+        await message.answer("Сначала /start")
+        return
+    _, level, lesson_index, *_ = row
+    learned = min(lesson_index, lesson_mgr.total(level))
+    if learned <= 0:
+        await message.answer("Сначала возьмите хотя бы один урок 📘.")
         return
 
-    if not can_take_manual(user_id, MAX_MANUAL_PER_DAY):
-        await message.answer("Достигнут лимит ручных уроков на сегодня.")
+    li = random.randrange(learned)
+    pairs = quiz_pairs(lesson_mgr.get_lesson_obj(level, li) or {})
+    nonce = secrets.token_hex(4)
+    question = make_question(pairs, question_rng(user_id, nonce))
+    if not question:
+        await message.answer("В этом уроке нечего спрашивать, попробуйте ещё раз.")
+        return
+    answer, options = question
+    # Правильный ответ в кнопки не кладём: только nonce вопроса и номер варианта
+    markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=pairs[i][1], callback_data=f"quiz:{level}:{li}:{nonce}:{pos}")]
+        for pos, i in enumerate(options)
+    ])
+    text = f"{prefix}<b>🎯 Как переводится?</b>\n\n<code>{esc(pairs[answer][0])}</code>"
+    if edit:
+        await message.edit_text(text, reply_markup=markup)
+    else:
+        await message.answer(text, reply_markup=markup)
+
+
+async def quiz_handler(message: Message):
+    await send_quiz_question(message, message.from_user.id)
+
+
+async def quiz_callback_handler(callback: CallbackQuery):
+    _, level, li, nonce, pos = callback.data.split(":")
+    li, pos = int(li), int(pos)
+    pairs = quiz_pairs(lesson_mgr.get_lesson_obj(level, li) or {})
+    question = make_question(pairs, question_rng(callback.from_user.id, nonce))
+    if not question or pos >= len(question[1]):
+        await callback.answer("Вопрос устарел", show_alert=True)
         return
 
-    # СНАЧАЛА берем урок по ТЕКУЩЕМУ индексу
+    answer, options = question
+    de, ru = pairs[answer]
+    ok = options[pos] == answer
+    answer_buffer.add(callback.from_user.id, level, li, de, RESULT_OK if ok else RESULT_WRONG)
+    if ok:
+        prefix = "✅ Верно!\n\n"
+    else:
+        prefix = f"❌ Неверно: <code>{esc(de)}</code> — {esc(ru)}\n\n"
+    await send_quiz_question(callback.message, callback.from_user.id, edit=True, prefix=prefix)
+    await callback.answer()
+
+
+async def next_lesson_handler(message: Message):
+    user_id = message.from_user.id
+    # Статус, конец уровня, дневной лимит и продвижение прогресса — одна запись в базе,
+    # поэтому двойное нажатие не выдаст лишний урок
+    claimed = await db.claim_manual_lesson(user_id, MAX_MANUAL_PER_DAY)
+    if claimed is None:
+        row = await db.get_user(user_id)
+        if not row:
+            await message.answer("Сначала /start")
+        elif row[7] != "active":
+            await message.answer("Статус не active. Напиши /start для реактивации.")
+        elif row[2] >= lesson_mgr.total(row[1]):
+            await message.answer(lesson_mgr.end_message(row[1]))
+        else:
+            await message.answer("Достигнут лимит ручных уроков на сегодня.")
+        return
+
+    level, lesson_index = claimed
     text = lesson_mgr.current_or_end(level, lesson_index)
     if not text:
         await message.answer("Не удалось получить урок (проверь lessons.json).")
         return
 
-    # ПОКАЗЫВАЕМ урок
     await message.answer(text)
-
-    # ПОТОМ увеличиваем индекс
-    set_last_request(user_id)
-    increment_lesson(user_id)
-    increment_manual(user_id)
-    set_last_sent(user_id)
+    add_lesson_cards(user_id, level, lesson_index, lesson_mgr.get_lesson_obj(level, lesson_index))
 
 async def restart_from_first_handler(message: Message):
     user_id = message.from_user.id
-    row = get_user(user_id)
+    row = await db.get_user(user_id)
     if not row:
         username = message.from_user.username
         full_name = f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip()
-        register_user(user_id, utc_date_str(), username, full_name)
+        await db.register_user(user_id, utc_date_str(), username, full_name)
 
-    reset_progress_to_first(user_id)
-    row2 = get_user(user_id)
+    await db.reset_progress_to_first(user_id)
+    row2 = await db.get_user(user_id)
     level = row2[1] if row2 else DEFAULT_LEVEL
 
     total = lesson_mgr.total(level)
@@ -219,40 +339,22 @@ async def restart_from_first_handler(message: Message):
 
     first_text = lesson_mgr.current_or_end(level, 0)
     await message.answer("<b>Прогресс обнулён.</b> Начинаем сначала!\n\n" + first_text)
+    add_lesson_cards(user_id, level, 0, lesson_mgr.get_lesson_obj(level, 0))
 
-    set_last_request(user_id)
-    increment_manual(user_id)
-    set_last_sent(user_id)
+    await db.set_last_request(user_id)
+    await db.increment_manual(user_id)
+    await db.set_last_sent(user_id)
 
 async def fallback(message: Message):
     await message.answer(
-        "Не понял. Кнопки:\n📘 урок • 🔁 повтор • 📈 прогресс • 🏁 сначала\nИли выберите уровень через /start."
+        "Не понял. Кнопки:\n📘 урок • 🔁 повтор • 🧠 карточки • 🎯 квиз • 📈 прогресс • 🏁 сначала\nИли выберите уровень через /start."
     )
 
-async def cmd_backup_db(message: Message):
-    try:
-        from aiogram.types import FSInputFile
-        
-        # Отправь файл базы
-        db_file = FSInputFile(DB_PATH, filename="users_backup.db")
-        await message.answer_document(
-            db_file,
-            caption=f"📁 Резервная копия базы данных\n📅 {utc_date_str()}\n💾 Размер: {os.path.getsize(DB_PATH)} байт"
-        )
-        
-    except Exception as e:
-        await message.answer(f"❌ Ошибка: {str(e)}")
-
 async def cmd_reset_me(message: Message):
     """Полностью удаляет твою запись из базы для тестирования"""
     try:
-        from models import get_conn
         user_id = message.from_user.id
-        
-        with get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-            conn.commit()
+        await db.delete_user(user_id)
         
         await message.answer("🔥 Твоя запись удалена! Теперь /start для новой регистрации.")
     except Exception as e:
@@ -261,13 +363,8 @@ async def cmd_reset_me(message: Message):
 async def delete_my_data_handler(message: Message):
     """Хандлер для кнопки удаления данных"""
     try:
-        from models import get_conn
         user_id = message.from_user.id
-        
-        with get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-            conn.commit()
+        await db.delete_user(user_id)
         
         await message.answer(
             "🗑️ <b>Ваши данные удалены из базы!</b>\n\n"
@@ -276,232 +373,181 @@ async def delete_my_data_handler(message: Message):
     except Exception as e:
         await message.answer(f"❌ Ошибка: {str(e)}")            
 
-# -------- НОВЫЕ АДМИН ФУНКЦИИ --------
+# -------- Админка (модуль admin грузится при первом обращении) --------
+
+async def cmd_backup_db(message: Message):
+    import admin
+    await admin.cmd_backup_db(message)
 
 async def cmd_admin(message: Message):
-    # ПРОВЕРКА НА АДМИНА
-    try:
-        from config import ADMIN_IDS
-        if message.from_user.id not in ADMIN_IDS:
-            await message.answer("❌ У вас нет прав доступа к админ-панели")
-            return
-    except ImportError:
-        # Если ADMIN_IDS не настроены, запрети всем
-        await message.answer("❌ Админ-панель не настроена")
-        return
-    
-    await message.answer(
-        "🔧 <b>Админ-панель</b>\n\n"
-        "Выберите действие:",
-        reply_markup=admin_kb
-    )
+    import admin
+    await admin.cmd_admin(message)
 
 async def admin_callback_handler(callback: CallbackQuery):
-    # ПРОВЕРКА НА АДМИНА
-    try:
-        from config import ADMIN_IDS
-        if callback.from_user.id not in ADMIN_IDS:
-            await callback.answer("❌ У вас нет прав доступа", show_alert=True)
-            return
-    except ImportError:
-        await callback.answer("❌ Админ-панель не настроена", show_alert=True)
+    import admin
+    await admin.admin_callback_handler(callback)
+
+# -------- Фоновый запуск --------
+
+async def daily_broadcast(bot):
+    from daily_send import broadcast
+    await broadcast(bot)
+
+
+def missed_fire_time(trigger, now: datetime):
+    """Сегодняшнее время рассылки по trigger, если оно уже прошло, иначе None."""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    fire = trigger.get_next_fire_time(None, midnight)
+    return fire if fire is not None and fire <= now else None
+
+
+async def catch_up_broadcast(bot, trigger):
+    """
+    Новый лидер поднимает планировщик заново, и его cron сработает только завтра.
+    Если сегодняшний запуск уже прошёл (прежний лидер упал до или во время рассылки),
+    а должники остались — досылаем сейчас. Повтор безопасен: кому урок уже ушёл,
+    next_due_day сдвинут, а mark_sent проверяет fence.
+    """
+    from models import today_day
+    fire = missed_fire_time(trigger, datetime.now(trigger.timezone))
+    if fire is None or not await db.due_users_page(0, today_day(), 1):
         return
-    
-    action = callback.data
-    
-    if action == "stats_today":
-        await show_stats(callback, "today")
-    elif action == "stats_week":
-        await show_stats(callback, "week")
-    elif action == "stats_month":
-        await show_stats(callback, "month")
-    elif action == "stats_all":
-        await show_stats(callback, "all")
-    elif action == "download_db":
-        await download_database(callback)
-    elif action == "export_txt":
-        await export_users_txt(callback)
-    elif action == "export_csv":
-        await export_users_csv(callback)
-
-async def show_stats(callback: CallbackQuery, period: str):
+    logger.warning("Broadcast due at %s was missed, catching up", fire)
     try:
-        from models import get_conn
-        import time
-        from datetime import datetime, timedelta
-        
-        now = datetime.now()
-        
-        # Определяем период
-        if period == "today":
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            title = "📊 Статистика за сегодня"
-        elif period == "week":
-            start_date = now - timedelta(days=7)
-            title = "📈 Статистика за неделю"
-        elif period == "month":
-            start_date = now - timedelta(days=30)
-            title = "📅 Статистика за месяц"
-        else:  # all
-            start_date = datetime(2020, 1, 1)  # Очень старая дата
-            title = "📋 Статистика за весь период"
-        
-        start_timestamp = int(start_date.timestamp())
-        
-        with get_conn() as conn:
-            cursor = conn.cursor()
-            
-            # Общее количество пользователей
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            
-            # Новые пользователи за период
-            cursor.execute("""
-                SELECT COUNT(*) FROM users 
-                WHERE last_request_at >= ? OR start_date >= ?
-            """, (start_timestamp, start_date.strftime('%Y-%m-%d')))
-            new_users = cursor.fetchone()[0]
-            
-            # Активные пользователи за период
-            cursor.execute("""
-                SELECT COUNT(*) FROM users 
-                WHERE last_request_at >= ? AND status = 'active'
-            """, (start_timestamp,))
-            active_users = cursor.fetchone()[0]
-            
-            # Статистика по уровням
-            cursor.execute("""
-                SELECT level, COUNT(*) FROM users 
-                WHERE (last_request_at >= ? OR start_date >= ?) AND status = 'active'
-                GROUP BY level
-            """, (start_timestamp, start_date.strftime('%Y-%m-%d')))
-            level_stats = cursor.fetchall()
-            
-            # Средний прогресс
-            cursor.execute("""
-                SELECT AVG(lesson_index) FROM users 
-                WHERE (last_request_at >= ? OR start_date >= ?) AND status = 'active'
-            """, (start_timestamp, start_date.strftime('%Y-%m-%d')))
-            avg_progress = cursor.fetchone()[0] or 0
-        
-        # Формируем сообщение
-        stats_text = [
-            f"<b>{title}</b>",
-            "",
-            f"👥 Всего пользователей: <b>{total_users}</b>",
-            f"🆕 Новых за период: <b>{new_users}</b>",
-            f"🟢 Активных за период: <b>{active_users}</b>",
-            f"📚 Средний прогресс: <b>{avg_progress:.1f}</b> урока",
-            "",
-            "<b>📊 По уровням:</b>"
-        ]
-        
-        for level, count in level_stats:
-            stats_text.append(f"  • {level}: <b>{count}</b> чел.")
-        
-        await callback.message.edit_text(
-            "\n".join(stats_text),
-            reply_markup=admin_kb
-        )
-        await callback.answer()
-        
-    except Exception as e:
-        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+        await daily_broadcast(bot)
+    except Exception:
+        # Как и у задачи планировщика: упавшая рассылка не останавливает бота
+        logger.exception("Catch-up broadcast failed")
+
+def start_scheduler(bot):
+    """Задачи лидера: утренняя рассылка, копия для отчётов и разбор повторов."""
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+    from analytics import refresh_snapshot_async
+    from daily_send import run_retry_loop
 
-async def download_database(callback: CallbackQuery):
-    try:
-        from aiogram.types import FSInputFile
-        
-        db_file = FSInputFile(DB_PATH, filename="users_backup.db")
-        await callback.message.answer_document(
-            db_file,
-            caption=f"📁 База данных SQLite\n📅 {utc_date_str()}"
-        )
-        await callback.answer("✅ База отправлена!")
-    except Exception as e:
-        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+    scheduler = AsyncIOScheduler(timezone="Europe/Berlin")
+    trigger = CronTrigger.from_crontab(BROADCAST_CRON, timezone="Europe/Berlin")
+    scheduler.add_job(
+        daily_broadcast,
+        trigger,
+        misfire_grace_time=86400,
+        coalesce=True,
+        id="daily_broadcast",
+        kwargs={"bot": bot},
+    )
 
-async def export_users_txt(callback: CallbackQuery):
-    try:
-        from models import get_conn
-        from aiogram.types import BufferedInputFile
-        
-        with get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT user_id, username, full_name, level, lesson_index, start_date, status 
-                FROM users ORDER BY user_id
-            """)
-            users = cursor.fetchall()
-        
-        text_lines = [
-            f"📊 Экспорт пользователей - {utc_date_str()}",
-            f"Всего: {len(users)} пользователей",
-            "",
-            "ID | Username | Имя | Уровень | Урок | Дата старта | Статус",
-            "-" * 70
-        ]
-        
-        for user in users:
-            user_id, username, full_name, level, lesson_idx, start_date, status = user
-            username_display = f"@{username}" if username else "—"
-            full_name_display = full_name if full_name else "—"
-            text_lines.append(f"{user_id} | {username_display} | {full_name_display} | {level} | {lesson_idx} | {start_date} | {status}")
-        
-        text_file = BufferedInputFile(
-            "\n".join(text_lines).encode('utf-8'),
-            filename=f"users_{utc_date_str()}.txt"
-        )
-        
-        await callback.message.answer_document(
-            text_file,
-            caption=f"📄 Экспорт в TXT\n👥 {len(users)} пользователей"
-        )
-        await callback.answer("✅ TXT файл отправлен!")
-    except Exception as e:
-        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+    scheduler.add_job(
+        refresh_snapshot_async,
+        IntervalTrigger(minutes=ANALYTICS_REFRESH_MINUTES),
+        coalesce=True,
+        max_instances=1,
+        next_run_time=datetime.now(),
+        id="analytics_snapshot",
+    )
+
+    scheduler.start()
+    logger.info(f"Scheduler started for daily lessons ({BROADCAST_CRON} Europe/Berlin)")
+    for job in scheduler.get_jobs():
+        logger.info(f"Next run for {job.id}: {job.next_run_time}")
+
+    retrier = asyncio.create_task(run_retry_loop(bot), name="retry_loop")
+    retrier.add_done_callback(fail_fast)
+    catch_up = asyncio.create_task(catch_up_broadcast(bot, trigger), name="catch_up_broadcast")
+    return scheduler, retrier, catch_up
+
+# Выставляется, если упала фоновая задача, без которой бот работать не должен
+fatal = asyncio.Event()
 
-async def export_users_csv(callback: CallbackQuery):
+
+def fail_fast(task: asyncio.Task):
+    """done-callback: ошибка в задаче не теряется молча — пишем в лог и останавливаем бота."""
+    if task.cancelled() or task.exception() is None:
+        return
+    logger.critical("Background task %s failed, stopping", task.get_name(), exc_info=task.exception())
+    fatal.set()
+
+
+async def deferred_startup(bot, tasks: list):
+    """
+    Всё, что не нужно для первого обновления: загрузка планировщика и выбор лидера,
+    который его запускает. Запускается параллельно с приёмом обновлений.
+    """
+    from leader import Leadership, make_lease
+    running = {}
+
+    async def on_elected():
+        running["scheduler"], running["retrier"], running["catch_up"] = start_scheduler(bot)
+
+    async def on_deposed():
+        # Начатая рассылка сама остановится: send_one проверяет leader.holds_lead()
+        if running:
+            running.pop("scheduler").shutdown(wait=False)
+            running.pop("retrier").cancel()
+            running.pop("catch_up").cancel()
+
+    leadership = asyncio.create_task(Leadership(make_lease(), on_elected, on_deposed).run(), name="leadership")
+    leadership.add_done_callback(fail_fast)
+    tasks.append(leadership)
+
+async def run_webhook(dp: Dispatcher, bot):
+    """Каждый экземпляр принимает обновления сам; Telegram шлёт их на общий WEBHOOK_URL."""
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+    secret = WEBHOOK_SECRET or None
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=secret,
+        allowed_updates=["message", "callback_query"],
+    )
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=WEBHOOK_PATH)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info(f"Bot started (webhook on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH})...")
     try:
-        from models import get_conn
-        from aiogram.types import BufferedInputFile
-        
-        with get_conn() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT user_id, level, lesson_index, manual_lessons_today,
-                       start_date, last_sent_lesson_at, last_request_at, status 
-                FROM users ORDER BY user_id
-            """)
-            users = cursor.fetchall()
-        
-        # CSV формат
-        csv_lines = [
-            "user_id,level,lesson_index,manual_today,start_date,last_sent,last_request,status"
-        ]
-        
-        for user in users:
-            csv_lines.append(",".join([str(field) if field is not None else "" for field in user]))
-        
-        csv_content = "\n".join(csv_lines)
-        csv_file = BufferedInputFile(
-            csv_content.encode('utf-8'),
-            filename=f"users_export_{utc_date_str()}.csv"
-        )
-        
-        await callback.message.answer_document(
-            csv_file,
-            caption=f"📊 Экспорт в CSV\n👥 {len(users)} пользователей\n💡 Можно открыть в Excel"
-        )
-        await callback.answer("✅ CSV файл отправлен!")
-    except Exception as e:
-        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
 
 # -------- Main --------
 
+async def activity_middleware(handler, event, data):
+    """
+    Любое сообщение или нажатие — активность для частоты рассылки (db.touch_activity),
+    а не только уроки и /start. После обработчика: /start сначала регистрирует пользователя.
+    """
+    try:
+        return await handler(event, data)
+    finally:
+        user = data.get("event_from_user")
+        if user is not None:
+            try:
+                await db.touch_activity(user.id)
+            except Exception as e:
+                logger.warning("Activity touch failed user %s: %s", user.id, e)
+
+
+async def serve(dp: Dispatcher, bot):
+    if WEBHOOK_URL:
+        await run_webhook(dp, bot)
+    else:
+        logger.info("Bot started (polling)...")
+        await dp.start_polling(bot, allowed_updates=["message", "callback_query"])
+
+
 async def main():
-    init_db()
+    await db.open()
+    # До приёма обновлений: без level_totals claim_manual_lesson отказывает всем
+    # («лимит на сегодня»). Обычно ничего не пишет — числа уроков не изменились.
+    await db.sync_level_totals({lvl: lesson_mgr.total(lvl) for lvl in lesson_mgr.data})
     dp = Dispatcher()
+    dp.message.outer_middleware(activity_middleware)
+    dp.callback_query.outer_middleware(activity_middleware)
 
     dp.message.register(cmd_start, Command("start"))
     dp.callback_query.register(set_level_callback_handler, F.data.startswith("set_level:"))
@@ -514,33 +560,46 @@ async def main():
     
     dp.message.register(next_lesson_handler, F.text == "📘 Следующий урок")
     dp.message.register(repeat_all_handler, F.text == "🔁 Повторить все")
+    if LOCAL_FEATURES:
+        dp.message.register(srs_review_handler, F.text == "🧠 Повторение")
+        dp.callback_query.register(srs_callback_handler, F.data.startswith("srs:"))
+        dp.message.register(quiz_handler, F.text == "🎯 Квиз")
+        dp.callback_query.register(quiz_callback_handler, F.data.startswith("quiz:"))
     dp.message.register(cmd_progress, F.text == "📈 Прогресс")
     dp.message.register(restart_from_first_handler, F.text == "🏁 Начать с первого урока")
     dp.message.register(delete_my_data_handler, F.text == "🗑️ Удалить мои данные")
     dp.message.register(fallback)
 
-    bot = Bot(
-        BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
-
-    # вместо CronTrigger импортируем IntervalTrigger
-    scheduler = AsyncIOScheduler(timezone="Europe/Berlin")
-    scheduler.add_job(
-        broadcast,
-        CronTrigger(hour=8, minute=0, timezone="Europe/Berlin"),
-        misfire_grace_time=86400,
-        coalesce=True,
-        id="daily_broadcast"
-    )
+    # Один Bot (и один HTTP-пул) и для polling, и для утренней рассылки
+    bot = create_bot()
 
-    scheduler.start()
-    logger.info("Scheduler started for daily lessons at 08:00 Europe/Berlin")
-    for job in scheduler.get_jobs():
-        logger.info(f"Next run for {job.id}: {job.next_run_time}")
+    tasks = [
+        asyncio.create_task(answer_buffer.run_flusher()),
+        asyncio.create_task(event_log.run_flusher()),
+        asyncio.create_task(run_stats_logger()),
+    ]
+    startup = asyncio.create_task(deferred_startup(bot, tasks), name="deferred_startup")
+    startup.add_done_callback(fail_fast)
+    tasks.append(startup)
 
-    logger.info("Bot started (polling)...")
-    await dp.start_polling(bot, allowed_updates=["message", "callback_query"])
+    server = asyncio.create_task(serve(dp, bot), name="serve")
+    stop = asyncio.create_task(fatal.wait())
+    try:
+        await asyncio.wait({server, stop}, return_when=asyncio.FIRST_COMPLETED)
+        if fatal.is_set():
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+            raise SystemExit(1)
+        await server
+    finally:
+        stop.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        answer_buffer.flush()
+        event_log.flush()
+        log_stats()
+        await db.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,192 @@
+"""
+Отчёт о каждом запуске утренней рассылки (таблица broadcast_runs, создаётся в models.init_db).
+
+Рассылка передаёт BroadcastReport в send_one, тот отмечает исход каждой отправки.
+В конце отчёт сохраняется в базу и одним сообщением уходит в ADMIN_IDS;
+история запусков — кнопка «📜 Рассылки» в /admin.
+
+Повторы из send_retries разбираются уже после отчёта; их исходы дописываются
+к последнему запуску (record_retry_outcome) и видны в истории.
+"""
+import heapq
+import json
+import statistics
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+from models import get_conn
+
+SENT = "sent"
+BLOCKED = "blocked"
+RETRIED = "retried"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+OUTCOME_NAMES = {SENT: "✅ отправлено", BLOCKED: "🚫 заблокировали", RETRIED: "🔁 в повторы",
+                 FAILED: "❌ ошибка", SKIPPED: "⏭ пропущено"}
+
+# Куда record_retry_outcome складывает исход повтора (RETRIED — снова отложен)
+RETRY_COLUMNS = {SENT: "retry_sent", BLOCKED: "retry_blocked", RETRIED: "retry_requeued", FAILED: "retry_failed"}
+
+# Ширина интервала графика скорости, секунды
+BUCKET_SECONDS = 10
+SLOWEST_KEEP = 5
+_SPARK = "▁▂▃▄▅▆▇█"
+
+
+class BroadcastReport:
+    def __init__(self, owner: str = ""):
+        self.owner = owner
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.outcomes: Counter = Counter()
+        self.levels: Dict[str, Counter] = defaultdict(Counter)
+        self.buckets: Counter = Counter()
+        self.retry_after_total = 0.0
+        # min-heap (latency, user_id, outcome) — держим только SLOWEST_KEEP самых долгих;
+        # latency — время вызовов API без ожидания очереди (http_session.api_time)
+        self._slowest: List[Tuple[float, int, str]] = []
+
+    def record(self, user_id: int, level: str, outcome: str, latency: float = 0.0):
+        self.outcomes[outcome] += 1
+        self.levels[level][outcome] += 1
+        if outcome == SENT:
+            self.buckets[int((time.time() - self.started_at) // BUCKET_SECONDS)] += 1
+        if latency:
+            item = (latency, user_id, outcome)
+            if len(self._slowest) < SLOWEST_KEEP:
+                heapq.heappush(self._slowest, item)
+            elif item > self._slowest[0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def record_pause(self, seconds: float):
+        """Сколько секунд за запуск отправка стояла на паузе по 429 (outbound.PriorityLimiter.paused_total)."""
+        self.retry_after_total += seconds
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Средняя скорость успешных отправок, сообщений в секунду."""
+        return self.outcomes[SENT] / self.duration if self.duration > 0 else 0.0
+
+    def timeline(self) -> List[float]:
+        """Сообщений в секунду по интервалам BUCKET_SECONDS от начала рассылки."""
+        if not self.buckets:
+            return []
+        return [self.buckets[i] / BUCKET_SECONDS for i in range(max(self.buckets) + 1)]
+
+    def to_dict(self) -> dict:
+        return {
+            "owner": self.owner,
+            "started_at": int(self.started_at),
+            "duration": round(self.duration, 1),
+            "outcomes": dict(self.outcomes),
+            "levels": {lvl: dict(c) for lvl, c in self.levels.items()},
+            "timeline": [round(x, 2) for x in self.timeline()],
+            "rate": round(self.rate, 2),
+            "slowest": [
+                {"ms": round(lat * 1000), "user_id": uid, "outcome": outcome}
+                for lat, uid, outcome in sorted(self._slowest, reverse=True)
+            ],
+            "retry_after_total": round(self.retry_after_total, 1),
+        }
+
+
+def sparkline(values: List[float]) -> str:
+    if not values:
+        return ""
+    top = max(values) or 1
+    return "".join(_SPARK[min(len(_SPARK) - 1, int(v / top * (len(_SPARK) - 1)))] for v in values)
+
+
+def report_text(r: dict) -> str:
+    o = r["outcomes"]
+    lines = [
+        f"<b>🌅 Рассылка {time.strftime('%d.%m %H:%M', time.localtime(r['started_at']))}</b>",
+        f"⏱ {r['duration']:.0f} с, в среднем {r['rate']:.1f} сообщ./с",
+    ]
+    lines += [f"{name}: <b>{o.get(key, 0)}</b>" for key, name in OUTCOME_NAMES.items() if o.get(key)]
+    if r["retry_after_total"]:
+        lines.append(f"⏳ Ожидание по 429: {r['retry_after_total']:.0f} с")
+    if r["levels"]:
+        lines.append("")
+        lines.append("<b>По уровням:</b>")
+        for level, counts in sorted(r["levels"].items()):
+            parts = " ".join(f"{OUTCOME_NAMES.get(k, k).split()[0]}{v}" for k, v in counts.items())
+            lines.append(f"  • {level}: {parts}")
+    if r["timeline"]:
+        lines.append("")
+        lines.append(f"📈 Скорость по {BUCKET_SECONDS} с: <code>{sparkline(r['timeline'])}</code> "
+                     f"(пик {max(r['timeline']):.1f}/с)")
+    if r["slowest"]:
+        lines.append("🐢 Самые долгие: " + ", ".join(f"{s['ms']} мс (#{s['user_id']})" for s in r["slowest"]))
+    return "\n".join(lines)
+
+
+def save_report(report: BroadcastReport) -> int:
+    data = report.to_dict()
+    o = data["outcomes"]
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO broadcast_runs
+                (started_at, duration, owner, sent, blocked, retried, failed, rate, report)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            data["started_at"], data["duration"], data["owner"], o.get(SENT, 0), o.get(BLOCKED, 0),
+            o.get(RETRIED, 0), o.get(FAILED, 0), data["rate"], json.dumps(data, ensure_ascii=False),
+        ))
+        conn.commit()
+        return c.lastrowid
+
+
+def record_retry_outcome(outcome: str):
+    """
+    Исход отправки из очереди повторов — к последнему запуску: повторы появляются
+    во время рассылки и разбираются до следующей. SKIPPED не учитывается.
+    """
+    col = RETRY_COLUMNS.get(outcome)
+    if col is None:
+        return
+    with get_conn() as conn:
+        conn.execute(f"UPDATE broadcast_runs SET {col} = {col} + 1 WHERE id = (SELECT MAX(id) FROM broadcast_runs)")
+        conn.commit()
+
+
+def recent_runs(limit: int = 10) -> List[Tuple]:
+    """
+    (started_at, duration, sent, blocked, retried, failed, rate,
+    retry_sent, retry_blocked, retry_requeued, retry_failed) последних запусков, новые первыми.
+    """
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT started_at, duration, sent, blocked, retried, failed, rate,
+                   retry_sent, retry_blocked, retry_requeued, retry_failed
+            FROM broadcast_runs ORDER BY id DESC LIMIT ?
+        """, (limit,)).fetchall()
+
+
+def history_text(limit: int = 10) -> str:
+    runs = recent_runs(limit)
+    if not runs:
+        return "<b>📜 Рассылки</b>\n\nЗапусков ещё не было."
+    lines = ["<b>📜 Последние рассылки</b>", ""]
+    for i, (started_at, duration, sent, blocked, retried, failed, rate, *retry) in enumerate(runs):
+        # Скорость заметно ниже медианы предыдущих запусков — повод разобраться
+        older = [r[6] for r in runs[i + 1:] if r[2]]
+        slow = sent and older and rate < 0.8 * statistics.median(older)
+        line = (
+            f"{'⚠️' if slow else '•'} {time.strftime('%d.%m %H:%M', time.localtime(started_at))}: "
+            f"✅{sent} 🚫{blocked} 🔁{retried} ❌{failed}, {duration:.0f} с, <b>{rate:.1f}</b>/с"
+        )
+        if any(retry):
+            r_sent, r_blocked, r_requeued, r_failed = retry
+            line += f"; повторы: ✅{r_sent} 🚫{r_blocked} 🔁{r_requeued} ❌{r_failed}"
+        lines.append(line)
+    return "\n".join(lines)
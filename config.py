@@ -4,14 +4,82 @@ from dotenv import load_dotenv
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Адрес своего Bot API сервера, напр. http://localhost:8081 (local bot-api или фейк для
+# бенчмарков); пусто — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
 TIMEZONE = os.getenv("TIMEZONE", "UTC")
 AUTOSEND_HOUR = int(os.getenv("AUTOSEND_HOUR", 6))
 MAX_MANUAL_PER_DAY = int(os.getenv("MAX_MANUAL_PER_DAY", 2))
 NEW_LESSON_COOLDOWN = int(os.getenv("NEW_LESSON_COOLDOWN", 30))
 DEFAULT_LEVEL = os.getenv("DEFAULT_LEVEL", "A1")
 LESSONS_FILE = os.getenv("LESSONS_FILE", "lessons.json")
+# Результат `python lessons_cli.py build`: готовые тексты уроков + метаданные
+COMPILED_LESSONS_FILE = os.getenv("COMPILED_LESSONS_FILE", "lessons.compiled.json")
 LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_JSON = os.getenv("LOG_JSON", "1") == "1"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_DEDUP_WINDOW = float(os.getenv("LOG_DEDUP_WINDOW", 60))
+LOG_DEDUP_BURST = int(os.getenv("LOG_DEDUP_BURST", 5))
+# Раз в столько секунд в лог пишутся выброшенные/скрытые записи (см. logging_conf.log_stats)
+LOG_STATS_INTERVAL = float(os.getenv("LOG_STATS_INTERVAL", 300))
 DB_PATH = os.getenv("DB_PATH", "/data/users.db")
+# Копия базы для админской статистики и выгрузок, обновляется раз в N минут
+ANALYTICS_DB_PATH = os.getenv("ANALYTICS_DB_PATH", DB_PATH + ".analytics")
+ANALYTICS_REFRESH_MINUTES = int(os.getenv("ANALYTICS_REFRESH_MINUTES", 10))
+# Закрытый чат/канал, куда бот выкладывает каждый урок один раз, а пользователям
+# рассылает copyMessage. 0 — режим выключен, каждому уходит полный текст.
+FANOUT_CHAT_ID = int(os.getenv("FANOUT_CHAT_ID", 0))
+# Сколько отправок рассылки идёт параллельно; под это число подстраивается HTTP-пул
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", 25))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 20))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", 60))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 600))
+# Рассылка читает пользователей страницами по столько id (keyset по user_id)
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", 1000))
+# Общий лимит исходящих запросов к Bot API (в секунду) и допустимый всплеск
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", 28))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", 5))
+# Повторы неудачных отправок (секунды)
+RETRY_BASE_DELAY = int(os.getenv("RETRY_BASE_DELAY", 30))
+RETRY_MAX_DELAY = int(os.getenv("RETRY_MAX_DELAY", 6 * 3600))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 8))
+RETRY_POLL_INTERVAL = float(os.getenv("RETRY_POLL_INTERVAL", 30))
+RETRY_BATCH = int(os.getenv("RETRY_BATCH", 50))
+# Частота рассылки по давности последнего нажатия (в днях)
+TIER_DAILY_DAYS = int(os.getenv("TIER_DAILY_DAYS", 14))
+TIER_WEEKLY_DAYS = int(os.getenv("TIER_WEEKLY_DAYS", 60))
+# Активность (last_active_at) пишется не чаще раза в столько секунд на пользователя
+ACTIVITY_TOUCH_SECONDS = int(os.getenv("ACTIVITY_TOUCH_SECONDS", 3600))
+# Ответы квиза пишутся в БД пачками: по размеру буфера или по таймеру (сек)
+QUIZ_FLUSH_SIZE = int(os.getenv("QUIZ_FLUSH_SIZE", 200))
+QUIZ_FLUSH_INTERVAL = float(os.getenv("QUIZ_FLUSH_INTERVAL", 5))
+# Журнал событий пользователей: групповая запись пачками
+EVENTS_FLUSH_SIZE = int(os.getenv("EVENTS_FLUSH_SIZE", 500))
+EVENTS_FLUSH_INTERVAL = float(os.getenv("EVENTS_FLUSH_INTERVAL", 2))
+
+# Хранилище пользователей: sqlite (файл DB_PATH) или postgres (DATABASE_URL, нужен asyncpg)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", 2))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", 10))
+# Повторение (srs_cards), квиз (user_errors), отчёты и выгрузки админки, журнал events.py
+# читают локальный SQLite. С postgres он у каждого экземпляра свой, поэтому они отключены
+LOCAL_FEATURES = STORAGE_BACKEND == "sqlite"
+
+# Webhook вместо polling (нужен для нескольких экземпляров): публичный адрес и где слушать
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Утренняя рассылка, crontab по Europe/Berlin
+BROADCAST_CRON = os.getenv("BROADCAST_CRON", "0 8 * * *")
+# Планировщик работает только у экземпляра-лидера: аренда в базе (db) или flock на файле (file, один хост)
+LEADER_LOCK = os.getenv("LEADER_LOCK", "db")
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", DB_PATH + ".leader")
+LEADER_LEASE_TTL = int(os.getenv("LEADER_LEASE_TTL", 30))
+LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", 10))
+INSTANCE_ID = os.getenv("INSTANCE_ID", "")
 
 # ADMIN_IDS = set целых чисел
 _admin_raw = os.getenv("ADMIN_IDS", "").strip()
@@ -1,58 +1,315 @@
 import asyncio
 import logging
-import time
+from collections import Counter
 from aiogram import Bot
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramNetworkError, TelegramAPIError
-from config import BOT_TOKEN
-from models import get_active_users, get_user, increment_lesson, set_last_sent, mark_blocked
-from lesson_manager import LessonManager
+from aiogram.exceptions import (
+    TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter, TelegramNetworkError, TelegramAPIError,
+)
+from config import BOT_TOKEN, ADMIN_IDS, FANOUT_CHAT_ID, SEND_CONCURRENCY, RETRY_POLL_INTERVAL, RETRY_BATCH, BROADCAST_BATCH
+from models import estimate_daily_savings, event_log, today_day
+from storage import get_storage
+from lesson_manager import get_lesson_manager
+from srs import add_lesson_cards, due_counts
+from http_session import create_bot, pool_stats_text, api_time
+from retry_queue import schedule_retry, clear_retry, fetch_due_retries
+from outbound import request_priority, outbound_limiter, ADMIN, BROADCAST, RETRY
+from leader import holds_lead, instance_id, fence, LeaseLost
+from broadcast_report import (
+    BroadcastReport, report_text, save_report, record_retry_outcome, SENT, BLOCKED, RETRIED, FAILED, SKIPPED,
+)
 
 logger = logging.getLogger(__name__)
-lesson_mgr = LessonManager()
+lesson_mgr = get_lesson_manager()
+db = get_storage()
 
-async def send_one(bot: Bot, user_id: int):
-    row = get_user(user_id)
+# Пока идёт основная рассылка, фоновые повторы ждут и не отнимают лимит
+broadcast_active = False
+
+# Ошибки BadRequest, после которых писать пользователю бессмысленно
+UNREACHABLE_MARKERS = ("chat not found", "user is deactivated", "bot was blocked", "peer_id_invalid")
+
+
+def is_unreachable(e: TelegramAPIError) -> bool:
+    msg = str(e).lower()
+    return any(m in msg for m in UNREACHABLE_MARKERS)
+
+
+async def mark_delivered(user_id: int, level: str, lesson_index: int):
+    # Прогресс, время отправки и следующий день рассылки — одной записью, и только пока
+    # аренда наша: иначе этого пользователя уже ведёт новый лидер
+    if not await db.mark_sent(user_id, fence=fence()):
+        raise LeaseLost(f"lease lost before marking user {user_id}")
+    # Карточки — только после принятой записи, чтобы не завести их за урок, который засчитает другой лидер
+    add_lesson_cards(user_id, level, lesson_index, lesson_mgr.get_lesson_obj(level, lesson_index))
+
+
+# Сколько раз за рассылку пробуем выложить один урок в FANOUT_CHAT_ID
+STAGE_ATTEMPTS = 3
+
+
+class FanoutStaging:
+    """Уроки, выложенные в FANOUT_CHAT_ID за одну рассылку: (level, index) -> задача send_message."""
+
+    def __init__(self):
+        self.tasks: dict[tuple, asyncio.Future] = {}
+        self.failures: Counter = Counter()
+
+
+async def stage_lesson(bot: Bot, key: tuple, text: str, staged: FanoutStaging) -> int | None:
+    """
+    Выкладывает урок в FANOUT_CHAT_ID один раз за рассылку и возвращает message_id.
+    Параллельные send_one с тем же (level, index) ждут одну и ту же задачу.
+    Неудачная задача из кэша убирается, и следующий пользователь пробует снова
+    (например, после 429); после STAGE_ATTEMPTS неудач урок идёт обычным send_message.
+    """
+    task = staged.tasks.get(key)
+    if task is None:
+        if staged.failures[key] >= STAGE_ATTEMPTS:
+            return None
+        task = asyncio.ensure_future(bot.send_message(FANOUT_CHAT_ID, text))
+        staged.tasks[key] = task
+    try:
+        return (await task).message_id
+    except Exception as e:
+        if staged.tasks.get(key) is task:
+            del staged.tasks[key]
+            staged.failures[key] += 1
+        logger.warning("Fan-out staging failed for %s: %s", key, e)
+        return None
+
+
+async def deliver(bot: Bot, user_id: int, text: str, key: tuple, staged: FanoutStaging | None):
+    """copyMessage из чата-склада, если включён fan-out; при ошибке — обычный send_message."""
+    if staged is not None:
+        message_id = await stage_lesson(bot, key, text, staged)
+        if message_id is not None:
+            try:
+                await bot.copy_message(user_id, FANOUT_CHAT_ID, message_id)
+                return
+            except (TelegramForbiddenError, TelegramRetryAfter):
+                raise
+            except TelegramBadRequest as e:
+                if is_unreachable(e):
+                    raise
+                logger.warning("copyMessage failed user %s, fallback: %s", user_id, e)
+            except (TelegramNetworkError, TelegramAPIError) as e:
+                logger.warning("copyMessage failed user %s, fallback: %s", user_id, e)
+    await bot.send_message(user_id, text)
+
+
+async def send_one(bot: Bot, user_id: int, due_cards: int = 0, staged: FanoutStaging | None = None,
+                   is_retry: bool = False, report: BroadcastReport | None = None) -> str:
+    """
+    Отправляет текущий урок. Временные ошибки (429, сеть, 5xx) не ждутся здесь,
+    а уходят в send_retries; остальное — как раньше. Возвращает исход (broadcast_report.SENT, ...)
+    и, если передан report, записывает его туда.
+    """
+    row = await db.get_user(user_id)
     if not row:
-        return
+        return SKIPPED
     _, level, lesson_index, *_ = row
     total = lesson_mgr.total(level)
     if lesson_index >= total:
         # можно время от времени напоминать
-        return
-    text = lesson_mgr.current_or_end(level, lesson_index)
+        return SKIPPED
+    text = "🌅 Утренний урок\n\n" + lesson_mgr.current_or_end(level, lesson_index)
+    # В режиме fan-out текст должен совпадать у всех на этом уроке, поэтому без подсказки
+    if due_cards and staged is None:
+        text += f"\n\n🧠 К повторению сегодня: <b>{due_cards}</b> карточек — кнопка «🧠 Повторение»."
+    log_ctx = {"user_id": user_id, "handler": "send_one"}
+    # Задержка — только сами вызовы API (http_session.api_time), без очереди лимитера и пауз 429
+    api_time.set(0.0)
+    latency = 0.0
     try:
-        await bot.send_message(user_id, "🌅 Утренний урок\n\n" + text)
-        increment_lesson(user_id)
-        set_last_sent(user_id, int(time.time()))
+        await deliver(bot, user_id, text, (level, lesson_index), staged)
+        latency = api_time.get()
+        await mark_delivered(user_id, level, lesson_index)
+        outcome = SENT
+        if is_retry:
+            clear_retry(user_id)
     except TelegramForbiddenError:
-        mark_blocked(user_id)
+        outcome = BLOCKED
+        await db.mark_blocked(user_id)
+        if is_retry:
+            clear_retry(user_id)
     except TelegramRetryAfter as e:
-        await asyncio.sleep(e.retry_after + 1)
-        try:
-            await bot.send_message(user_id, "🌅 Утренний урок\n\n" + text)
-            increment_lesson(user_id)
-            set_last_sent(user_id, int(time.time()))
-        except TelegramForbiddenError:
-            mark_blocked(user_id)
-        except Exception as ex:
-            logger.error(f"Retry failed user {user_id}: {ex}")
+        # Все отправки уже на паузе (outbound.priority_middleware -> PriorityLimiter.pause),
+        # здесь только переносим этого пользователя в повторы
+        outcome = RETRIED
+        schedule_retry(user_id, level, lesson_index, str(e), min_delay=e.retry_after + 1)
+    except TelegramBadRequest as e:
+        if is_retry:
+            clear_retry(user_id)
+        if is_unreachable(e):
+            outcome = BLOCKED
+            await db.mark_blocked(user_id)
+        else:
+            outcome = FAILED
+            latency = api_time.get()
+            log_ctx["latency"] = round(latency, 3)
+            logger.error("Bad request user %s: %s", user_id, e, extra=log_ctx)
     except (TelegramNetworkError, TelegramAPIError) as e:
-        logger.error(f"Network/API error user {user_id}: {e}")
+        outcome = RETRIED
+        latency = api_time.get()
+        log_ctx["latency"] = round(latency, 3)
+        logger.error("Network/API error user %s: %s", user_id, e, extra=log_ctx)
+        schedule_retry(user_id, level, lesson_index, str(e))
+    if report is not None:
+        report.record(user_id, level, outcome, latency)
+    if is_retry:
+        try:
+            record_retry_outcome(outcome)
+        except Exception as e:
+            logger.error("Retry outcome save failed: %s", e)
+    return outcome
+
+
+async def run_retry_loop(bot: Bot):
+    """
+    Фоновый разбор send_retries. Низкий приоритет: во время основной рассылки
+    не работает, а сам шлёт по одному сообщению, уступая event loop между ними.
+    """
+    request_priority.set(RETRY)
+    while True:
+        await asyncio.sleep(RETRY_POLL_INTERVAL)
+        if broadcast_active:
+            continue
+        try:
+            due = fetch_due_retries(RETRY_BATCH)
+        except Exception as e:
+            logger.error("Retry queue read failed: %s", e)
+            continue
+        for user_id, level, lesson_index, _attempts in due:
+            if broadcast_active:
+                break
+            try:
+                row = await db.get_user(user_id)
+                # Пользователь уже получил этот урок иначе, сменил уровень или пропал — повтор не нужен
+                if not row or row[7] != "active" or (row[1], row[2]) != (level, lesson_index):
+                    clear_retry(user_id)
+                    continue
+                # SKIPPED — урока с этим индексом больше нет (lessons.json стал короче):
+                # иначе запись выбиралась бы каждые RETRY_POLL_INTERVAL вечно
+                if await send_one(bot, user_id, is_retry=True) == SKIPPED:
+                    clear_retry(user_id)
+            except LeaseLost as e:
+                # Повторы теперь разбирает новый лидер
+                logger.warning("Retry loop paused: %s", e)
+                break
+            except Exception as e:
+                # Ошибка базы (например, "database is locked") не должна останавливать цикл
+                logger.error("Retry send failed user %s: %s", user_id, e)
+            await asyncio.sleep(0)
 
-async def broadcast():
-    if not BOT_TOKEN:
+async def publish_report(bot: Bot, report: BroadcastReport):
+    """Сохраняет отчёт о запуске и отправляет его админам одним сообщением."""
+    data = report.to_dict()
+    try:
+        save_report(report)
+    except Exception as e:
+        logger.error("Broadcast report save failed: %s", e)
+    text = report_text(data)
+    request_priority.set(ADMIN)
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(admin_id, text)
+        except TelegramAPIError as e:
+            logger.warning("Broadcast report to admin %s failed: %s", admin_id, e)
+
+
+async def broadcast(bot: Bot | None = None):
+    """
+    Утренняя рассылка. В bot.py сюда передаётся Bot polling-а, чтобы переиспользовать
+    его HTTP-пул; если bot не передан (запуск скриптом), создаётся свой и закрывается.
+    """
+    global broadcast_active
+    if bot is None and not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN не задан")
-    bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    user_ids = get_active_users()
-    if not user_ids:
+    # Все запросы рассылки (и задачи, созданные ниже) пропускают вперёд ответы пользователям
+    request_priority.set(BROADCAST)
+    # Пересчитываем eligible на случай, если lessons.json поменялся
+    await db.sync_level_totals({lvl: lesson_mgr.total(lvl) for lvl in lesson_mgr.data})
+    await db.update_engagement_tiers()
+    tier_counts = await db.get_tier_counts()
+    day = today_day()
+    logger.info(
+        "Broadcast: tiers %s, saved ~%.0f sends/day",
+        dict(tier_counts), estimate_daily_savings(tier_counts),
+    )
+    if not await db.due_users_page(0, day, 1):
         return
-    tasks = [send_one(bot, uid) for uid in user_ids]
-    await asyncio.gather(*tasks)
-    await bot.session.close()
+    own_bot = bot is None
+    if own_bot:
+        bot = create_bot()
+    staged = FanoutStaging() if FANOUT_CHAT_ID else None
+    # Пользователи идут страницами через ограниченную очередь: память не растёт с числом
+    # подписчиков, а отправляют SEND_CONCURRENCY воркеров — столько же соединений в пуле
+    queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_CONCURRENCY * 2)
+    report = BroadcastReport(owner=instance_id())
+    # Паузы по 429 считает лимитер по реальному времени: один флуд-лимит,
+    # пойманный всеми воркерами сразу, — одна пауза, а не SEND_CONCURRENCY
+    paused_before = outbound_limiter.paused_total
+    # База отклонила запись прогресса (mark_delivered): аренда ушла раньше, чем это заметил holds_lead
+    lease_lost = asyncio.Event()
+
+    def leading() -> bool:
+        return holds_lead() and not lease_lost.is_set()
+
+    async def stop_consumers():
+        for _ in range(SEND_CONCURRENCY):
+            await queue.put(None)
+
+    async def produce():
+        try:
+            async for page in db.iter_due_users(day, BROADCAST_BATCH):
+                # Аренду забрал другой экземпляр — не шлём параллельно с ним
+                if not leading():
+                    break
+                cards = due_counts(page)
+                for uid in page:
+                    await queue.put((uid, cards.get(uid, 0)))
+        except Exception:
+            await stop_consumers()
+            raise
+        await stop_consumers()
+
+    async def consume():
+        while (item := await queue.get()) is not None:
+            uid, due_cards = item
+            if not leading():
+                continue
+            try:
+                await send_one(bot, uid, due_cards, staged, report=report)
+            except LeaseLost as e:
+                if not lease_lost.is_set():
+                    logger.warning("Broadcast stopped: %s", e)
+                lease_lost.set()
+            except Exception as e:
+                logger.error("Broadcast send failed user %s: %s", uid, e)
+                report.record(uid, "?", FAILED)
+
+    broadcast_active = True
+    try:
+        await asyncio.gather(produce(), *(consume() for _ in range(SEND_CONCURRENCY)))
+        report.finish()
+        report.record_pause(outbound_limiter.paused_total - paused_before)
+        logger.info("Broadcast finished: %s. %s", dict(report.outcomes), pool_stats_text(bot).replace("\n", "; "))
+        await publish_report(bot, report)
+    finally:
+        broadcast_active = False
+        if own_bot:
+            await bot.session.close()
 
 if __name__ == "__main__":
     from logging_conf import setup_logging
     setup_logging()
-    asyncio.run(broadcast())
+
+    async def _run_once():
+        await db.open()
+        try:
+            await broadcast()
+        finally:
+            await db.close()
+
+    asyncio.run(_run_once())
+    event_log.flush()
@@ -0,0 +1,186 @@
+"""
+Чтение журнала events: восстановление состояния пользователей и статистика.
+
+    python events.py verify            — пересобрать users из журнала и сравнить с живой таблицей
+    python events.py rebuild OUT.db    — записать восстановленную таблицу users в отдельную базу
+    python events.py stats [DAYS]      — события по дням (инкрементальная проекция)
+
+Журнал — аудит рядом с users, а не источник записи. События одного пользователя
+применяются в порядке seq (см. models.stamp_events), а не id: id раздаются в
+момент записи пачки, и у нескольких экземпляров бота пачки пишутся в разное время.
+
+Читает локальный SQLite; с STORAGE_BACKEND=postgres журнал лежит в таблице events
+общей базы, и команды отказываются работать.
+"""
+import sqlite3
+import sys
+from typing import Dict, Iterator, List, Tuple
+from config import DEFAULT_LEVEL, LOCAL_FEATURES
+from models import (
+    get_conn, event_log,
+    EV_REGISTER, EV_SET_LEVEL, EV_RESET, EV_LESSON, EV_BLOCKED, EV_REACTIVATED,
+    EV_DELETED, EV_MANUAL, EV_REQUEST, EV_SENT, EV_SNAPSHOT,
+)
+
+EVENT_NAMES = {
+    EV_REGISTER: "register", EV_SET_LEVEL: "set_level", EV_RESET: "reset", EV_LESSON: "lesson",
+    EV_BLOCKED: "blocked", EV_REACTIVATED: "reactivated", EV_DELETED: "deleted",
+    EV_MANUAL: "manual", EV_REQUEST: "request", EV_SENT: "sent", EV_SNAPSHOT: "snapshot",
+}
+
+# Поля users, которые однозначно восстанавливаются из журнала
+PROJECTED_FIELDS = ("level", "lesson_index", "status", "start_date", "last_sent_lesson_at", "last_request_at")
+
+
+def iter_user_events() -> Iterator[Tuple]:
+    """(ts, user_id, type, payload) по пользователям, у каждого — по возрастанию seq. Одним курсором."""
+    conn = get_conn()
+    try:
+        yield from conn.execute(
+            "SELECT ts, user_id, type, payload FROM events WHERE user_id IS NOT NULL ORDER BY user_id, seq, id"
+        )
+    finally:
+        conn.close()
+
+
+def apply_event(state: Dict[int, dict], ts: int, user_id: int, ev_type: int, payload):
+    """Применяет одно событие к состоянию {user_id: поля users}."""
+    if user_id is None:
+        return
+    if ev_type == EV_REGISTER:
+        state[user_id] = {
+            "level": DEFAULT_LEVEL, "lesson_index": 0, "status": "active", "start_date": payload,
+            "last_sent_lesson_at": None, "last_request_at": None,
+        }
+        return
+    if ev_type == EV_SNAPSHOT:
+        level, idx, status, start_date, last_sent, last_req = payload.split("|")
+        state[user_id] = {
+            "level": level, "lesson_index": int(idx), "status": status, "start_date": start_date or None,
+            "last_sent_lesson_at": int(last_sent) if last_sent else None,
+            "last_request_at": int(last_req) if last_req else None,
+        }
+        return
+    u = state.get(user_id)
+    if u is None:
+        return
+    if ev_type == EV_SET_LEVEL:
+        u["level"] = payload
+        u["lesson_index"] = 0
+    elif ev_type == EV_RESET:
+        u["lesson_index"] = 0
+    elif ev_type == EV_LESSON:
+        u["lesson_index"] += 1
+    elif ev_type == EV_BLOCKED:
+        u["status"] = "blocked"
+    elif ev_type == EV_REACTIVATED:
+        u["status"] = "active"
+    elif ev_type == EV_SENT:
+        u["last_sent_lesson_at"] = ts
+    elif ev_type == EV_REQUEST:
+        u["last_request_at"] = ts
+
+
+def replay() -> Dict[int, dict]:
+    event_log.flush()
+    state: Dict[int, dict] = {}
+    for ts, user_id, ev_type, payload in iter_user_events():
+        apply_event(state, ts, user_id, ev_type, payload)
+    return state
+
+
+def verify() -> List[str]:
+    """Расхождения между журналом и живой таблицей users (пусто — совпадает)."""
+    state = replay()
+    cols = ", ".join(PROJECTED_FIELDS)
+    with get_conn() as conn:
+        live = {r[0]: dict(zip(PROJECTED_FIELDS, r[1:])) for r in conn.execute(f"SELECT user_id, {cols} FROM users")}
+    diffs = []
+    for user_id in sorted(set(state) | set(live)):
+        if state.get(user_id) != live.get(user_id):
+            diffs.append(f"{user_id}: журнал={state.get(user_id)} users={live.get(user_id)}")
+    return diffs
+
+
+def rebuild(out_path: str) -> int:
+    state = replay()
+    cols = ", ".join(PROJECTED_FIELDS)
+    dst = sqlite3.connect(out_path)
+    try:
+        dst.execute("DROP TABLE IF EXISTS users")
+        dst.execute(f"CREATE TABLE users (user_id INTEGER PRIMARY KEY, {cols})")
+        dst.executemany(
+            f"INSERT INTO users (user_id, {cols}) VALUES (?{', ?' * len(PROJECTED_FIELDS)})",
+            [(uid, *(u[f] for f in PROJECTED_FIELDS)) for uid, u in state.items()]
+        )
+        dst.commit()
+    finally:
+        dst.close()
+    return len(state)
+
+
+def update_daily_stats() -> int:
+    """
+    Инкрементальная проекция: дописывает в event_daily_stats счётчики по дням и типам
+    только для событий после последнего обработанного id. Возвращает число новых событий.
+    """
+    event_log.flush()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS event_daily_stats (
+                day TEXT, type INTEGER, count INTEGER,
+                PRIMARY KEY (day, type)
+            )
+        """)
+        c.execute("CREATE TABLE IF NOT EXISTS event_projection (name TEXT PRIMARY KEY, last_id INTEGER)")
+        row = c.execute("SELECT last_id FROM event_projection WHERE name='daily_stats'").fetchone()
+        last_id = row[0] if row else 0
+        max_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        if max_id <= last_id:
+            return 0
+        c.execute("""
+            INSERT INTO event_daily_stats (day, type, count)
+            SELECT date(ts, 'unixepoch'), type, COUNT(*) FROM events
+            WHERE id > ? AND id <= ?
+            GROUP BY 1, 2
+            ON CONFLICT(day, type) DO UPDATE SET count = count + excluded.count
+        """, (last_id, max_id))
+        c.execute(
+            "INSERT OR REPLACE INTO event_projection (name, last_id) VALUES ('daily_stats', ?)",
+            (max_id,)
+        )
+        conn.commit()
+        return max_id - last_id
+
+
+def daily_stats(days: int = 7) -> List[Tuple[str, str, int]]:
+    update_daily_stats()
+    with get_conn() as conn:
+        rows = conn.execute("""
+            SELECT day, type, count FROM event_daily_stats
+            WHERE day >= date('now', ?)
+            ORDER BY day, type
+        """, (f"-{days} days",)).fetchall()
+    return [(day, EVENT_NAMES.get(t, str(t)), n) for day, t, n in rows]
+
+
+if __name__ == "__main__":
+    if not LOCAL_FEATURES:
+        print("events.py читает SQLite; с STORAGE_BACKEND=postgres журнал — таблица events в DATABASE_URL")
+        sys.exit(2)
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if cmd == "verify":
+        problems = verify()
+        for p in problems[:50]:
+            print(p)
+        print(f"Расхождений: {len(problems)}")
+        sys.exit(1 if problems else 0)
+    elif cmd == "rebuild" and len(sys.argv) > 2:
+        print(f"Восстановлено пользователей: {rebuild(sys.argv[2])}")
+    elif cmd == "stats":
+        for day, name, n in daily_stats(int(sys.argv[2]) if len(sys.argv) > 2 else 7):
+            print(f"{day}  {name:<12} {n}")
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -0,0 +1,89 @@
+"""
+Один Bot с настроенным HTTP-пулом на весь процесс: и polling, и утренняя рассылка
+ходят через одну aiohttp-сессию, поэтому keep-alive и TLS-сессии переживают рассылку.
+"""
+import contextvars
+import time
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from config import BOT_TOKEN, TELEGRAM_API_URL, SEND_CONCURRENCY, HTTP_TIMEOUT, HTTP_KEEPALIVE, HTTP_DNS_TTL
+from outbound import priority_middleware
+
+# Время в самих HTTP-запросах текущей задачи, без ожидания токена и паузы по 429:
+# _count_requests прибавляет, вызывающий обнуляет перед замером (daily_send.send_one)
+api_time: contextvars.ContextVar[float] = contextvars.ContextVar("api_time", default=0.0)
+
+
+class TunedAiohttpSession(AiohttpSession):
+    """AiohttpSession с пулом под SEND_CONCURRENCY, keep-alive и DNS-кэшем + счётчики запросов."""
+
+    def __init__(self, pool_size: int = SEND_CONCURRENCY, **kwargs):
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        super().__init__(**kwargs)
+        # +2 соединения на интерактивные ответы и getUpdates во время рассылки
+        self.pool_size = pool_size + 2
+        self._connector_init.update(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            enable_cleanup_closed=True,
+        )
+        self.requests_total = 0
+        self.requests_failed = 0
+        self.request_time_total = 0.0
+        # Сначала очередь с приоритетами и общий лимит, затем замер самого HTTP-запроса
+        self.middleware(priority_middleware)
+        self.middleware(self._count_requests)
+
+    async def _count_requests(self, make_request, bot, method):
+        started = time.monotonic()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            self.requests_failed += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self.requests_total += 1
+            self.request_time_total += elapsed
+            api_time.set(api_time.get() + elapsed)
+
+    def pool_stats(self) -> dict:
+        """Занятые/свободные соединения пула и средняя длительность запроса."""
+        connector = self._session.connector if self._session and not self._session.closed else None
+        acquired = len(getattr(connector, "_acquired", ())) if connector else 0
+        idle = sum(len(v) for v in getattr(connector, "_conns", {}).values()) if connector else 0
+        avg = self.request_time_total / self.requests_total if self.requests_total else 0.0
+        return {
+            "limit": self.pool_size,
+            "acquired": acquired,
+            "idle": idle,
+            "requests": self.requests_total,
+            "failed": self.requests_failed,
+            "avg_ms": round(avg * 1000, 1),
+        }
+
+
+def create_bot() -> Bot:
+    session_kwargs = {}
+    if TELEGRAM_API_URL:
+        session_kwargs["api"] = TelegramAPIServer.from_base(TELEGRAM_API_URL)
+    return Bot(
+        BOT_TOKEN,
+        session=TunedAiohttpSession(**session_kwargs),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+
+
+def pool_stats_text(bot: Bot) -> str:
+    if not isinstance(bot.session, TunedAiohttpSession):
+        return ""
+    s = bot.session.pool_stats()
+    return (
+        f"🔌 HTTP-пул: занято {s['acquired']}, свободно {s['idle']}, лимит {s['limit']}\n"
+        f"📡 Запросов: {s['requests']} (ошибок {s['failed']}), в среднем {s['avg_ms']} мс"
+    )
@@ -0,0 +1,158 @@
+"""
+Выбор лидера между несколькими экземплярами бота.
+
+Обновления (webhook) обрабатывают все экземпляры, а планировщик — утренняя
+рассылка, копия для отчётов, разбор повторов — работает только у того, кто держит
+аренду "scheduler". Лидер продлевает аренду каждые LEADER_RENEW_INTERVAL секунд;
+если он упал или завис, через LEADER_LEASE_TTL аренду забирает другой.
+
+    LEADER_LOCK=db    — строка в таблице leases общей базы (SQLite или PostgreSQL)
+    LEADER_LOCK=file  — flock на LEADER_LOCK_FILE, только для экземпляров на одном хосте (не Windows)
+
+Флага is_leader в памяти мало: лидер, зависший дольше ttl, узнает о потере аренды
+только на следующем продлении. Поэтому у аренды в базе есть поколение (растёт при
+смене владельца), и запись прогресса рассылки проверяет его — fence() и
+Storage.mark_sent(..., fence=...). Если проверка не прошла, поднимается LeaseLost.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+from config import LEADER_LOCK, LEADER_LOCK_FILE, LEADER_LEASE_TTL, LEADER_RENEW_INTERVAL
+from models import Fence, instance_id
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
+
+
+class LeaseLost(RuntimeError):
+    """Запись лидера отклонена: аренду уже держит другой экземпляр (или она истекла)."""
+
+
+class DbLease:
+    def __init__(self, name: str = LEASE_NAME, owner: str | None = None, ttl: int = LEADER_LEASE_TTL):
+        self.name = name
+        self.owner = owner or instance_id()
+        self.ttl = ttl
+        self.generation = 0
+
+    async def acquire(self) -> bool:
+        generation = await get_storage().acquire_lease(self.name, self.owner, self.ttl)
+        if generation is None:
+            return False
+        self.generation = generation
+        return True
+
+    @property
+    def fence(self) -> Fence:
+        return self.name, self.owner, self.generation
+
+    async def release(self):
+        await get_storage().release_lease(self.name, self.owner)
+
+
+class FileLease:
+    """Блокировка снимается ядром, если процесс умер, поэтому ttl не нужен."""
+
+    def __init__(self, path: str = LEADER_LOCK_FILE):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    # flock не переживает смерть процесса, а зависший процесс блокировку не теряет,
+    # поэтому двух лидеров не бывает и fencing-токен не нужен
+    fence = None
+
+    async def acquire(self) -> bool:
+        import fcntl  # только POSIX: без него модуль импортируется и на Windows
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, instance_id().encode())
+        self._fd = fd
+        return True
+
+    async def release(self):
+        import fcntl
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def make_lease():
+    if LEADER_LOCK == "file":
+        return FileLease()
+    if LEADER_LOCK == "db":
+        return DbLease()
+    raise RuntimeError(f"Неизвестный LEADER_LOCK: {LEADER_LOCK}")
+
+
+class Leadership:
+    """
+    Цикл аренды: on_elected вызывается, когда экземпляр стал лидером, on_deposed —
+    когда перестал (аренду забрали, база недоступна дольше ttl, остановка).
+    """
+
+    def __init__(self, lease, on_elected: Callable[[], Awaitable], on_deposed: Callable[[], Awaitable],
+                 interval: float = LEADER_RENEW_INTERVAL, ttl: int = LEADER_LEASE_TTL):
+        self.lease = lease
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.interval = interval
+        self.ttl = ttl
+        self.is_leader = False
+        self._renewed_at = 0.0
+
+    async def _set(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        logger.info("Instance %s %s leader", instance_id(), "became" if leader else "is no longer")
+        await (self.on_elected() if leader else self.on_deposed())
+
+    async def run(self):
+        global current
+        current = self
+        try:
+            while True:
+                try:
+                    held = await self.lease.acquire()
+                except Exception as e:
+                    logger.warning("Lease renew failed: %s", e)
+                    # Пока аренда заведомо не истекла, продолжаем считать себя лидером
+                    held = self.is_leader and time.monotonic() - self._renewed_at < self.ttl - self.interval
+                else:
+                    if held:
+                        self._renewed_at = time.monotonic()
+                await self._set(held)
+                await asyncio.sleep(self.interval)
+        finally:
+            if self.is_leader:
+                await self._set(False)
+                try:
+                    await self.lease.release()
+                except Exception as e:
+                    logger.error("Lease release failed: %s", e)
+
+
+# Leadership этого процесса; None — выбора нет (daily_send.py запущен скриптом)
+current: Optional[Leadership] = None
+
+
+def holds_lead() -> bool:
+    """Можно ли сейчас выполнять работу лидера. Проверяется рассылкой перед каждой отправкой."""
+    return current is None or current.is_leader
+
+
+def fence() -> Optional[Fence]:
+    """Токен для записей лидера; None — проверять нечего (скрипт или flock)."""
+    return current.lease.fence if current is not None else None
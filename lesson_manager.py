@@ -1,8 +1,14 @@
 import json
 import html
+import hashlib
 import logging
-from typing import Dict, List, Any
-from config import LESSONS_FILE
+from html.parser import HTMLParser
+from typing import Dict, List, Any, Optional
+from config import LESSONS_FILE, COMPILED_LESSONS_FILE
+
+# Лимит Telegram 4096, оставляем запас под заголовок рассылки и подсказки
+MAX_LESSON_LEN = 3800
+ALLOWED_TAGS = {"b", "i", "code"}
 
 
 def esc(text: str) -> str:
@@ -55,19 +61,234 @@ def format_lesson(obj: dict, index: int, total: int) -> str:
     return "\n\n".join(parts)
 
 
+# -------- Проверка и предкомпиляция контента --------
+
+def _is_pair_list(value: Any) -> bool:
+    return isinstance(value, list) and all(
+        isinstance(p, list) and len(p) == 2 and all(isinstance(x, str) for x in p) for p in value
+    )
+
+
+class _TagChecker(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.stack: List[str] = []
+        self.errors: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ALLOWED_TAGS:
+            self.errors.append(f"недопустимый тег <{tag}>")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            self.errors.append(f"несбалансированный тег </{tag}>")
+
+
+def validate_lesson(obj: Any) -> List[str]:
+    """Ошибки схемы одного урока (пустой список — всё хорошо)."""
+    if not isinstance(obj, dict):
+        return ["урок должен быть объектом"]
+    errors = []
+    for key in ("title", "task"):
+        if key in obj and not isinstance(obj[key], str):
+            errors.append(f"{key}: ожидается строка")
+    for key in ("words", "phrases", "review"):
+        if obj.get(key) and not _is_pair_list(obj[key]):
+            errors.append(f"{key}: ожидается список пар [de, ru]")
+    gram = obj.get("gram")
+    if gram:
+        if not isinstance(gram, dict):
+            errors.append("gram: ожидается объект")
+        else:
+            if "rule" in gram and not isinstance(gram["rule"], str):
+                errors.append("gram.rule: ожидается строка")
+            table = gram.get("table")
+            if table and not (isinstance(table, list) and all(
+                    isinstance(r, list) and all(isinstance(x, str) for x in r) for r in table)):
+                errors.append("gram.table: ожидается список строк таблицы")
+            if gram.get("examples") and not _is_pair_list(gram["examples"]):
+                errors.append("gram.examples: ожидается список пар [de, ru]")
+    return errors
+
+
+def check_rendered(text: str) -> List[str]:
+    """Проверка готового HTML: только разрешённые теги, всё закрыто, влезает в лимит."""
+    checker = _TagChecker()
+    checker.feed(text)
+    checker.close()
+    errors = checker.errors
+    if checker.stack:
+        errors.append(f"незакрытые теги: {checker.stack}")
+    if len(text) > MAX_LESSON_LEN:
+        errors.append(f"длина {len(text)} > {MAX_LESSON_LEN}")
+    return errors
+
+
+# Служебный ключ lessons.json с метаданными уровней (всё необязательно):
+#   "_levels": {"A1": {"name": "A1", "order": 1, "next": "A2", "button": "🚀 Уровень A1"}}
+# По умолчанию порядок — как в файле, next — следующий по порядку, name — ключ уровня.
+LEVELS_KEY = "_levels"
+
+
+def split_levels(raw: dict) -> tuple[Dict[str, List[dict]], dict]:
+    """Содержимое lessons.json -> (уровень -> уроки, метаданные из LEVELS_KEY)."""
+    data = {k: v for k, v in raw.items() if k != LEVELS_KEY}
+    return data, raw.get(LEVELS_KEY) or {}
+
+
+def build_level_meta(data: Dict[str, List[dict]], meta: dict) -> tuple[Dict[str, dict], List[str]]:
+    """
+    Полные метаданные каждого уровня с умолчаниями, в порядке показа:
+    уровень -> {name, order, next, button}. Второй элемент — ошибки в LEVELS_KEY.
+    """
+    errors: List[str] = []
+    if not isinstance(meta, dict):
+        errors.append(f"{LEVELS_KEY}: ожидается объект {{уровень: {{...}}}}")
+        meta = {}
+    for level, m in meta.items():
+        if level not in data:
+            errors.append(f"{LEVELS_KEY}.{level}: такого уровня нет среди уроков")
+        elif not isinstance(m, dict):
+            errors.append(f"{LEVELS_KEY}.{level}: ожидается объект")
+    meta = {lvl: m for lvl, m in meta.items() if isinstance(m, dict)}
+
+    position = {lvl: i for i, lvl in enumerate(data)}
+    # Уровни с явным order — первыми по нему, остальные — в порядке файла
+    ordered = sorted(data, key=lambda lvl: (meta.get(lvl, {}).get("order", float("inf")), position[lvl]))
+    result: Dict[str, dict] = {}
+    for i, level in enumerate(ordered):
+        m = meta.get(level, {})
+        name = m.get("name") or level
+        nxt = m["next"] if "next" in m else (ordered[i + 1] if i + 1 < len(ordered) else None)
+        if nxt is not None and nxt not in data:
+            errors.append(f"{LEVELS_KEY}.{level}.next: нет уровня {nxt}")
+            nxt = None
+        result[level] = {
+            "name": name,
+            "order": i,
+            "next": nxt,
+            "button": m.get("button") or f"{'🚀' * min(i + 1, 3)} Уровень {name}",
+        }
+    return result, errors
+
+
+def file_checksum(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_lessons(data: Dict[str, List[dict]]) -> tuple[Dict[str, List[dict]], List[str]]:
+    """
+    Один проход по всем (level, index): проверка схемы, рендер, проверка HTML и длины.
+    Возвращает (уровень -> список {text, length, words, checksum}, ошибки).
+    """
+    compiled: Dict[str, List[dict]] = {}
+    errors: List[str] = []
+    if not isinstance(data, dict):
+        return compiled, ["корень файла должен быть объектом {уровень: [уроки]}"]
+    data, meta = split_levels(data)
+    errors.extend(build_level_meta(data, meta)[1])
+    for level, lessons in data.items():
+        if not isinstance(lessons, list):
+            errors.append(f"{level}: ожидается список уроков")
+            continue
+        total = len(lessons)
+        out = []
+        for i, obj in enumerate(lessons):
+            where = f"{level}[{i}]"
+            problems = validate_lesson(obj)
+            if problems:
+                errors.extend(f"{where}: {p}" for p in problems)
+                continue
+            text = format_lesson(obj, i, total)
+            errors.extend(f"{where}: {p}" for p in check_rendered(text))
+            out.append({
+                "text": text,
+                "length": len(text),
+                "words": len(obj.get("words", []) or []),
+                "checksum": hashlib.sha256(text.encode("utf-8")).hexdigest()[:16],
+            })
+        compiled[level] = out
+    return compiled, errors
+
+
+class LessonsError(RuntimeError):
+    """lessons.json не читается или не проходит проверку: с таким контентом бот не стартует."""
+
+
 class LessonManager:
-    def __init__(self, path: str = LESSONS_FILE):
+    def __init__(self, path: str = LESSONS_FILE, compiled_path: str = COMPILED_LESSONS_FILE):
         self.path = path
+        self.compiled_path = compiled_path
         self.data: Dict[str, List[dict]] = {}
+        # уровень -> готовые тексты уроков (из lessons.compiled.json)
+        self.rendered: Dict[str, List[str]] = {}
+        # уровень -> {name, order, next, button}; levels — в порядке показа
+        self.meta: Dict[str, dict] = {}
+        self.levels: List[str] = []
+        # Тексты, зависящие только от уровня, считаются один раз при загрузке
+        self.end_messages: Dict[str, str] = {}
+        # Растёт при каждой загрузке: по нему bot.py пересобирает клавиатуру уровней
+        self.version = 0
         self._load()
 
     def _load(self):
+        """
+        Читает и проверяет контент. Ошибка -> LessonsError, прежнее состояние
+        (при reload) не трогается. Тексты уроков берутся из lessons.compiled.json;
+        если его нет или он устарел, выполняется та же проверка и сборка, что в
+        `lessons_cli.py build`, — на горячем пути рендера и проверок нет.
+        """
         try:
             with open(self.path, "r", encoding="utf-8") as f:
-                self.data = json.load(f)
+                raw = json.load(f)
         except (FileNotFoundError, json.JSONDecodeError) as e:
-            logging.error(f"Could not load or parse lessons file: {e}")
-            self.data = {}
+            raise LessonsError(f"Could not load or parse lessons file {self.path}: {e}") from e
+        if not isinstance(raw, dict):
+            raise LessonsError(f"{self.path}: корень файла должен быть объектом {{уровень: [уроки]}}")
+
+        data, meta = split_levels(raw)
+        meta, errors = build_level_meta(data, meta)
+        rendered = self._load_compiled()
+        if rendered is None:
+            compiled, errors = compile_lessons(raw)
+            rendered = {lvl: [item["text"] for item in items] for lvl, items in compiled.items()}
+        if errors:
+            shown = "\n".join(errors[:20])
+            more = f"\n... и ещё {len(errors) - 20}" if len(errors) > 20 else ""
+            raise LessonsError(f"{self.path}: ошибок в контенте: {len(errors)}\n{shown}{more}")
+
+        self.data = data
+        self.meta = meta
+        self.levels = list(meta)
+        self.rendered = rendered
+        self.end_messages = {lvl: self._build_end_message(lvl) for lvl in self.levels}
+        self.version += 1
+
+    def _load_compiled(self) -> Optional[Dict[str, List[str]]]:
+        """Тексты из артефакта сборки; None, если его нет или он собран из другой версии lessons.json."""
+        try:
+            with open(self.compiled_path, "r", encoding="utf-8") as f:
+                artifact = json.load(f)
+            source = file_checksum(self.path)
+        except FileNotFoundError:
+            logging.warning(f"{self.compiled_path} не найден, lessons.json проверяется и собирается при загрузке")
+            return None
+        except json.JSONDecodeError:
+            logging.warning(f"{self.compiled_path} повреждён, lessons.json проверяется и собирается при загрузке")
+            return None
+        if artifact.get("source_checksum") != source:
+            logging.warning(f"{self.compiled_path} устарел (lessons.json изменён), lessons.json проверяется и собирается при загрузке")
+            return None
+        return {lvl: [item["text"] for item in items] for lvl, items in artifact["levels"].items()}
+
+    def render(self, level: str, index: int) -> Optional[str]:
+        """Готовый текст урока (собран и проверен при загрузке)."""
+        texts = self.rendered.get(level)
+        if texts is not None and 0 <= index < len(texts):
+            return texts[index]
+        return None
 
 
     def reload(self):
@@ -88,22 +309,28 @@ class LessonManager:
             return f"❗ Уроки для уровня {level} не найдены или файл {self.path} пуст."
         if index >= total:
             return self.end_message(level)
-        obj = self.get_lesson_obj(level, index)
-        if not obj:
+        text = self.render(level, index)
+        if not text:
             return "❗ Урок не найден."
-        return format_lesson(obj, index, total)
+        return text
+
+    def name(self, level: str) -> str:
+        return self.meta.get(level, {}).get("name", level)
 
     def end_message(self, level: str) -> str:
-        other_levels = [lvl for lvl in self.data.keys() if lvl != level]
-        other_level_text = ""
-        if other_levels:
-            other = other_levels[0]
-            other_level_text = f"➡️ Попробуйте перейти на <b>{other}</b>, отправив /start и выбрав уровень."
+        text = self.end_messages.get(level)
+        return text if text is not None else self._build_end_message(level)
+
+    def _build_end_message(self, level: str) -> str:
+        nxt = self.meta.get(level, {}).get("next")
+        next_level_text = ""
+        if nxt:
+            next_level_text = f"➡️ Попробуйте перейти на <b>{esc(self.name(nxt))}</b>, отправив /start и выбрав уровень.\n"
 
         return (
-            f"🏆 <b>Все уроки уровня {level} пройдены!</b>\n"
+            f"🏆 <b>Все уроки уровня {esc(self.name(level))} пройдены!</b>\n"
             f"🔁 Используйте «Повторить все» для закрепления.\n"
-            f"{other_level_text}\n"
+            f"{next_level_text}"
             "✨ Новые блоки уроков появятся позже."
         )
 
@@ -114,13 +341,12 @@ class LessonManager:
         if up_to > len(arr):
             up_to = len(arr)
 
-        total = len(arr)
         out: List[str] = []
         buffer: List[str] = []
         acc = 0
 
         for i in range(up_to):
-            t = format_lesson(arr[i], i, total)
+            t = self.render(level, i)
             # Telegram message length limit is 4096
             if acc + len(t) + 2 > 4000 and buffer:
                 out.append("\n\n".join(buffer))
@@ -136,4 +362,14 @@ class LessonManager:
         if out:
             out[0] = "<b>🔁 Повторение изученных уроков</b>\n\n" + out[0]
 
-        return out
\ No newline at end of file
+        return out
+
+_shared: Optional[LessonManager] = None
+
+
+def get_lesson_manager() -> LessonManager:
+    """Один LessonManager на процесс: bot.py и daily_send читают lessons.json один раз."""
+    global _shared
+    if _shared is None:
+        _shared = LessonManager()
+    return _shared
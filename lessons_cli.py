@@ -0,0 +1,50 @@
+"""
+Проверка и сборка контента уроков.
+
+    python lessons_cli.py validate   — проверить lessons.json (схема, HTML, длина)
+    python lessons_cli.py build      — проверить и записать lessons.compiled.json
+
+При любой ошибке выходит с кодом 1, артефакт не пишется.
+"""
+import argparse
+import json
+import sys
+from config import LESSONS_FILE, COMPILED_LESSONS_FILE
+from lesson_manager import compile_lessons, file_checksum
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Проверка и предкомпиляция lessons.json")
+    parser.add_argument("command", choices=["validate", "build"])
+    parser.add_argument("--src", default=LESSONS_FILE)
+    parser.add_argument("--out", default=COMPILED_LESSONS_FILE)
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.src, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"❌ {args.src}: {e}", file=sys.stderr)
+        return 1
+
+    compiled, errors = compile_lessons(data)
+    if errors:
+        for err in errors:
+            print(f"❌ {err}", file=sys.stderr)
+        print(f"Найдено ошибок: {len(errors)}", file=sys.stderr)
+        return 1
+
+    for level, items in compiled.items():
+        longest = max((item["length"] for item in items), default=0)
+        print(f"✅ {level}: {len(items)} уроков, самый длинный {longest} символов")
+
+    if args.command == "build":
+        artifact = {"source_checksum": file_checksum(args.src), "levels": compiled}
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(artifact, f, ensure_ascii=False)
+        print(f"💾 {args.out} записан")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,208 @@
+import asyncio
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
-from config import LOG_FILE
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from config import LOG_FILE, LOG_JSON, LOG_QUEUE_SIZE, LOG_DEDUP_WINDOW, LOG_DEDUP_BURST, LOG_STATS_INTERVAL
+
+# Поля, которые можно передавать через extra={...} и которые попадут в JSON
+CONTEXT_FIELDS = ("user_id", "handler", "latency")
+
+_listener: QueueListener | None = None
+# Сколько сводок о скрытых повторах держим до следующего log_stats()
+PENDING_SUPPRESSED_MAX = 100
+# Форматирует трейсбек в DroppingQueueHandler.prepare
+_plain = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись: время, уровень, логгер, сообщение + контекст."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Трейсбек уже отформатирован в DroppingQueueHandler.prepare
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class DedupFilter(logging.Filter):
+    """
+    Гасит одинаковые WARNING/ERROR во время рассылки (шторм 429 и т.п.).
+    Ключ — логгер + уровень + шаблон сообщения (без аргументов), поэтому
+    "Network/API error user %s" для тысячи пользователей — это одна запись.
+    В окне LOG_DEDUP_WINDOW секунд пропускаем первые LOG_DEDUP_BURST штук,
+    остальные считаем и докладываем счётчиком в первой записи следующего окна.
+    Истёкшие окна раз в window выкидываются; если в них что-то было скрыто,
+    счётчик уходит в pending и попадает в лог через log_stats().
+    """
+
+    def __init__(self, window: float = LOG_DEDUP_WINDOW, burst: int = LOG_DEDUP_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._seen: dict[tuple, list] = {}  # key -> [window_start, count]
+        self._swept_at = time.monotonic()
+        self.suppressed_total = 0
+        # (key, скрыто) по окнам, которые истекли без повтора сообщения
+        self.pending: list[tuple[tuple, int]] = []
+
+    def _sweep(self, now: float):
+        expired = [key for key, (start, _) in self._seen.items() if now - start >= self.window]
+        for key in expired:
+            count = self._seen.pop(key)[1]
+            if count > self.burst and len(self.pending) < PENDING_SUPPRESSED_MAX:
+                self.pending.append((key, count - self.burst))
+        self._swept_at = now
+
+    def take_pending(self) -> list[tuple[tuple, int]]:
+        with self._lock:
+            self._sweep(time.monotonic())
+            pending, self.pending = self.pending, []
+        return pending
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.window <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at >= self.window:
+                self._sweep(now)
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is not None and state[1] > self.burst:
+                    record.suppressed = state[1] - self.burst
+                    record.msg = f"{record.msg} (похожих скрыто: {record.suppressed})"
+                self._seen[key] = [now, 1]
+                return True
+            state[1] += 1
+            if state[1] > self.burst:
+                self.suppressed_total += 1
+                return False
+            return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler с ограниченной очередью: при переполнении запись выбрасывается."""
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare склеивает трейсбек с текстом и обнуляет exc_info;
+        # сохраняем его отдельно в exc_text, чтобы JsonFormatter вывел поле exc
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _plain.formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _queue_handler() -> DroppingQueueHandler | None:
+    for h in logging.getLogger().handlers:
+        if isinstance(h, DroppingQueueHandler):
+            return h
+    return None
+
+
+def get_log_stats() -> dict:
+    """Сколько записей в очереди, сколько выброшено и скрыто дедупликацией с момента старта."""
+    h = _queue_handler()
+    if h is None:
+        return {"queued": 0, "dropped": 0, "suppressed": 0}
+    suppressed = sum(f.suppressed_total for f in h.filters if isinstance(f, DedupFilter))
+    return {"queued": h.queue.qsize(), "dropped": h.dropped, "suppressed": suppressed}
+
+
+def log_stats_text() -> str:
+    s = get_log_stats()
+    return f"📝 Логи: в очереди {s['queued']}, выброшено {s['dropped']}, скрыто повторов {s['suppressed']}"
+
+
+_last_stats: dict = {}
+
+
+def log_stats():
+    """Пишет в лог счётчики очереди и сводки по окнам дедупликации, истёкшим без повтора."""
+    global _last_stats
+    h = _queue_handler()
+    if h is None:
+        return
+    logger = logging.getLogger(__name__)
+    for f in h.filters:
+        if isinstance(f, DedupFilter):
+            for (name, levelno, msg), n in f.take_pending():
+                logger.info("Скрыто повторов: %d × [%s %s] %s", n, logging.getLevelName(levelno), name, msg)
+    stats = get_log_stats()
+    if stats["dropped"] != _last_stats.get("dropped", 0) or stats["suppressed"] != _last_stats.get("suppressed", 0):
+        logger.info("Log stats: queued=%d dropped=%d suppressed=%d",
+                    stats["queued"], stats["dropped"], stats["suppressed"])
+    _last_stats = stats
+
+
+async def run_stats_logger(interval: float = LOG_STATS_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        log_stats()
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 
 def setup_logging():
+    global _listener
     root = logging.getLogger()
     if root.handlers:
         return
     root.setLevel(logging.INFO)
-    fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+    if LOG_JSON:
+        fmt = JsonFormatter()
+    else:
+        fmt = logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
     fh = RotatingFileHandler(LOG_FILE, maxBytes=2_000_000, backupCount=3, encoding="utf-8")
     fh.setFormatter(fmt)
     sh = logging.StreamHandler()
     sh.setFormatter(fmt)
-    root.addHandler(fh)
-    root.addHandler(sh)
+
+    # Файл и консоль пишет фоновый поток, event loop только кладёт запись в очередь
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    qh = DroppingQueueHandler(log_queue)
+    qh.addFilter(DedupFilter())
+    root.addHandler(qh)
+    _listener = QueueListener(log_queue, fh, sh, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
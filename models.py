@@ -1,17 +1,214 @@
+import asyncio
+import logging
+import os
+import socket
 import sqlite3
+import threading
 import time
-from typing import Optional, List, Tuple
+import zlib
+from typing import Optional, List, Tuple, Dict
 from config import DEFAULT_LEVEL
 from config import DB_PATH
+from config import TIER_DAILY_DAYS, TIER_WEEKLY_DAYS, ACTIVITY_TOUCH_SECONDS
+from config import EVENTS_FLUSH_SIZE, EVENTS_FLUSH_INTERVAL, INSTANCE_ID
+
+logger = logging.getLogger(__name__)
 
 
 def get_conn():
     return sqlite3.connect(DB_PATH)
 
 
+# Пользователь "к отправке": активен и ещё не прошёл все уроки своего уровня.
+# Число уроков по уровням лежит в level_totals (заполняет sync_level_totals).
+_ELIGIBLE_EXPR = """(status = 'active' AND lesson_index <
+    COALESCE((SELECT total FROM level_totals t WHERE t.level = users.level), 0))"""
+
+
+class BatchWriter:
+    """
+    Копит строки в памяти и пишет их одним executemany в одной транзакции:
+    когда набралось max_size строк или по таймеру (run_flusher).
+    Если база недоступна, строки ждут следующей попытки, но не больше max_pending:
+    сверх этого самые старые выбрасываются (счётчик dropped).
+    user_col — номер поля с user_id в строке: по нему discard_user убирает
+    ещё не записанные строки удалённого пользователя.
+    """
+
+    # Все буферы процесса — чтобы delete_user почистил каждый
+    instances: List["BatchWriter"] = []
+
+    def __init__(self, insert_sql: str, max_size: int, interval: float, max_pending: int | None = None,
+                 user_col: int | None = None):
+        self.insert_sql = insert_sql
+        self.user_col = user_col
+        self.max_size = max_size
+        self.interval = interval
+        self.max_pending = max_pending or max_size * 20
+        self.dropped = 0
+        self._rows: List[Tuple] = []
+        self._lock = threading.Lock()
+        self._failed_at = 0.0
+        BatchWriter.instances.append(self)
+
+    def add_row(self, row: Tuple):
+        self.add_rows([row])
+
+    def add_rows(self, rows: List[Tuple]):
+        with self._lock:
+            self._rows.extend(rows)
+            overflow = len(self._rows) - self.max_pending
+            if overflow > 0:
+                del self._rows[:overflow]
+                self.dropped += overflow
+            # После неудачной записи не дёргаем базу на каждой строке — ждём таймера
+            full = len(self._rows) >= self.max_size and time.monotonic() - self._failed_at >= self.interval
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                # Ошибка базы не должна долетать до хендлера, строки остались в буфере
+                logger.error("Batch flush failed: %s", e)
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        try:
+            with get_conn() as conn:
+                conn.executemany(self.insert_sql, rows)
+                conn.commit()
+        except Exception:
+            # Не теряем строки: вернём их в начало буфера до следующей попытки
+            with self._lock:
+                self._rows[:0] = rows
+                self._failed_at = time.monotonic()
+                overflow = len(self._rows) - self.max_pending
+                if overflow > 0:
+                    del self._rows[:overflow]
+                    self.dropped += overflow
+            if self.dropped:
+                logger.error("Batch buffer full, %d oldest rows dropped so far", self.dropped)
+            raise
+        return len(rows)
+
+    def discard_user(self, user_id: int) -> int:
+        """Выбрасывает не записанные строки пользователя; сколько выброшено."""
+        if self.user_col is None:
+            return 0
+        with self._lock:
+            before = len(self._rows)
+            self._rows = [r for r in self._rows if r[self.user_col] != user_id]
+            return before - len(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Batch flush failed: %s", e)
+
+
+# -------- Журнал событий (append-only) --------
+# Каждое изменение состояния пользователя дописывается в events компактной
+# строкой (ts, user_id, код события, короткий payload, seq). Пишется пачками,
+# по нему events.py восстанавливает состояние users и считает статистику.
+# Это журнал аудита, а не путь записи: users по-прежнему обновляется на месте.
+# id событий раздаются в момент записи пачки, а пачки у нескольких экземпляров
+# свои, поэтому порядок событий пользователя задаёт seq (stamp_events): монотонный
+# счётчик процесса на основе времени в микросекундах, в младших трёх цифрах —
+# метка экземпляра. Лишних записей в users для этого нет. Между экземплярами
+# порядок держится на синхронизированных часах: следующее действие пользователя
+# приходит только после ответа на предыдущее, то есть минимум через round-trip.
+
+EV_REGISTER = 1      # payload: start_date
+EV_SET_LEVEL = 2     # payload: level
+EV_RESET = 3
+EV_LESSON = 4        # lesson_index + 1
+EV_BLOCKED = 5
+EV_REACTIVATED = 6
+EV_DELETED = 7       # user_id не пишем — данные пользователя удалены
+EV_MANUAL = 8
+EV_REQUEST = 9
+EV_SENT = 10
+EV_SNAPSHOT = 11     # payload: "level|lesson_index|status|start_date|last_sent|last_request"
+
+event_log = BatchWriter(
+    "INSERT INTO events (ts, user_id, type, payload, seq) VALUES (?, ?, ?, ?, ?)",
+    EVENTS_FLUSH_SIZE, EVENTS_FLUSH_INTERVAL, user_col=1,
+)
+
+
+def instance_id() -> str:
+    return INSTANCE_ID or f"{socket.gethostname()}:{os.getpid()}"
+
+
+_SEQ_TAG = zlib.crc32(instance_id().encode()) % 1000
+_last_seq = 0
+
+
+def stamp_events(events: List[Tuple]) -> List[Tuple]:
+    """
+    (ts, user_id, type, payload) -> (..., seq). Вызывать в момент изменения (до
+    commit или сразу после — запись в этом процессе синхронная); события без
+    user_id остаются без seq.
+    """
+    global _last_seq
+    stamped = []
+    for ts, uid, ev_type, payload in events:
+        seq = None
+        if uid is not None:
+            # +1000 сохраняет метку экземпляра и не даёт счётчику пойти назад вместе с часами
+            _last_seq = max(_last_seq + 1000, time.time_ns() // 1000 * 1000 + _SEQ_TAG)
+            seq = _last_seq
+        stamped.append((ts, uid, ev_type, payload, seq))
+    return stamped
+
+
+def log_event(user_id: int | None, ev_type: int, payload: str | None = None, ts: int | None = None):
+    """Событие вне пользователя (например, обезличенное удаление): без seq."""
+    event_log.add_row((ts if ts is not None else int(time.time()), user_id, ev_type, payload, None))
+
+
+# Порядок полей строки пользователя (get_user / get_users и хранилища в storage.py)
+USER_COLUMNS = """user_id, level, lesson_index, manual_lessons_today,
+    start_date, last_sent_lesson_at, last_request_at,
+    status, reactivated_at"""
+
+# Таблицы с данными пользователя помимо users и events
+USER_DATA_TABLES = ("srs_cards", "srs_seeded", "user_errors", "send_retries")
+
+
+def _refresh_eligible(c, user_id: int):
+    c.execute(f"UPDATE users SET eligible = {_ELIGIBLE_EXPR} WHERE user_id=?", (user_id,))
+
+
+# Частота утренней рассылки: tier -> раз в сколько дней
+TIER_INTERVALS = {"daily": 1, "few_days": 3, "weekly": 7}
+
+_TIER_INTERVAL_EXPR = "CASE tier " + " ".join(
+    f"WHEN '{t}' THEN {d}" for t, d in TIER_INTERVALS.items()
+) + " ELSE 1 END"
+
+
+def today_day(ts: int | None = None) -> int:
+    """Номер дня по UTC (дни с эпохи) — в этих единицах хранится next_due_day."""
+    if ts is None:
+        ts = int(time.time())
+    return ts // 86400
+
+
 def init_db():
     with get_conn() as conn:
         c = conn.cursor()
+        # WAL: читатели (копия для отчётов, выборки рассылки) не блокируют запись.
+        # Режим хранится в файле базы, достаточно включить один раз.
+        c.execute("PRAGMA journal_mode=WAL")
         # ВАЖНО: убрали параметр ?, подставили DEFAULT_LEVEL прямо в SQL
         c.execute(f"""
         CREATE TABLE IF NOT EXISTS users (
@@ -39,7 +236,171 @@ def init_db():
             c.execute("ALTER TABLE users ADD COLUMN full_name TEXT")
         except:
             pass  # Колонка уже существует
+
+        try:
+            c.execute("ALTER TABLE users ADD COLUMN eligible INTEGER DEFAULT 1")
+        except:
+            pass  # Колонка уже существует
+
+        # Счётчик событий в users больше не ведётся (см. stamp_events)
+        try:
+            c.execute("ALTER TABLE users DROP COLUMN event_seq")
+        except sqlite3.OperationalError:
+            pass  # Колонки нет
+
+        try:
+            c.execute("ALTER TABLE users ADD COLUMN tier TEXT DEFAULT 'daily'")
+        except:
+            pass  # Колонка уже существует
+
+        try:
+            c.execute("ALTER TABLE users ADD COLUMN next_due_day INTEGER")
+        except:
+            pass  # Колонка уже существует
+
+        # Последнее любое действие пользователя (touch_activity) — по нему считается tier.
+        # last_request_at остаётся днём счётчика ручных уроков
+        try:
+            c.execute("ALTER TABLE users ADD COLUMN last_active_at INTEGER")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        else:
+            c.execute("UPDATE users SET last_active_at = last_request_at")
+
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS level_totals (
+            level TEXT PRIMARY KEY,
+            total INTEGER NOT NULL
+        )
+        """)
+        # Частичный индекс: утренняя выборка читает только тех, кому есть что слать
+        c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_eligible
+        ON users(user_id) WHERE eligible = 1
+        """)
+        # update_engagement_tiers трогает только давно не заходивших
+        c.execute("DROP INDEX IF EXISTS idx_users_dormant")
+        c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_inactive
+        ON users(last_active_at) WHERE eligible = 1
+        """)
         
+        # Карточки интервального повторения (см. srs.py)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS srs_cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            level TEXT,
+            lesson_index INTEGER,
+            front TEXT NOT NULL,
+            back TEXT NOT NULL,
+            reps INTEGER DEFAULT 0,
+            interval INTEGER DEFAULT 0,
+            ease REAL DEFAULT 2.5,
+            due_at INTEGER NOT NULL,
+            UNIQUE (user_id, front, back)
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_srs_user_due ON srs_cards(user_id, due_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_srs_due ON srs_cards(due_at)")
+        # Кому уже заведены карточки по пройденным урокам (srs.seed_once)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS srs_seeded (
+            user_id INTEGER PRIMARY KEY,
+            seeded_at INTEGER NOT NULL
+        )
+        """)
+
+        # Повторы неудачных утренних отправок (см. retry_queue.py)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS send_retries (
+            user_id INTEGER PRIMARY KEY,
+            level TEXT,
+            lesson_index INTEGER,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at INTEGER,
+            last_error TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at INTEGER
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_retries_due ON send_retries(status, next_attempt_at)")
+
+        # Отчёты о запусках рассылки (см. broadcast_report.py)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at INTEGER NOT NULL,
+            duration REAL,
+            owner TEXT,
+            sent INTEGER,
+            blocked INTEGER,
+            retried INTEGER,
+            failed INTEGER,
+            rate REAL,
+            report TEXT,
+            retry_sent INTEGER DEFAULT 0,
+            retry_blocked INTEGER DEFAULT 0,
+            retry_requeued INTEGER DEFAULT 0,
+            retry_failed INTEGER DEFAULT 0
+        )
+        """)
+        # Исходы повторов, дописываемые к запуску позже (broadcast_report.record_retry_outcome)
+        for col in ("retry_sent", "retry_blocked", "retry_requeued", "retry_failed"):
+            try:
+                c.execute(f"ALTER TABLE broadcast_runs ADD COLUMN {col} INTEGER DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass  # Колонка уже существует
+
+        # Аренды (см. leader.py): кто из экземпляров сейчас держит планировщик
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at INTEGER NOT NULL,
+            generation INTEGER NOT NULL DEFAULT 1
+        )
+        """)
+        try:
+            c.execute("ALTER TABLE leases ADD COLUMN generation INTEGER NOT NULL DEFAULT 1")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+
+        # Журнал событий: только INSERT, без индексов кроме rowid — дешёвая последовательная запись
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            user_id INTEGER,
+            type INTEGER NOT NULL,
+            payload TEXT,
+            seq INTEGER
+        )
+        """)
+        try:
+            c.execute("ALTER TABLE events ADD COLUMN seq INTEGER")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        else:
+            # Журнал без seq: нумеруем уже записанные события по id. Номера малы,
+            # поэтому все новые (stamp_events) окажутся после них
+            c.execute("""
+                UPDATE events SET seq = r.rn FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS rn
+                    FROM events WHERE user_id IS NOT NULL
+                ) AS r WHERE events.id = r.id
+            """)
+        # Журнал появился позже users: один раз записываем текущее состояние как точку отсчёта (seq 0)
+        if c.execute("SELECT 1 FROM events LIMIT 1").fetchone() is None:
+            c.execute(f"""
+                INSERT INTO events (ts, user_id, type, payload, seq)
+                SELECT CAST(strftime('%s', 'now') AS INTEGER), user_id, {EV_SNAPSHOT},
+                       level || '|' || lesson_index || '|' || status || '|' ||
+                       IFNULL(start_date, '') || '|' || IFNULL(last_sent_lesson_at, '') || '|' ||
+                       IFNULL(last_request_at, ''), 0
+                FROM users
+            """)
+
         c.execute("""
         CREATE TABLE IF NOT EXISTS user_errors (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -51,28 +412,46 @@ def init_db():
             created_at INTEGER
         )
         """)
+        # Покрывающий индекс для "слабых слов": агрегат читает только строки пользователя
+        c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_errors_user_token
+        ON user_errors(user_id, token, error_type)
+        """)
         conn.commit()
 
 def register_user(user_id: int, start_date: str, username: str = None, full_name: str = None):
     with get_conn() as conn:
         c = conn.cursor()
         c.execute("""
-            INSERT OR IGNORE INTO users (user_id, start_date, username, full_name)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, start_date, username, full_name))
+            INSERT OR IGNORE INTO users (user_id, start_date, username, full_name, last_active_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, start_date, username, full_name, int(time.time())))
+        created = c.rowcount == 1
+        _refresh_eligible(c, user_id)
+        events = stamp_events([(int(time.time()), user_id, EV_REGISTER, start_date)]) if created else []
         conn.commit()
+    event_log.add_rows(events)
 
 
 def get_user(user_id: int) -> Optional[Tuple]:
     with get_conn() as conn:
         c = conn.cursor()
-        c.execute("""SELECT user_id, level, lesson_index, manual_lessons_today,
-                            start_date, last_sent_lesson_at, last_request_at,
-                            status, reactivated_at
-                     FROM users WHERE user_id=?""", (user_id,))
+        c.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id=?", (user_id,))
         return c.fetchone()
 
 
+def get_users(user_ids: List[int], chunk: int = 500) -> Dict[int, Tuple]:
+    """Строки нескольких пользователей за пару запросов: {user_id: строка как в get_user}."""
+    out: Dict[int, Tuple] = {}
+    with get_conn() as conn:
+        for i in range(0, len(user_ids), chunk):
+            part = user_ids[i:i + chunk]
+            marks = ",".join("?" * len(part))
+            for row in conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id IN ({marks})", part):
+                out[row[0]] = row
+    return out
+
+
 def get_active_users() -> List[int]:
     with get_conn() as conn:
         c = conn.cursor()
@@ -80,6 +459,134 @@ def get_active_users() -> List[int]:
         return [r[0] for r in c.fetchall()]
 
 
+def get_due_users(day: int | None = None) -> List[int]:
+    """
+    Кому реально нужно отправить утренний урок сегодня: активные, не закончившие
+    уровень и у кого по частоте (tier) подошёл день отправки.
+    """
+    if day is None:
+        day = today_day()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT user_id FROM users WHERE eligible = 1 "
+            "AND (next_due_day IS NULL OR next_due_day <= ?)",
+            (day,)
+        )
+        return [r[0] for r in c.fetchall()]
+
+
+def due_users_page(after_id: int, day: int, limit: int) -> List[int]:
+    """
+    Страница get_due_users: следующие limit id после after_id по возрастанию.
+    Keyset по user_id идёт по частичному индексу idx_users_eligible и не зависит
+    от того, что рассылка тем временем меняет next_due_day у уже пройденных.
+    """
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT user_id FROM users WHERE eligible = 1 "
+            "AND (next_due_day IS NULL OR next_due_day <= ?) AND user_id > ? "
+            "ORDER BY user_id LIMIT ?",
+            (day, after_id, limit)
+        )
+        return [r[0] for r in c.fetchall()]
+
+
+def active_users_page(after_id: int, limit: int) -> List[int]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT user_id FROM users WHERE status='active' AND user_id > ? ORDER BY user_id LIMIT ?",
+            (after_id, limit)
+        )
+        return [r[0] for r in c.fetchall()]
+
+
+# NULL в last_active_at (активности не было ни разу) — как давно не заходивший
+_TIER_BY_ACTIVITY = """CASE
+    WHEN last_active_at >= :daily_from THEN 'daily'
+    WHEN last_active_at >= :weekly_from THEN 'few_days'
+    ELSE 'weekly'
+END"""
+
+
+def update_engagement_tiers(now: int | None = None):
+    """
+    Раскладывает пользователей по частоте рассылки по давности last_active_at:
+    до TIER_DAILY_DAYS — каждый день, до TIER_WEEKLY_DAYS — раз в несколько дней,
+    дальше — раз в неделю. Обратно в daily пользователя возвращает touch_activity,
+    поэтому здесь читаются только давно не заходившие (idx_users_inactive) и
+    пишутся только строки, у которых tier действительно меняется.
+    """
+    if now is None:
+        now = int(time.time())
+    daily_from = now - TIER_DAILY_DAYS * 86400
+    weekly_from = now - TIER_WEEKLY_DAYS * 86400
+    with get_conn() as conn:
+        c = conn.cursor()
+        # Два условия отдельными запросами: с OR SQLite сканирует весь индекс, а так — два поиска
+        for dormant in ("last_active_at < :daily_from", "last_active_at IS NULL"):
+            c.execute(f"""
+                UPDATE users SET tier = {_TIER_BY_ACTIVITY}
+                WHERE eligible = 1 AND {dormant}
+                  AND tier IS NOT {_TIER_BY_ACTIVITY}
+            """, {"daily_from": daily_from, "weekly_from": weekly_from})
+        conn.commit()
+
+
+def set_next_due(user_id: int, day: int | None = None):
+    """После утренней отправки: следующий урок через интервал, заданный tier."""
+    if day is None:
+        day = today_day()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            f"UPDATE users SET next_due_day = ? + {_TIER_INTERVAL_EXPR} WHERE user_id=?",
+            (day, user_id)
+        )
+        conn.commit()
+
+
+def get_tier_counts() -> List[Tuple[str, int]]:
+    """Сколько пользователей к отправке в каждом tier."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT tier, COUNT(*) FROM users WHERE eligible = 1 GROUP BY tier")
+        return c.fetchall()
+
+
+def estimate_daily_savings(tier_counts: List[Tuple[str, int]]) -> float:
+    """Сколько отправок в день экономим по сравнению с ежедневной рассылкой всем."""
+    saved = 0.0
+    for tier, count in tier_counts:
+        interval = TIER_INTERVALS.get(tier, 1)
+        saved += count * (1 - 1 / interval)
+    return saved
+
+
+def sync_level_totals(totals: Dict[str, int]) -> bool:
+    """
+    Записывает число уроков по уровням и пересчитывает флаг eligible.
+    Вызывать при старте и после перезагрузки lessons.json. Если числа не изменились,
+    ничего не пишет (eligible поддерживается при каждом изменении пользователя);
+    иначе обновляет только строки, у которых флаг действительно меняется.
+    Возвращает True, если level_totals поменялись.
+    """
+    with get_conn() as conn:
+        c = conn.cursor()
+        if dict(c.execute("SELECT level, total FROM level_totals").fetchall()) == totals:
+            return False
+        c.execute("DELETE FROM level_totals")
+        c.executemany(
+            "INSERT INTO level_totals (level, total) VALUES (?, ?)",
+            list(totals.items())
+        )
+        c.execute(f"UPDATE users SET eligible = {_ELIGIBLE_EXPR} WHERE eligible IS NOT {_ELIGIBLE_EXPR}")
+        conn.commit()
+        return True
+
+
 def set_level(user_id: int, level: str):
     with get_conn() as conn:
         c = conn.cursor()
@@ -87,7 +594,10 @@ def set_level(user_id: int, level: str):
             "UPDATE users SET level=?, lesson_index=0, manual_lessons_today=0 WHERE user_id=?",
             (level, user_id)
         )
+        _refresh_eligible(c, user_id)
+        events = stamp_events([(int(time.time()), user_id, EV_SET_LEVEL, level)])
         conn.commit()
+    event_log.add_rows(events)
 
 
 def reset_progress_to_first(user_id: int):
@@ -100,14 +610,20 @@ def reset_progress_to_first(user_id: int):
             "UPDATE users SET lesson_index=0, manual_lessons_today=0 WHERE user_id=?",
             (user_id,)
         )
+        _refresh_eligible(c, user_id)
+        events = stamp_events([(int(time.time()), user_id, EV_RESET, None)])
         conn.commit()
+    event_log.add_rows(events)
 
 
 def increment_lesson(user_id: int):
     with get_conn() as conn:
         c = conn.cursor()
         c.execute("UPDATE users SET lesson_index = lesson_index + 1 WHERE user_id=?", (user_id,))
+        _refresh_eligible(c, user_id)
+        events = stamp_events([(int(time.time()), user_id, EV_LESSON, None)])
         conn.commit()
+    event_log.add_rows(events)
 
 
 def set_last_sent(user_id: int, ts: int | None = None):
@@ -116,7 +632,9 @@ def set_last_sent(user_id: int, ts: int | None = None):
     with get_conn() as conn:
         c = conn.cursor()
         c.execute("UPDATE users SET last_sent_lesson_at=? WHERE user_id=?", (ts, user_id))
+        events = stamp_events([(ts, user_id, EV_SENT, None)])
         conn.commit()
+    event_log.add_rows(events)
 
 
 def set_last_request(user_id: int, ts: int | None = None):
@@ -124,7 +642,35 @@ def set_last_request(user_id: int, ts: int | None = None):
         ts = int(time.time())
     with get_conn() as conn:
         c = conn.cursor()
-        c.execute("UPDATE users SET last_request_at=? WHERE user_id=?", (ts, user_id))
+        # Пользователь проявил активность — возвращаем его на ежедневную рассылку
+        c.execute(
+            "UPDATE users SET last_request_at=?, tier='daily', next_due_day=NULL WHERE user_id=?",
+            (ts, user_id)
+        )
+        events = stamp_events([(ts, user_id, EV_REQUEST, None)])
+        conn.commit()
+    event_log.add_rows(events)
+
+
+# Вернуть на ежедневную рассылку; next_due_day не позже завтра, но и не раньше —
+# иначе урок, уже полученный сегодня, ушёл бы повторно
+_TOUCH_SQL = """
+    UPDATE users SET last_active_at = :ts, tier = 'daily',
+        next_due_day = CASE WHEN next_due_day > :day + 1 THEN :day + 1 ELSE next_due_day END
+    WHERE user_id = :uid AND (last_active_at IS NULL OR last_active_at <= :ts - :every)
+"""
+
+
+def touch_activity(user_id: int, ts: int | None = None):
+    """
+    Пользователь что-то нажал (любой обработчик, см. bot.activity_middleware).
+    Пишется не чаще раза в ACTIVITY_TOUCH_SECONDS: в остальное время UPDATE
+    не находит строку. В журнал events не попадает — это не поле проекции.
+    """
+    if ts is None:
+        ts = int(time.time())
+    with get_conn() as conn:
+        conn.execute(_TOUCH_SQL, {"uid": user_id, "ts": ts, "day": today_day(ts), "every": ACTIVITY_TOUCH_SECONDS})
         conn.commit()
 
 
@@ -157,7 +703,9 @@ def increment_manual(user_id: int):
             "UPDATE users SET manual_lessons_today = manual_lessons_today + 1 WHERE user_id=?",
             (user_id,)
         )
+        events = stamp_events([(int(time.time()), user_id, EV_MANUAL, None)])
         conn.commit()
+    event_log.add_rows(events)
 
 
 def can_take_manual(user_id: int, max_manual: int) -> bool:
@@ -171,7 +719,10 @@ def mark_blocked(user_id: int):
     with get_conn() as conn:
         c = conn.cursor()
         c.execute("UPDATE users SET status='blocked' WHERE user_id=?", (user_id,))
+        _refresh_eligible(c, user_id)
+        events = stamp_events([(int(time.time()), user_id, EV_BLOCKED, None)])
         conn.commit()
+    event_log.add_rows(events)
 
 
 def reactivate_if_blocked(user_id: int):
@@ -186,7 +737,182 @@ def reactivate_if_blocked(user_id: int):
                 "UPDATE users SET status='active', reactivated_at=? WHERE user_id=?",
                 (now, user_id)
             )
+            _refresh_eligible(c, user_id)
+            events = stamp_events([(now, user_id, EV_REACTIVATED, None)])
             conn.commit()
+        event_log.add_rows(events)
+
+
+def mark_blocked_many(user_ids: List[int]):
+    if not user_ids:
+        return
+    now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.executemany(
+            "UPDATE users SET status='blocked', eligible=0 WHERE user_id=?",
+            [(uid,) for uid in user_ids]
+        )
+        events = stamp_events([(now, uid, EV_BLOCKED, None) for uid in user_ids])
+        conn.commit()
+    event_log.add_rows(events)
+
+
+# -------- Совмещённые операции: проверка и запись одним UPDATE ... RETURNING --------
+
+# Тот же _ELIGIBLE_EXPR, но для lesson_index + 1 (в SET видны старые значения)
+_ELIGIBLE_AFTER_LESSON = """(status = 'active' AND lesson_index + 1 <
+    COALESCE((SELECT total FROM level_totals t WHERE t.level = users.level), 0))"""
+
+# Счётчик ручных уроков относится к прошлому дню (UTC), если last_request_at был раньше
+_NEW_DAY_EXPR = "(last_request_at IS NULL OR last_request_at / 86400 < :day)"
+
+
+def claim_manual_lesson(user_id: int, max_manual: int, ts: int | None = None) -> Optional[Tuple[str, int]]:
+    """
+    Ручной урок одним UPDATE: проверяет статус, конец уровня и дневной лимит
+    (со сбросом счётчика в новый день) и сразу продвигает прогресс.
+    Возвращает (level, индекс выданного урока) или None, если урок не положен.
+    """
+    if ts is None:
+        ts = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        row = c.execute(f"""
+            UPDATE users SET
+                manual_lessons_today = CASE WHEN {_NEW_DAY_EXPR} THEN 1 ELSE manual_lessons_today + 1 END,
+                lesson_index = lesson_index + 1,
+                last_request_at = :ts, last_sent_lesson_at = :ts,
+                tier = 'daily', next_due_day = NULL,
+                eligible = {_ELIGIBLE_AFTER_LESSON}
+            WHERE user_id = :uid AND status = 'active'
+              AND lesson_index < COALESCE((SELECT total FROM level_totals t WHERE t.level = users.level), 0)
+              AND ({_NEW_DAY_EXPR} OR manual_lessons_today < :max)
+            RETURNING level, lesson_index - 1
+        """, {"uid": user_id, "ts": ts, "day": today_day(ts), "max": max_manual}).fetchone()
+        if row is None:
+            return None
+        events = stamp_events([
+            (ts, user_id, EV_REQUEST, None), (ts, user_id, EV_LESSON, None),
+            (ts, user_id, EV_MANUAL, None), (ts, user_id, EV_SENT, None),
+        ])
+        conn.commit()
+    event_log.add_rows(events)
+    return row
+
+
+_MARK_SENT_SQL = f"""
+    UPDATE users SET
+        lesson_index = lesson_index + 1,
+        last_sent_lesson_at = ?,
+        next_due_day = ? + {_TIER_INTERVAL_EXPR},
+        eligible = {_ELIGIBLE_AFTER_LESSON}
+    WHERE user_id = ?
+"""
+
+
+# Fencing-токен аренды (см. leader.py): (name, owner, generation)
+Fence = Tuple[str, str, int]
+
+
+def mark_sent(user_id: int, ts: int | None = None, day: int | None = None, fence: Fence | None = None) -> bool:
+    """Утренний урок доставлен: increment_lesson + set_last_sent + set_next_due одной записью."""
+    return mark_sent_many([user_id], ts, day, fence)
+
+
+def mark_sent_many(user_ids: List[int], ts: int | None = None, day: int | None = None,
+                   fence: Fence | None = None) -> bool:
+    """
+    С fence запись проходит, только если аренда всё ещё наша, того же поколения и не
+    истекла: бывший лидер, который не успел заметить потерю аренды, не сдвинет прогресс
+    параллельно с новым. False — аренда потеряна, ничего не записано.
+    """
+    if not user_ids:
+        return True
+    if ts is None:
+        ts = int(time.time())
+    if day is None:
+        day = today_day(ts)
+    with get_conn() as conn:
+        c = conn.cursor()
+        if fence is not None:
+            # Пишущий запрос открывает транзакцию и берёт блокировку записи: до commit
+            # аренду никто не перехватит, проверка и обновление users атомарны
+            c.execute(
+                "UPDATE leases SET expires_at = expires_at "
+                "WHERE name = ? AND owner = ? AND generation = ? AND expires_at >= ?",
+                (*fence, int(time.time()))
+            )
+            if c.rowcount == 0:
+                conn.rollback()
+                return False
+        c.executemany(_MARK_SENT_SQL, [(ts, day, uid) for uid in user_ids])
+        events = []
+        for uid in user_ids:
+            events.append((ts, uid, EV_LESSON, None))
+            events.append((ts, uid, EV_SENT, None))
+        events = stamp_events(events)
+        conn.commit()
+    event_log.add_rows(events)
+    return True
+
+
+def acquire_lease(name: str, owner: str, ttl: int, now: int | None = None) -> Optional[int]:
+    """
+    Берёт или продлевает аренду name на ttl секунд. Удаётся, если аренды нет,
+    она уже наша или истекла; проверка и запись — один upsert.
+    Возвращает поколение аренды (растёт при каждой смене владельца) или None.
+    """
+    if now is None:
+        now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        row = c.execute("""
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at,
+                generation = leases.generation + (leases.owner <> excluded.owner)
+            WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            RETURNING generation
+        """, (name, owner, now + ttl, now)).fetchone()
+        conn.commit()
+        return row[0] if row else None
+
+
+def release_lease(name: str, owner: str):
+    # Строка остаётся, чтобы поколение не начиналось заново
+    with get_conn() as conn:
+        conn.execute("UPDATE leases SET expires_at = 0 WHERE name=? AND owner=?", (name, owner))
+        conn.commit()
+
+
+def discard_pending(user_id: int):
+    """
+    Строки пользователя, ещё лежащие в буферах (события, ответы квиза), не должны
+    попасть в базу после удаления: вызывать до DELETE.
+    """
+    for writer in BatchWriter.instances:
+        writer.discard_user(user_id)
+
+
+def delete_user_data(c, user_id: int):
+    """Данные пользователя вне users/events (всегда в SQLite, при любом хранилище)."""
+    for table in USER_DATA_TABLES:
+        c.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+
+def delete_user(user_id: int):
+    """
+    Удаляет все данные пользователя, включая его историю в events.
+    В журнал пишется только обезличенный факт удаления.
+    """
+    discard_pending(user_id)
+    with get_conn() as conn:
+        c = conn.cursor()
+        for table in ("users", "events"):
+            c.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        delete_user_data(c, user_id)
+        conn.commit()
+    log_event(None, EV_DELETED)
 
 
 # Оставляем на случай, если где-то ещё вызывается (но антифлуд ты вырубил)
@@ -195,7 +921,10 @@ def anti_flood_ok(user_id: int, cooldown: int) -> bool:
 
 
 def get_progress_text(user_id: int, total_lessons: int) -> str:
-    row = get_user(user_id)
+    return progress_text(get_user(user_id), total_lessons)
+
+
+def progress_text(row: Optional[Tuple], total_lessons: int) -> str:
     if not row:
         return "Нет данных по прогрессу. Нажми /start."
     (
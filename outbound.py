@@ -0,0 +1,136 @@
+"""
+Единый исходящий лимит на все вызовы Bot API с приоритетами.
+
+Каждый запрос (кроме getUpdates) берёт токен из общего ведра OUTBOUND_RATE/сек.
+Если токенов нет, запрос ждёт в очереди, и первым получает токен тот, у кого
+класс выше: ответы пользователям > админка > рассылка > повторы. Класс задаётся
+contextvar'ом request_priority, который наследуют задачи, созданные из текущей.
+Ответ 429 (TelegramRetryAfter) на любой запрос ставит на паузу все классы
+на retry_after секунд.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from typing import Dict, List, Tuple
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates
+from config import OUTBOUND_RATE, OUTBOUND_BURST
+
+INTERACTIVE = 0
+ADMIN = 1
+BROADCAST = 2
+RETRY = 3
+
+CLASS_NAMES = {INTERACTIVE: "interactive", ADMIN: "admin", BROADCAST: "broadcast", RETRY: "retry"}
+
+# По умолчанию запрос считается ответом пользователю
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+# Long polling не тратит лимит отправки и не должен стоять в очереди
+EXEMPT_METHODS = (GetUpdates,)
+
+
+class PriorityLimiter:
+    """Token bucket + очередь ожидающих по (приоритет, порядок прихода)."""
+
+    def __init__(self, rate: float = OUTBOUND_RATE, burst: int = OUTBOUND_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._waiting: Dict[int, int] = {p: 0 for p in CLASS_NAMES}
+        self._granted: Dict[int, int] = {p: 0 for p in CLASS_NAMES}
+        self._pump: asyncio.Task | None = None
+        self.pauses = 0
+        # Сколько секунд реального времени выдача стояла на паузе: перекрывающиеся
+        # 429 от параллельных запросов считаются один раз
+        self.paused_total = 0.0
+
+    def pause(self, seconds: float):
+        """
+        Telegram ответил 429: seconds секунд токены не выдаются никому, после паузы
+        ведро наполняется с нуля, без всплеска. Пауза не сокращается более короткой.
+        """
+        now = time.monotonic()
+        until = now + seconds
+        if until <= self._updated:
+            return
+        self.paused_total += until - max(self._updated, now)
+        self._tokens = 0.0
+        # _updated в будущем = пауза: _refill ничего не добавит до этого момента
+        self._updated = until
+        self.pauses += 1
+
+    def paused_for(self) -> float:
+        return max(0.0, self._updated - time.monotonic())
+
+    def _refill(self):
+        now = time.monotonic()
+        if now < self._updated:
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int):
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            self._granted[priority] = self._granted.get(priority, 0) + 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        try:
+            await fut
+        finally:
+            self._waiting[priority] -= 1
+
+    async def _run(self):
+        while self._waiters:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep(self.paused_for() + (1 - self._tokens) / self.rate)
+                continue
+            priority, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # ожидающий отменён
+                continue
+            self._tokens -= 1
+            self._granted[priority] = self._granted.get(priority, 0) + 1
+            fut.set_result(None)
+
+    def depths(self) -> Dict[str, int]:
+        """Сколько запросов сейчас ждёт токен, по классам."""
+        return {CLASS_NAMES[p]: n for p, n in self._waiting.items()}
+
+    def granted(self) -> Dict[str, int]:
+        return {CLASS_NAMES[p]: n for p, n in self._granted.items()}
+
+
+outbound_limiter = PriorityLimiter()
+
+
+async def priority_middleware(make_request, bot, method):
+    """Request-middleware aiogram: ждём токен своего класса, потом идём в сеть."""
+    if not isinstance(method, EXEMPT_METHODS):
+        await outbound_limiter.acquire(request_priority.get())
+    try:
+        return await make_request(bot, method)
+    except TelegramRetryAfter as e:
+        # Остальные воркеры рассылки не должны продолжать слать в тот же флуд-лимит
+        outbound_limiter.pause(e.retry_after)
+        raise
+
+
+def queue_stats_text() -> str:
+    depths = outbound_limiter.depths()
+    text = "📥 Очередь запросов: " + ", ".join(f"{name} {n}" for name, n in depths.items())
+    paused = outbound_limiter.paused_for()
+    if paused:
+        text += f"\n⏸ Пауза по 429: ещё {paused:.0f} с (всего пауз {outbound_limiter.pauses})"
+    return text
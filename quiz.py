@@ -0,0 +1,88 @@
+"""
+Квиз по словам и фразам пройденных уроков.
+Ответы пишутся в user_errors не по одному, а пачками через AnswerBuffer.
+user_errors — локальный SQLite: с STORAGE_BACKEND=postgres квиз отключён (config.LOCAL_FEATURES).
+"""
+import hashlib
+import hmac
+import random
+import time
+from typing import List, Optional, Tuple
+from config import BOT_TOKEN, QUIZ_FLUSH_SIZE, QUIZ_FLUSH_INTERVAL, LOCAL_FEATURES
+from models import get_conn, BatchWriter
+
+OPTIONS = 4
+RESULT_OK = "quiz_ok"
+RESULT_WRONG = "quiz_wrong"
+
+
+def quiz_pairs(obj: dict) -> List[Tuple[str, str]]:
+    """Пары (de, ru) урока для квиза: слова и фразы."""
+    pairs = []
+    for block in (obj.get("words", []) or [], obj.get("phrases", []) or []):
+        for pair in block:
+            if len(pair) == 2:
+                pairs.append((pair[0], pair[1]))
+    return pairs
+
+
+def make_question(pairs: List[Tuple[str, str]], rnd: random.Random = random) -> Optional[Tuple[int, List[int]]]:
+    """Индекс загаданной пары и перемешанные индексы вариантов ответа."""
+    if len(pairs) < 2:
+        return None
+    answer = rnd.randrange(len(pairs))
+    others = [i for i in range(len(pairs)) if i != answer]
+    options = rnd.sample(others, min(OPTIONS - 1, len(others))) + [answer]
+    rnd.shuffle(options)
+    return answer, options
+
+
+def question_rng(user_id: int, nonce: str) -> random.Random:
+    """
+    Генератор для make_question. В callback_data уходят только nonce и номер
+    варианта: по ним вопрос восстанавливается на любом экземпляре бота, а без
+    BOT_TOKEN правильный ответ из кнопок не вычислить.
+    """
+    key = (BOT_TOKEN or "").encode()
+    return random.Random(hmac.new(key, f"{user_id}:{nonce}".encode(), hashlib.sha256).digest())
+
+
+class AnswerBuffer(BatchWriter):
+    """
+    Копит ответы в памяти и пишет их в user_errors одним executemany:
+    когда набралось QUIZ_FLUSH_SIZE записей или по таймеру (run_flusher).
+    """
+
+    def __init__(self, max_size: int = QUIZ_FLUSH_SIZE, interval: float = QUIZ_FLUSH_INTERVAL):
+        super().__init__("""
+            INSERT INTO user_errors (user_id, level, lesson_index, token, error_type, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, max_size, interval, user_col=0)
+
+    def add(self, user_id: int, level: str, lesson_index: int, token: str, result: str):
+        self.add_row((user_id, level, lesson_index, token, result, int(time.time())))
+
+
+answer_buffer = AnswerBuffer()
+
+
+def weakest_words(user_id: int, limit: int = 5) -> List[Tuple[str, int, int]]:
+    """
+    Слова с наибольшим числом ошибок: (token, ошибок, всего ответов).
+    Читает только строки пользователя по покрывающему индексу (user_id, token, error_type).
+    """
+    if not LOCAL_FEATURES:
+        return []
+    answer_buffer.flush()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT token, SUM(error_type = ?) AS wrong, COUNT(*) AS total
+            FROM user_errors
+            WHERE user_id = ?
+            GROUP BY token
+            HAVING wrong > 0
+            ORDER BY wrong DESC, total ASC
+            LIMIT ?
+        """, (RESULT_WRONG, user_id, limit))
+        return c.fetchall()
@@ -0,0 +1,76 @@
+"""
+Очередь повторных отправок утреннего урока (таблица send_retries, создаётся в models.init_db).
+Неудачная отправка не ждёт внутри рассылки, а записывается сюда с временем следующей
+попытки; разбирает очередь фоновый цикл daily_send.run_retry_loop.
+"""
+import random
+import time
+from typing import List, Tuple
+from config import RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_MAX_ATTEMPTS
+from models import get_conn
+
+
+def backoff_delay(attempts: int, min_delay: float = 0) -> int:
+    """Экспоненциальная задержка со случайным джиттером, не меньше min_delay (retry_after от Telegram)."""
+    cap = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempts))
+    return int(max(min_delay, random.uniform(RETRY_BASE_DELAY, max(RETRY_BASE_DELAY, cap))))
+
+
+def schedule_retry(user_id: int, level: str, lesson_index: int, error: str, min_delay: float = 0):
+    """
+    Записывает (или обновляет) повтор для пользователя. После RETRY_MAX_ATTEMPTS
+    запись остаётся в таблице со статусом 'dead' — для разбора руками.
+    """
+    now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT attempts, level, lesson_index FROM send_retries WHERE user_id=?",
+            (user_id,)
+        )
+        row = c.fetchone()
+        # Попытки считаем только для того же урока
+        attempts = row[0] if row and (row[1], row[2]) == (level, lesson_index) else 0
+        status = "dead" if attempts + 1 >= RETRY_MAX_ATTEMPTS else "pending"
+        c.execute("""
+            INSERT INTO send_retries
+                (user_id, level, lesson_index, attempts, next_attempt_at, last_error, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                level=excluded.level, lesson_index=excluded.lesson_index,
+                attempts=excluded.attempts, next_attempt_at=excluded.next_attempt_at,
+                last_error=excluded.last_error, status=excluded.status
+        """, (
+            user_id, level, lesson_index, attempts + 1,
+            now + backoff_delay(attempts, min_delay), error[:500], status, now,
+        ))
+        conn.commit()
+
+
+def clear_retry(user_id: int):
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM send_retries WHERE user_id=?", (user_id,))
+        conn.commit()
+
+
+def fetch_due_retries(limit: int, now: int | None = None) -> List[Tuple[int, str, int, int]]:
+    """(user_id, level, lesson_index, attempts) для повторов, у которых подошло время."""
+    if now is None:
+        now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT user_id, level, lesson_index, attempts FROM send_retries
+            WHERE status='pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT ?
+        """, (now, limit))
+        return c.fetchall()
+
+
+def retry_counts() -> dict:
+    """Сколько повторов ждёт и сколько уже списано ('dead')."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT status, COUNT(*) FROM send_retries GROUP BY status")
+        return dict(c.fetchall())
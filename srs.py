@@ -0,0 +1,174 @@
+"""
+Интервальное повторение (SM-2) по словам, фразам и примерам из пройденных уроков.
+Карточки лежат в таблице srs_cards (создаётся в models.init_db) локального SQLite,
+поэтому с STORAGE_BACKEND=postgres повторение отключено (config.LOCAL_FEATURES):
+add_lesson_cards и due_counts ничего не делают, кнопки нет.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+from config import LOCAL_FEATURES
+from models import get_conn, today_day
+
+DAY = 86400
+MIN_EASE = 1.3
+
+# Оценки из кнопок: не помню / трудно / помню
+GRADE_AGAIN = 1
+GRADE_HARD = 3
+GRADE_GOOD = 5
+
+
+def lesson_cards(obj: dict) -> List[Tuple[str, str]]:
+    """Пары (de, ru) урока, из которых делаются карточки."""
+    pairs: List[Tuple[str, str]] = []
+    gram = obj.get("gram", {}) or {}
+    for block in (obj.get("words", []) or [], obj.get("phrases", []) or [], gram.get("examples", []) or []):
+        for pair in block:
+            if len(pair) == 2:
+                pairs.append((pair[0], pair[1]))
+    return pairs
+
+
+def _insert_cards(rows: List[Tuple]):
+    if not rows:
+        return
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.executemany("""
+            INSERT OR IGNORE INTO srs_cards (user_id, level, lesson_index, front, back, due_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+
+
+def add_lesson_cards(user_id: int, level: str, lesson_index: int, obj: Optional[dict],
+                     due_at: int | None = None):
+    """
+    Создаёт карточки урока одной транзакцией. Повторы (та же пара у пользователя)
+    игнорируются. Новые карточки по умолчанию ждут начала следующего дня (UTC).
+    """
+    if not obj or not LOCAL_FEATURES:
+        return
+    if due_at is None:
+        due_at = (today_day() + 1) * DAY
+    rows = [(user_id, level, lesson_index, de, ru, due_at) for de, ru in lesson_cards(obj)]
+    _insert_cards(rows)
+
+
+def seed_once(user_id: int, level: str, up_to: int, lessons: List[dict]) -> bool:
+    """
+    Для тех, кто прошёл уроки до появления повторения: карточки всех уже
+    изученных уроков, сразу доступные к повторению. Выполняется один раз на
+    пользователя (отметка в srs_seeded) — независимо от того, успели ли новые
+    уроки завести ему карточки через add_lesson_cards. Одна транзакция.
+    Возвращает True, если засев был сейчас.
+    """
+    now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("INSERT OR IGNORE INTO srs_seeded (user_id, seeded_at) VALUES (?, ?)", (user_id, now))
+        if c.rowcount == 0:
+            return False
+        rows = []
+        for i in range(min(up_to, len(lessons))):
+            for de, ru in lesson_cards(lessons[i]):
+                rows.append((user_id, level, i, de, ru, now))
+        c.executemany("""
+            INSERT OR IGNORE INTO srs_cards (user_id, level, lesson_index, front, back, due_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        return True
+
+
+def next_due_card(user_id: int, now: int | None = None) -> Optional[Tuple]:
+    """Самая просроченная карточка: (id, front, back) или None. Идёт по индексу (user_id, due_at)."""
+    if now is None:
+        now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT id, front, back FROM srs_cards
+            WHERE user_id=? AND due_at <= ?
+            ORDER BY due_at LIMIT 1
+        """, (user_id, now))
+        return c.fetchone()
+
+
+def get_card(card_id: int, user_id: int) -> Optional[Tuple]:
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, front, back FROM srs_cards WHERE id=? AND user_id=?",
+            (card_id, user_id)
+        )
+        return c.fetchone()
+
+
+def count_due(user_id: int, now: int | None = None) -> int:
+    if now is None:
+        now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM srs_cards WHERE user_id=? AND due_at <= ?", (user_id, now))
+        return c.fetchone()[0]
+
+
+def due_counts(user_ids: List[int] | None = None, now: int | None = None) -> Dict[int, int]:
+    """
+    Число карточек к повторению по пользователям — один агрегирующий запрос.
+    С user_ids — только для этой страницы рассылки (по индексу idx_srs_user_due).
+    """
+    if not LOCAL_FEATURES:
+        return {}
+    if now is None:
+        now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        if user_ids is None:
+            c.execute("SELECT user_id, COUNT(*) FROM srs_cards WHERE due_at <= ? GROUP BY user_id", (now,))
+        else:
+            marks = ",".join("?" * len(user_ids))
+            c.execute(
+                f"SELECT user_id, COUNT(*) FROM srs_cards WHERE user_id IN ({marks}) AND due_at <= ? "
+                "GROUP BY user_id",
+                (*user_ids, now)
+            )
+        return dict(c.fetchall())
+
+
+def sm2(quality: int, reps: int, interval: int, ease: float) -> Tuple[int, int, float]:
+    """Классический SM-2: по оценке 0..5 возвращает новые (reps, interval в днях, ease)."""
+    if quality < 3:
+        reps = 0
+        interval = 1
+    else:
+        reps += 1
+        if reps == 1:
+            interval = 1
+        elif reps == 2:
+            interval = 6
+        else:
+            interval = max(1, round(interval * ease))
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return reps, interval, ease
+
+
+def grade_card(card_id: int, user_id: int, quality: int, now: int | None = None):
+    if now is None:
+        now = int(time.time())
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT reps, interval, ease FROM srs_cards WHERE id=? AND user_id=?",
+            (card_id, user_id)
+        )
+        row = c.fetchone()
+        if not row:
+            return
+        reps, interval, ease = sm2(quality, *row)
+        c.execute(
+            "UPDATE srs_cards SET reps=?, interval=?, ease=?, due_at=? WHERE id=?",
+            (reps, interval, ease, now + interval * DAY, card_id)
+        )
+        conn.commit()
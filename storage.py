@@ -0,0 +1,677 @@
+"""
+Хранилище пользователей за одним асинхронным интерфейсом.
+
+Storage описывает все операции над users/level_totals, которые раньше вызывались
+напрямую из models.py (плюс пакетные и совмещённые), и две реализации:
+
+    SqliteStorage   — обёртка над функциями models.py, файл DB_PATH (по умолчанию)
+    PostgresStorage — asyncpg с пулом соединений; проверка и запись совмещены
+                      в UPDATE ... RETURNING, события пишутся в той же транзакции
+
+Выбор — STORAGE_BACKEND=sqlite|postgres (для postgres нужен DATABASE_URL и
+`pip install asyncpg`). Карточки SRS, ответы квиза, очередь повторов, отчёты о
+рассылках и снимок для админки остаются в локальном SQLite при любом хранилище;
+с postgres всё, что читает их из админки или кнопок, отключено (config.LOCAL_FEATURES).
+Очередь повторов разбирает лидер, который её записал: после смены лидера старые
+записи ждут, пока он снова станет лидером.
+"""
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from config import (
+    DEFAULT_LEVEL, TIER_DAILY_DAYS, TIER_WEEKLY_DAYS, BROADCAST_BATCH, ACTIVITY_TOUCH_SECONDS,
+    STORAGE_BACKEND, DATABASE_URL, PG_POOL_MIN, PG_POOL_MAX,
+)
+import models
+from models import (
+    USER_COLUMNS, TIER_INTERVALS, Fence, today_day, progress_text, stamp_events,
+    EV_REGISTER, EV_SET_LEVEL, EV_RESET, EV_LESSON, EV_BLOCKED, EV_REACTIVATED,
+    EV_DELETED, EV_MANUAL, EV_REQUEST, EV_SENT,
+)
+
+
+class Storage(ABC):
+    """Интерфейс хранилища; строка пользователя — кортеж в порядке models.USER_COLUMNS."""
+
+    async def open(self):
+        """Подключение и создание схемы. Вызывается один раз при старте."""
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def register_user(self, user_id: int, start_date: str, username: str = None, full_name: str = None):
+        ...
+
+    @abstractmethod
+    async def get_user(self, user_id: int) -> Optional[Tuple]:
+        ...
+
+    @abstractmethod
+    async def get_users(self, user_ids: List[int]) -> Dict[int, Tuple]:
+        ...
+
+    @abstractmethod
+    async def get_active_users(self) -> List[int]:
+        ...
+
+    @abstractmethod
+    async def get_due_users(self, day: int | None = None) -> List[int]:
+        ...
+
+    @abstractmethod
+    async def due_users_page(self, after_id: int, day: int, limit: int) -> List[int]:
+        ...
+
+    @abstractmethod
+    async def active_users_page(self, after_id: int, limit: int) -> List[int]:
+        ...
+
+    async def iter_due_users(self, day: int | None = None, batch: int = BROADCAST_BATCH) -> AsyncIterator[List[int]]:
+        """Кому слать сегодня — страницами по batch id, без списка всех пользователей в памяти."""
+        if day is None:
+            day = today_day()
+        after = 0
+        while True:
+            page = await self.due_users_page(after, day, batch)
+            if not page:
+                return
+            yield page
+            after = page[-1]
+
+    async def iter_active_users(self, batch: int = BROADCAST_BATCH) -> AsyncIterator[List[int]]:
+        after = 0
+        while True:
+            page = await self.active_users_page(after, batch)
+            if not page:
+                return
+            yield page
+            after = page[-1]
+
+    @abstractmethod
+    async def update_engagement_tiers(self, now: int | None = None):
+        ...
+
+    @abstractmethod
+    async def set_next_due(self, user_id: int, day: int | None = None):
+        ...
+
+    @abstractmethod
+    async def get_tier_counts(self) -> List[Tuple[str, int]]:
+        ...
+
+    @abstractmethod
+    async def sync_level_totals(self, totals: Dict[str, int]) -> bool:
+        """True, если числа уроков изменились и eligible пересчитан."""
+
+    @abstractmethod
+    async def set_level(self, user_id: int, level: str):
+        ...
+
+    @abstractmethod
+    async def reset_progress_to_first(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def increment_lesson(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def set_last_sent(self, user_id: int, ts: int | None = None):
+        ...
+
+    @abstractmethod
+    async def set_last_request(self, user_id: int, ts: int | None = None):
+        ...
+
+    @abstractmethod
+    async def touch_activity(self, user_id: int, ts: int | None = None):
+        """Любое действие пользователя: last_active_at и tier 'daily' (см. models.touch_activity)."""
+
+    @abstractmethod
+    async def reset_manual_if_new_day(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def increment_manual(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def can_take_manual(self, user_id: int, max_manual: int) -> bool:
+        ...
+
+    @abstractmethod
+    async def mark_blocked(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def mark_blocked_many(self, user_ids: List[int]):
+        ...
+
+    @abstractmethod
+    async def reactivate_if_blocked(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def delete_user(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def claim_manual_lesson(self, user_id: int, max_manual: int,
+                                  ts: int | None = None) -> Optional[Tuple[str, int]]:
+        """Ручной урок: проверка лимитов и продвижение прогресса атомарно. (level, index) или None."""
+
+    @abstractmethod
+    async def mark_sent(self, user_id: int, ts: int | None = None, day: int | None = None,
+                        fence: Fence | None = None) -> bool:
+        ...
+
+    @abstractmethod
+    async def mark_sent_many(self, user_ids: List[int], ts: int | None = None, day: int | None = None,
+                             fence: Fence | None = None) -> bool:
+        """С fence — только пока аренда действительна (см. models.mark_sent_many); False — потеряна."""
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, owner: str, ttl: int) -> Optional[int]:
+        """Взять/продлить аренду (см. leader.py): поколение аренды или None, если её держит другой."""
+
+    @abstractmethod
+    async def release_lease(self, name: str, owner: str):
+        ...
+
+    async def get_progress_text(self, user_id: int, total_lessons: int) -> str:
+        return progress_text(await self.get_user(user_id), total_lessons)
+
+
+class SqliteStorage(Storage):
+    """Текущая схема в файле DB_PATH: каждая операция — функция models.py."""
+
+    async def open(self):
+        models.init_db()
+
+    async def register_user(self, user_id, start_date, username=None, full_name=None):
+        models.register_user(user_id, start_date, username, full_name)
+
+    async def get_user(self, user_id):
+        return models.get_user(user_id)
+
+    async def get_users(self, user_ids):
+        return models.get_users(user_ids)
+
+    async def get_active_users(self):
+        return models.get_active_users()
+
+    async def get_due_users(self, day=None):
+        return models.get_due_users(day)
+
+    async def due_users_page(self, after_id, day, limit):
+        return models.due_users_page(after_id, day, limit)
+
+    async def active_users_page(self, after_id, limit):
+        return models.active_users_page(after_id, limit)
+
+    async def update_engagement_tiers(self, now=None):
+        models.update_engagement_tiers(now)
+
+    async def set_next_due(self, user_id, day=None):
+        models.set_next_due(user_id, day)
+
+    async def get_tier_counts(self):
+        return models.get_tier_counts()
+
+    async def sync_level_totals(self, totals):
+        # Пересчёт eligible по всей таблице — в потоке, чтобы не держать event loop
+        return await asyncio.to_thread(models.sync_level_totals, totals)
+
+    async def set_level(self, user_id, level):
+        models.set_level(user_id, level)
+
+    async def reset_progress_to_first(self, user_id):
+        models.reset_progress_to_first(user_id)
+
+    async def increment_lesson(self, user_id):
+        models.increment_lesson(user_id)
+
+    async def set_last_sent(self, user_id, ts=None):
+        models.set_last_sent(user_id, ts)
+
+    async def set_last_request(self, user_id, ts=None):
+        models.set_last_request(user_id, ts)
+
+    async def touch_activity(self, user_id, ts=None):
+        models.touch_activity(user_id, ts)
+
+    async def reset_manual_if_new_day(self, user_id):
+        models.reset_manual_if_new_day(user_id)
+
+    async def increment_manual(self, user_id):
+        models.increment_manual(user_id)
+
+    async def can_take_manual(self, user_id, max_manual):
+        return models.can_take_manual(user_id, max_manual)
+
+    async def mark_blocked(self, user_id):
+        models.mark_blocked(user_id)
+
+    async def mark_blocked_many(self, user_ids):
+        models.mark_blocked_many(user_ids)
+
+    async def reactivate_if_blocked(self, user_id):
+        models.reactivate_if_blocked(user_id)
+
+    async def delete_user(self, user_id):
+        models.delete_user(user_id)
+
+    async def claim_manual_lesson(self, user_id, max_manual, ts=None):
+        return models.claim_manual_lesson(user_id, max_manual, ts)
+
+    async def mark_sent(self, user_id, ts=None, day=None, fence=None):
+        return models.mark_sent(user_id, ts, day, fence)
+
+    async def mark_sent_many(self, user_ids, ts=None, day=None, fence=None):
+        return models.mark_sent_many(user_ids, ts, day, fence)
+
+    async def acquire_lease(self, name, owner, ttl):
+        return models.acquire_lease(name, owner, ttl)
+
+    async def release_lease(self, name, owner):
+        models.release_lease(name, owner)
+
+
+# -------- PostgreSQL --------
+
+_PG_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        level TEXT DEFAULT '{DEFAULT_LEVEL}',
+        lesson_index INTEGER DEFAULT 0,
+        manual_lessons_today INTEGER DEFAULT 0,
+        start_date TEXT,
+        last_sent_lesson_at BIGINT,
+        last_request_at BIGINT,
+        status TEXT DEFAULT 'active',
+        reactivated_at BIGINT,
+        username TEXT,
+        full_name TEXT,
+        eligible SMALLINT DEFAULT 1,
+        tier TEXT DEFAULT 'daily',
+        next_due_day INTEGER,
+        last_active_at BIGINT
+    )
+    """,
+    "ALTER TABLE users DROP COLUMN IF EXISTS event_seq",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_active_at BIGINT",
+    """
+    CREATE TABLE IF NOT EXISTS level_totals (
+        level TEXT PRIMARY KEY,
+        total INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_users_eligible ON users(user_id) WHERE eligible = 1",
+    "DROP INDEX IF EXISTS idx_users_dormant",
+    "CREATE INDEX IF NOT EXISTS idx_users_inactive ON users(last_active_at) WHERE eligible = 1",
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id BIGSERIAL PRIMARY KEY,
+        ts BIGINT NOT NULL,
+        user_id BIGINT,
+        type SMALLINT NOT NULL,
+        payload TEXT,
+        seq BIGINT
+    )
+    """,
+    "ALTER TABLE events ADD COLUMN IF NOT EXISTS seq BIGINT",
+    """
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at BIGINT NOT NULL,
+        generation BIGINT NOT NULL DEFAULT 1
+    )
+    """,
+    "ALTER TABLE leases ADD COLUMN IF NOT EXISTS generation BIGINT NOT NULL DEFAULT 1",
+]
+
+_PG_TOTAL = "COALESCE((SELECT total FROM level_totals t WHERE t.level = users.level), 0)"
+_PG_ELIGIBLE = f"CASE WHEN status = 'active' AND lesson_index < {_PG_TOTAL} THEN 1 ELSE 0 END"
+_PG_ELIGIBLE_AFTER_LESSON = f"CASE WHEN status = 'active' AND lesson_index + 1 < {_PG_TOTAL} THEN 1 ELSE 0 END"
+_PG_TIER_INTERVAL = "CASE tier " + " ".join(
+    f"WHEN '{t}' THEN {d}" for t, d in TIER_INTERVALS.items()
+) + " ELSE 1 END"
+
+# Время аренды — часы сервера базы, а не хоста экземпляра: расхождение часов между
+# экземплярами не даёт двум считать себя лидером одновременно
+_PG_NOW = "extract(epoch from now())::bigint"
+
+_PG_INSERT_EVENT = "INSERT INTO events (ts, user_id, type, payload, seq) VALUES ($1, $2, $3, $4, $5)"
+
+
+async def _insert_events(conn, events: List[Tuple]):
+    """events: (ts, user_id, type, payload); seq — models.stamp_events, без записей в users."""
+    await conn.executemany(_PG_INSERT_EVENT, stamp_events(events))
+
+
+class PostgresStorage(Storage):
+    """
+    users, level_totals и events в PostgreSQL. Все обращения идут через пул asyncpg;
+    изменение и запись события — одна транзакция, поэтому журнал не расходится с users.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL, min_size: int = PG_POOL_MIN, max_size: int = PG_POOL_MAX):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def open(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=postgres требует пакет asyncpg (pip install asyncpg)")
+        if not self.dsn:
+            raise RuntimeError("STORAGE_BACKEND=postgres требует DATABASE_URL")
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self.pool.acquire() as conn:
+            had_activity = await conn.fetchval(
+                "SELECT 1 FROM information_schema.columns WHERE table_name = 'users' AND column_name = 'last_active_at'"
+            )
+            for ddl in _PG_SCHEMA:
+                await conn.execute(ddl)
+            if not had_activity:
+                # Как в models.init_db: до появления колонки активностью был last_request_at
+                await conn.execute("UPDATE users SET last_active_at = last_request_at")
+        # SRS, квиз и повторы по-прежнему в SQLite
+        await asyncio.to_thread(models.init_db)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _write(self, sql: str, args: tuple, events: List[Tuple] = (), fetch: bool = False):
+        """UPDATE/INSERT и события в одной транзакции; при fetch возвращает строку RETURNING."""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(sql, *args) if fetch else await conn.execute(sql, *args)
+                if fetch and row is None:
+                    return None
+                if events:
+                    await _insert_events(conn, events)
+                return row
+
+    async def register_user(self, user_id, start_date, username=None, full_name=None):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                created = await conn.fetchval("""
+                    INSERT INTO users (user_id, start_date, username, full_name, last_active_at)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (user_id) DO NOTHING
+                    RETURNING user_id
+                """, user_id, start_date, username, full_name, int(time.time()))
+                await conn.execute(f"UPDATE users SET eligible = {_PG_ELIGIBLE} WHERE user_id = $1", user_id)
+                if created is not None:
+                    await _insert_events(conn, [(int(time.time()), user_id, EV_REGISTER, start_date)])
+
+    async def get_user(self, user_id):
+        row = await self.pool.fetchrow(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = $1", user_id)
+        return tuple(row) if row else None
+
+    async def get_users(self, user_ids):
+        rows = await self.pool.fetch(
+            f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ANY($1::bigint[])", list(user_ids)
+        )
+        return {r[0]: tuple(r) for r in rows}
+
+    async def get_active_users(self):
+        rows = await self.pool.fetch("SELECT user_id FROM users WHERE status = 'active'")
+        return [r[0] for r in rows]
+
+    async def get_due_users(self, day=None):
+        if day is None:
+            day = today_day()
+        rows = await self.pool.fetch(
+            "SELECT user_id FROM users WHERE eligible = 1 AND (next_due_day IS NULL OR next_due_day <= $1)",
+            day
+        )
+        return [r[0] for r in rows]
+
+    async def due_users_page(self, after_id, day, limit):
+        rows = await self.pool.fetch(
+            "SELECT user_id FROM users WHERE eligible = 1 AND (next_due_day IS NULL OR next_due_day <= $1) "
+            "AND user_id > $2 ORDER BY user_id LIMIT $3",
+            day, after_id, limit
+        )
+        return [r[0] for r in rows]
+
+    async def active_users_page(self, after_id, limit):
+        rows = await self.pool.fetch(
+            "SELECT user_id FROM users WHERE status = 'active' AND user_id > $1 ORDER BY user_id LIMIT $2",
+            after_id, limit
+        )
+        return [r[0] for r in rows]
+
+    async def update_engagement_tiers(self, now=None):
+        if now is None:
+            now = int(time.time())
+        # Как в models.update_engagement_tiers: только давно не заходившие и только смена tier
+        await self.pool.execute("""
+            UPDATE users SET tier = CASE WHEN last_active_at >= $2 THEN 'few_days' ELSE 'weekly' END
+            WHERE eligible = 1 AND (last_active_at < $1 OR last_active_at IS NULL)
+              AND tier IS DISTINCT FROM CASE WHEN last_active_at >= $2 THEN 'few_days' ELSE 'weekly' END
+        """, now - TIER_DAILY_DAYS * 86400, now - TIER_WEEKLY_DAYS * 86400)
+
+    async def set_next_due(self, user_id, day=None):
+        if day is None:
+            day = today_day()
+        await self.pool.execute(
+            f"UPDATE users SET next_due_day = $1 + {_PG_TIER_INTERVAL} WHERE user_id = $2", day, user_id
+        )
+
+    async def get_tier_counts(self):
+        rows = await self.pool.fetch("SELECT tier, COUNT(*) FROM users WHERE eligible = 1 GROUP BY tier")
+        return [tuple(r) for r in rows]
+
+    async def sync_level_totals(self, totals):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                current = await conn.fetch("SELECT level, total FROM level_totals")
+                if {r[0]: r[1] for r in current} == totals:
+                    return False
+                await conn.execute("DELETE FROM level_totals")
+                await conn.executemany(
+                    "INSERT INTO level_totals (level, total) VALUES ($1, $2)", list(totals.items())
+                )
+                await conn.execute(
+                    f"UPDATE users SET eligible = {_PG_ELIGIBLE} WHERE eligible IS DISTINCT FROM {_PG_ELIGIBLE}"
+                )
+                return True
+
+    async def set_level(self, user_id, level):
+        # eligible считается по новому уровню, поэтому level_totals берётся по $2
+        await self._write("""
+            UPDATE users SET level = $2, lesson_index = 0, manual_lessons_today = 0,
+                eligible = CASE WHEN status = 'active' AND 0 <
+                    COALESCE((SELECT total FROM level_totals t WHERE t.level = $2), 0) THEN 1 ELSE 0 END
+            WHERE user_id = $1
+        """, (user_id, level), [(int(time.time()), user_id, EV_SET_LEVEL, level)])
+
+    async def reset_progress_to_first(self, user_id):
+        await self._write(f"""
+            UPDATE users SET lesson_index = 0, manual_lessons_today = 0,
+                eligible = CASE WHEN status = 'active' AND 0 < {_PG_TOTAL} THEN 1 ELSE 0 END
+            WHERE user_id = $1
+        """, (user_id,), [(int(time.time()), user_id, EV_RESET, None)])
+
+    async def increment_lesson(self, user_id):
+        await self._write(
+            f"UPDATE users SET lesson_index = lesson_index + 1, eligible = {_PG_ELIGIBLE_AFTER_LESSON} "
+            "WHERE user_id = $1",
+            (user_id,), [(int(time.time()), user_id, EV_LESSON, None)]
+        )
+
+    async def set_last_sent(self, user_id, ts=None):
+        if ts is None:
+            ts = int(time.time())
+        await self._write(
+            "UPDATE users SET last_sent_lesson_at = $2 WHERE user_id = $1",
+            (user_id, ts), [(ts, user_id, EV_SENT, None)]
+        )
+
+    async def set_last_request(self, user_id, ts=None):
+        if ts is None:
+            ts = int(time.time())
+        await self._write(
+            "UPDATE users SET last_request_at = $2, tier = 'daily', next_due_day = NULL WHERE user_id = $1",
+            (user_id, ts), [(ts, user_id, EV_REQUEST, None)]
+        )
+
+    async def touch_activity(self, user_id, ts=None):
+        if ts is None:
+            ts = int(time.time())
+        await self.pool.execute("""
+            UPDATE users SET last_active_at = $2, tier = 'daily',
+                next_due_day = CASE WHEN next_due_day > $3 + 1 THEN $3 + 1 ELSE next_due_day END
+            WHERE user_id = $1 AND (last_active_at IS NULL OR last_active_at <= $2 - $4)
+        """, user_id, ts, today_day(ts), ACTIVITY_TOUCH_SECONDS)
+
+    async def reset_manual_if_new_day(self, user_id):
+        await self.pool.execute(
+            "UPDATE users SET manual_lessons_today = 0 "
+            "WHERE user_id = $1 AND (last_request_at IS NULL OR last_request_at / 86400 < $2)",
+            user_id, today_day()
+        )
+
+    async def increment_manual(self, user_id):
+        await self._write(
+            "UPDATE users SET manual_lessons_today = manual_lessons_today + 1 WHERE user_id = $1",
+            (user_id,), [(int(time.time()), user_id, EV_MANUAL, None)]
+        )
+
+    async def can_take_manual(self, user_id, max_manual):
+        ok = await self.pool.fetchval(
+            "SELECT manual_lessons_today < $2 FROM users WHERE user_id = $1", user_id, max_manual
+        )
+        return bool(ok)
+
+    async def mark_blocked(self, user_id):
+        await self.mark_blocked_many([user_id])
+
+    async def mark_blocked_many(self, user_ids):
+        if not user_ids:
+            return
+        now = int(time.time())
+        await self._write(
+            "UPDATE users SET status = 'blocked', eligible = 0 WHERE user_id = ANY($1::bigint[])",
+            (list(user_ids),), [(now, uid, EV_BLOCKED, None) for uid in user_ids]
+        )
+
+    async def reactivate_if_blocked(self, user_id):
+        now = int(time.time())
+        # Проверка статуса и запись — один UPDATE; событие только если статус сменился
+        await self._write(f"""
+            UPDATE users SET status = 'active', reactivated_at = $2,
+                eligible = CASE WHEN lesson_index < {_PG_TOTAL} THEN 1 ELSE 0 END
+            WHERE user_id = $1 AND status = 'blocked'
+            RETURNING user_id
+        """, (user_id, now), [(now, user_id, EV_REACTIVATED, None)], fetch=True)
+
+    async def delete_user(self, user_id):
+        models.discard_pending(user_id)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM users WHERE user_id = $1", user_id)
+                await conn.execute("DELETE FROM events WHERE user_id = $1", user_id)
+                await _insert_events(conn, [(int(time.time()), None, EV_DELETED, None)])
+        await asyncio.to_thread(_delete_sqlite_user_data, user_id)
+
+    async def claim_manual_lesson(self, user_id, max_manual, ts=None):
+        if ts is None:
+            ts = int(time.time())
+        new_day = "(last_request_at IS NULL OR last_request_at / 86400 < $3)"
+        row = await self._write(f"""
+            UPDATE users SET
+                manual_lessons_today = CASE WHEN {new_day} THEN 1 ELSE manual_lessons_today + 1 END,
+                lesson_index = lesson_index + 1,
+                last_request_at = $2, last_sent_lesson_at = $2,
+                tier = 'daily', next_due_day = NULL,
+                eligible = {_PG_ELIGIBLE_AFTER_LESSON}
+            WHERE user_id = $1 AND status = 'active'
+              AND lesson_index < {_PG_TOTAL}
+              AND ({new_day} OR manual_lessons_today < $4)
+            RETURNING level, lesson_index - 1
+        """, (user_id, ts, today_day(ts), max_manual), [
+            (ts, user_id, EV_REQUEST, None), (ts, user_id, EV_LESSON, None),
+            (ts, user_id, EV_MANUAL, None), (ts, user_id, EV_SENT, None),
+        ], fetch=True)
+        return tuple(row) if row else None
+
+    async def mark_sent(self, user_id, ts=None, day=None, fence=None):
+        return await self.mark_sent_many([user_id], ts, day, fence)
+
+    async def mark_sent_many(self, user_ids, ts=None, day=None, fence=None):
+        if not user_ids:
+            return True
+        if ts is None:
+            ts = int(time.time())
+        if day is None:
+            day = today_day(ts)
+        events = []
+        for uid in user_ids:
+            events.append((ts, uid, EV_LESSON, None))
+            events.append((ts, uid, EV_SENT, None))
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # FOR SHARE держит строку аренды до commit: перехватить её посреди записи нельзя
+                if fence is not None and await conn.fetchval(f"""
+                    SELECT 1 FROM leases
+                    WHERE name = $1 AND owner = $2 AND generation = $3 AND expires_at >= {_PG_NOW}
+                    FOR SHARE
+                """, *fence) is None:
+                    return False
+                await conn.execute(f"""
+                    UPDATE users SET
+                        lesson_index = lesson_index + 1,
+                        last_sent_lesson_at = $2,
+                        next_due_day = $3 + {_PG_TIER_INTERVAL},
+                        eligible = {_PG_ELIGIBLE_AFTER_LESSON}
+                    WHERE user_id = ANY($1::bigint[])
+                """, list(user_ids), ts, day)
+                await _insert_events(conn, events)
+        return True
+
+    async def acquire_lease(self, name, owner, ttl):
+        return await self.pool.fetchval(f"""
+            INSERT INTO leases (name, owner, expires_at) VALUES ($1, $2, {_PG_NOW} + $3)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at,
+                generation = leases.generation + CASE WHEN leases.owner = excluded.owner THEN 0 ELSE 1 END
+            WHERE leases.owner = excluded.owner OR leases.expires_at < {_PG_NOW}
+            RETURNING generation
+        """, name, owner, ttl)
+
+    async def release_lease(self, name, owner):
+        # Строка остаётся, чтобы поколение не начиналось заново
+        await self.pool.execute("UPDATE leases SET expires_at = 0 WHERE name = $1 AND owner = $2", name, owner)
+
+
+def _delete_sqlite_user_data(user_id: int):
+    with models.get_conn() as conn:
+        models.delete_user_data(conn.cursor(), user_id)
+        conn.commit()
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """Хранилище процесса по STORAGE_BACKEND (создаётся при первом вызове)."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "postgres":
+            _storage = PostgresStorage()
+        elif STORAGE_BACKEND == "sqlite":
+            _storage = SqliteStorage()
+        else:
+            raise RuntimeError(f"Неизвестный STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
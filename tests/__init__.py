@@ -0,0 +1,11 @@
+"""
+Тесты: python -m unittest (или pytest) из корня репозитория.
+Рабочая база не трогается: DB_PATH указывает на временный каталог до импорта config.
+"""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ["DB_PATH"] = os.path.join(_tmp, "users.db")
+os.environ["ANALYTICS_DB_PATH"] = os.path.join(_tmp, "users.db.analytics")
+os.environ.setdefault("BOT_TOKEN", "123:test")
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import unittest
+from unittest import mock
+
+import admin
+import analytics
+from config import ANALYTICS_DB_PATH
+
+
+def fake_message(user_id):
+    message = mock.Mock()
+    message.from_user.id = user_id
+    message.answer = mock.AsyncMock()
+    message.answer_document = mock.AsyncMock()
+    return message
+
+
+class BackupGuardTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_non_admin_gets_no_backup(self):
+        message = fake_message(1)
+        with mock.patch("config.ADMIN_IDS", [2]), \
+                mock.patch.object(admin, "refresh_snapshot_async", mock.AsyncMock()) as refresh:
+            await admin.cmd_backup_db(message)
+        refresh.assert_not_awaited()
+        message.answer_document.assert_not_awaited()
+
+    async def test_admin_gets_backup(self):
+        message = fake_message(2)
+        with mock.patch("config.ADMIN_IDS", [2]):
+            await admin.cmd_backup_db(message)
+        message.answer_document.assert_awaited_once()
+
+
+class SnapshotTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        if os.path.exists(ANALYTICS_DB_PATH):
+            os.remove(ANALYTICS_DB_PATH)
+
+    async def test_conn_does_not_take_snapshot(self):
+        with mock.patch.object(analytics, "refresh_snapshot") as refresh:
+            with self.assertRaises(sqlite3.OperationalError):
+                analytics.get_analytics_conn().execute("SELECT 1 FROM users")
+        refresh.assert_not_called()
+
+    async def test_ensure_snapshot_only_when_missing(self):
+        await analytics.ensure_snapshot()
+        self.assertTrue(os.path.exists(ANALYTICS_DB_PATH))
+        with mock.patch.object(analytics, "refresh_snapshot_async", mock.AsyncMock()) as refresh:
+            await analytics.ensure_snapshot()
+        refresh.assert_not_awaited()
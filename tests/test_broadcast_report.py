@@ -0,0 +1,119 @@
+import json
+import time
+import unittest
+
+import models
+from broadcast_report import (
+    BroadcastReport, save_report, record_retry_outcome, recent_runs, history_text, report_text,
+    SLOWEST_KEEP, SENT, BLOCKED, RETRIED, FAILED, SKIPPED,
+)
+
+
+def make_report(sent: int, duration: float, started_at: float | None = None) -> BroadcastReport:
+    report = BroadcastReport(owner="w0")
+    report.started_at = time.time() - duration
+    for uid in range(sent):
+        report.record(uid, "A1", SENT, 0.01)
+    # Дата запуска сдвигается после записи: интервалы графика считаются от started_at
+    if started_at is not None:
+        report.started_at = started_at
+    report.finished_at = report.started_at + duration
+    return report
+
+
+class BroadcastReportTest(unittest.TestCase):
+
+    def test_counts_by_outcome_and_level(self):
+        report = BroadcastReport(owner="w0")
+        report.record(1, "A1", SENT, 0.1)
+        report.record(2, "A1", BLOCKED)
+        report.record(3, "A2", SENT, 0.2)
+        report.record(4, "A2", RETRIED)
+        report.record_pause(5.5)
+        report.finish()
+        data = report.to_dict()
+        self.assertEqual(data["outcomes"], {SENT: 2, BLOCKED: 1, RETRIED: 1})
+        self.assertEqual(data["levels"], {"A1": {SENT: 1, BLOCKED: 1}, "A2": {SENT: 1, RETRIED: 1}})
+        self.assertEqual(data["retry_after_total"], 5.5)
+        self.assertEqual(data["owner"], "w0")
+        text = report_text(data)
+        self.assertIn("✅ отправлено: <b>2</b>", text)
+        self.assertIn("Ожидание по 429: 6 с", text)
+
+    def test_keeps_only_slowest(self):
+        report = BroadcastReport()
+        for uid in range(20):
+            report.record(uid, "A1", SENT, uid / 100)
+        slowest = report.to_dict()["slowest"]
+        self.assertEqual(len(slowest), SLOWEST_KEEP)
+        self.assertEqual([s["user_id"] for s in slowest], [19, 18, 17, 16, 15])
+        self.assertEqual(slowest[0]["ms"], 190)
+
+    def test_rate_and_timeline(self):
+        report = make_report(sent=50, duration=25)
+        self.assertAlmostEqual(report.rate, 2.0)
+        # Все отправки записаны «сейчас», через 25 с после начала — третий интервал
+        self.assertEqual(report.timeline(), [0.0, 0.0, 5.0])
+        self.assertEqual(BroadcastReport().timeline(), [])
+
+
+class SavedRunsTest(unittest.TestCase):
+
+    def setUp(self):
+        models.init_db()
+        with models.get_conn() as conn:
+            conn.execute("DELETE FROM broadcast_runs")
+            conn.commit()
+
+    def save(self, sent: int, duration: float, start: int):
+        return save_report(make_report(sent, duration, started_at=start))
+
+    def test_save_report(self):
+        report = make_report(sent=10, duration=5, started_at=1_700_000_000)
+        report.record(99, "A1", FAILED)
+        run_id = save_report(report)
+        with models.get_conn() as conn:
+            row = conn.execute(
+                "SELECT started_at, owner, sent, failed, rate, report FROM broadcast_runs WHERE id=?", (run_id,)
+            ).fetchone()
+        self.assertEqual(row[:5], (1_700_000_000, "w0", 10, 1, 2.0))
+        self.assertEqual(json.loads(row[5])["outcomes"], {SENT: 10, FAILED: 1})
+
+    def test_history_empty(self):
+        self.assertIn("Запусков ещё не было", history_text())
+
+    def test_history_flags_run_below_median(self):
+        for i, rate in enumerate((10, 10, 12)):
+            self.save(sent=rate * 10, duration=10, start=1_700_000_000 + i * 86400)
+        # Медиана предыдущих — 10/с: 7.9/с ниже 80% от неё, 8.5/с — нет
+        self.save(sent=85, duration=10, start=1_700_300_000)
+        self.save(sent=79, duration=10, start=1_700_400_000)
+        lines = history_text().splitlines()[2:]
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[0].startswith("⚠️"), lines[0])
+        self.assertIn("<b>7.9</b>/с", lines[0])
+        self.assertTrue(all(line.startswith("•") for line in lines[1:]), lines)
+
+    def test_history_ignores_runs_without_sends(self):
+        self.save(sent=100, duration=10, start=1_700_000_000)
+        self.save(sent=0, duration=10, start=1_700_100_000)
+        self.save(sent=90, duration=10, start=1_700_200_000)
+        lines = history_text().splitlines()[2:]
+        # Пустой запуск не тянет медиану вниз и сам не помечается
+        self.assertTrue(all(line.startswith("•") for line in lines), lines)
+
+    def test_retry_outcomes_attach_to_last_run(self):
+        self.save(sent=10, duration=5, start=1_700_000_000)
+        last = self.save(sent=10, duration=5, start=1_700_100_000)
+        for outcome in (SENT, SENT, BLOCKED, RETRIED, FAILED, SKIPPED):
+            record_retry_outcome(outcome)
+        runs = recent_runs()
+        self.assertEqual(runs[0][7:], (2, 1, 1, 1))
+        self.assertEqual(runs[1][7:], (0, 0, 0, 0))
+        self.assertIn("повторы: ✅2 🚫1 🔁1 ❌1", history_text().splitlines()[2])
+        self.assertNotIn("повторы", history_text().splitlines()[3])
+        self.assertTrue(last)
+
+    def test_retry_outcome_without_runs(self):
+        record_retry_outcome(SENT)
+        self.assertEqual(recent_runs(), [])
@@ -0,0 +1,55 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from apscheduler.triggers.cron import CronTrigger
+
+import bot
+
+
+TRIGGER = CronTrigger.from_crontab("0 8 * * *", timezone="Europe/Berlin")
+
+
+def berlin(hour, minute=0):
+    return TRIGGER.timezone.localize(datetime(2024, 3, 5, hour, minute))
+
+
+class MissedFireTimeTest(unittest.TestCase):
+
+    def test_before_cron_time(self):
+        self.assertIsNone(bot.missed_fire_time(TRIGGER, berlin(7, 59)))
+
+    def test_after_cron_time(self):
+        self.assertEqual(bot.missed_fire_time(TRIGGER, berlin(8, 30)), berlin(8))
+
+    def test_not_today(self):
+        weekly = CronTrigger.from_crontab("0 8 * * sun", timezone="Europe/Berlin")
+        self.assertIsNone(bot.missed_fire_time(weekly, berlin(9)))  # 2024-03-05 — вторник
+
+
+class CatchUpTest(unittest.IsolatedAsyncioTestCase):
+
+    async def run_catch_up(self, now, due):
+        with mock.patch.object(bot, "datetime") as dt, \
+                mock.patch.object(bot.db, "due_users_page", mock.AsyncMock(return_value=due)), \
+                mock.patch.object(bot, "daily_broadcast", mock.AsyncMock()) as send:
+            dt.now.return_value = now
+            await bot.catch_up_broadcast(None, TRIGGER)
+        return send
+
+    async def test_missed_run_with_due_users(self):
+        (await self.run_catch_up(berlin(9), [1])).assert_awaited_once()
+
+    async def test_nobody_due(self):
+        (await self.run_catch_up(berlin(9), [])).assert_not_awaited()
+
+    async def test_before_cron_time(self):
+        (await self.run_catch_up(berlin(7), [1])).assert_not_awaited()
+
+    async def test_failure_is_logged(self):
+        with mock.patch.object(bot, "datetime") as dt, \
+                mock.patch.object(bot.db, "due_users_page", mock.AsyncMock(return_value=[1])), \
+                mock.patch.object(bot, "daily_broadcast", mock.AsyncMock(side_effect=RuntimeError)), \
+                self.assertLogs(bot.logger, "ERROR"):
+            dt.now.return_value = berlin(9)
+            await bot.catch_up_broadcast(None, TRIGGER)
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+
+import events
+import models
+from models import stamp_events, EV_LESSON, EV_SENT, EV_DELETED
+
+
+class StampEventsTest(unittest.TestCase):
+
+    def test_monotonic_even_if_clock_goes_back(self):
+        with mock.patch.object(models.time, "time_ns", side_effect=[5_000_000_000, 4_000_000_000, 4_000_000_000]):
+            stamped = stamp_events([(1, 7, EV_LESSON, None), (1, 7, EV_SENT, None), (1, 8, EV_LESSON, None)])
+        seqs = [ev[4] for ev in stamped]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(len(set(seqs)), 3)
+        # Младшие три цифры — метка экземпляра, одна на процесс
+        self.assertEqual({s % 1000 for s in seqs}, {models._SEQ_TAG})
+
+    def test_event_without_user_has_no_seq(self):
+        self.assertIsNone(stamp_events([(1, None, EV_DELETED, None)])[0][4])
+
+    def test_users_has_no_seq_column(self):
+        models.init_db()
+        with models.get_conn() as conn:
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(users)")}
+        self.assertNotIn("event_seq", cols)
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        models.init_db()
+        models.event_log.flush()
+        with models.get_conn() as conn:
+            for table in ("users", "events", "level_totals"):
+                conn.execute(f"DELETE FROM {table}")
+            conn.commit()
+        models.sync_level_totals({"A1": 10})
+
+    def test_journal_matches_users(self):
+        for uid in (1, 2, 3):
+            models.register_user(uid, "2024-01-01")
+        models.mark_sent_many([1, 2, 3])
+        models.claim_manual_lesson(1, 2)
+        models.set_level(2, "A2")
+        models.mark_blocked(3)
+        models.reactivate_if_blocked(3)
+        models.reset_progress_to_first(1)
+        models.increment_lesson(1)
+        self.assertEqual(events.verify(), [])
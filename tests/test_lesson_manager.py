@@ -0,0 +1,125 @@
+import json
+import os
+import tempfile
+import unittest
+
+from lesson_manager import (
+    LessonManager, LessonsError, MAX_LESSON_LEN, check_rendered, compile_lessons, file_checksum,
+    validate_lesson,
+)
+
+
+LESSON = {
+    "title": "Begrüßung",
+    "words": [["Hallo", "привет"], ["Tschüss", "пока"]],
+    "phrases": [["Wie geht's?", "как дела?"]],
+    "gram": {"rule": "du/Sie", "table": [["ich", "bin"]], "examples": [["Ich bin da", "я здесь"]]},
+    "task": "Поздоровайтесь <по-немецки>",
+}
+
+
+class ValidateLessonTest(unittest.TestCase):
+
+    def test_good_lesson(self):
+        self.assertEqual(validate_lesson(LESSON), [])
+
+    def test_malformed_pairs(self):
+        for bad in ([["Hallo"]], [["Hallo", "привет", "лишнее"]], [["Hallo", 1]], ["Hallo"], "Hallo"):
+            with self.subTest(words=bad):
+                self.assertEqual(validate_lesson({**LESSON, "words": bad}),
+                                 ["words: ожидается список пар [de, ru]"])
+        errors = validate_lesson({**LESSON, "gram": {"rule": "x", "examples": [["a"]]}})
+        self.assertEqual(errors, ["gram.examples: ожидается список пар [de, ru]"])
+
+    def test_wrong_types(self):
+        self.assertEqual(validate_lesson([]), ["урок должен быть объектом"])
+        errors = validate_lesson({"title": 1, "gram": {"rule": 2, "table": [["a", 3]]}})
+        self.assertEqual(errors, ["title: ожидается строка", "gram.rule: ожидается строка",
+                                  "gram.table: ожидается список строк таблицы"])
+
+
+class CheckRenderedTest(unittest.TestCase):
+
+    def test_allowed_tags(self):
+        self.assertEqual(check_rendered("<b>a</b> <i>b</i> <code>c</code>"), [])
+
+    def test_forbidden_tag(self):
+        self.assertEqual(check_rendered('<a href="x">a</a>'), ["недопустимый тег <a>"])
+
+    def test_unbalanced_tags(self):
+        self.assertEqual(check_rendered("<b><i>a</b></i>"),
+                         ["несбалансированный тег </b>", "несбалансированный тег </i>"])
+        self.assertEqual(check_rendered("<b>a"), ["незакрытые теги: ['b']"])
+
+    def test_too_long(self):
+        self.assertEqual(check_rendered("x" * MAX_LESSON_LEN), [])
+        self.assertEqual(check_rendered("x" * (MAX_LESSON_LEN + 1)),
+                         [f"длина {MAX_LESSON_LEN + 1} > {MAX_LESSON_LEN}"])
+
+
+class CompileLessonsTest(unittest.TestCase):
+
+    def test_compiles_and_escapes(self):
+        compiled, errors = compile_lessons({"A1": [LESSON, LESSON]})
+        self.assertEqual(errors, [])
+        first = compiled["A1"][0]
+        self.assertIn("(1/2)", first["text"])
+        self.assertIn("&lt;по-немецки&gt;", first["text"])
+        self.assertEqual(first["length"], len(first["text"]))
+        self.assertEqual(first["words"], 2)
+
+    def test_errors_point_at_lesson(self):
+        long_task = {"title": "t", "task": "x" * MAX_LESSON_LEN}
+        compiled, errors = compile_lessons({"A1": [LESSON, {"words": [["a"]]}, long_task]})
+        self.assertEqual(len(compiled["A1"]), 2)  # урок с ошибкой схемы не рендерится
+        self.assertEqual(errors[0], "A1[1]: words: ожидается список пар [de, ru]")
+        self.assertTrue(errors[1].startswith("A1[2]: длина "))
+
+    def test_bad_root(self):
+        self.assertEqual(compile_lessons([])[1], ["корень файла должен быть объектом {уровень: [уроки]}"])
+        self.assertEqual(compile_lessons({"A1": {}})[1], ["A1: ожидается список уроков"])
+
+
+class CompiledArtifactTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp(prefix="lessons-")
+        self.src = os.path.join(tmp, "lessons.json")
+        self.out = os.path.join(tmp, "lessons.compiled.json")
+        self.write_source({"A1": [LESSON]})
+
+    def write_source(self, data):
+        with open(self.src, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def write_artifact(self, text, checksum=None):
+        artifact = {"source_checksum": checksum or file_checksum(self.src),
+                    "levels": {"A1": [{"text": text}]}}
+        with open(self.out, "w", encoding="utf-8") as f:
+            json.dump(artifact, f, ensure_ascii=False)
+
+    def test_fresh_artifact_is_used(self):
+        self.write_artifact("из артефакта")
+        self.assertEqual(LessonManager(self.src, self.out).render("A1", 0), "из артефакта")
+
+    def test_checksum_mismatch_rebuilds(self):
+        self.write_artifact("из артефакта", checksum="0" * 64)
+        with self.assertLogs(level="WARNING") as logs:
+            mgr = LessonManager(self.src, self.out)
+        self.assertIn("устарел", logs.output[0])
+        self.assertEqual(mgr.render("A1", 0), compile_lessons({"A1": [LESSON]})[0]["A1"][0]["text"])
+
+    def test_missing_or_broken_artifact_rebuilds(self):
+        with self.assertLogs(level="WARNING"):
+            self.assertIn("Begrüßung", LessonManager(self.src, self.out).render("A1", 0))
+        with open(self.out, "w") as f:
+            f.write("{")
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertIn("Begrüßung", LessonManager(self.src, self.out).render("A1", 0))
+        self.assertIn("повреждён", logs.output[0])
+
+    def test_stale_artifact_does_not_hide_bad_content(self):
+        self.write_artifact("из артефакта")
+        self.write_source({"A1": [{"words": [["a"]]}]})
+        with self.assertLogs(level="WARNING"), self.assertRaises(LessonsError):
+            LessonManager(self.src, self.out)
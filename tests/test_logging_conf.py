@@ -0,0 +1,101 @@
+import logging
+import types
+import unittest
+from unittest import mock
+
+import logging_conf
+from logging_conf import DedupFilter, PENDING_SUPPRESSED_MAX
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def record(msg="Network/API error user %s", args=(1,), level=logging.WARNING, name="daily_send"):
+    return logging.LogRecord(name, level, __file__, 0, msg, args, None)
+
+
+class DedupFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(logging_conf, "time", types.SimpleNamespace(monotonic=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.f = DedupFilter(window=60, burst=3)
+
+    def passed(self, n, **kw):
+        return [self.f.filter(record(args=(i,), **kw)) for i in range(n)]
+
+    def test_burst_then_suppress(self):
+        self.assertEqual(self.passed(5), [True, True, True, False, False])
+        self.assertEqual(self.f.suppressed_total, 2)
+
+    def test_key_ignores_args_but_not_level_or_logger(self):
+        self.passed(3)
+        self.assertFalse(self.f.filter(record(args=(999,))))
+        self.assertTrue(self.f.filter(record(level=logging.ERROR)))
+        self.assertTrue(self.f.filter(record(name="bot")))
+
+    def test_info_and_disabled_window_pass(self):
+        self.assertEqual(self.passed(10, level=logging.INFO), [True] * 10)
+        self.f.window = 0
+        self.assertEqual(self.passed(10), [True] * 10)
+
+    def test_next_window_reports_suppressed(self):
+        # Окно сообщения истекает раньше, чем приходит очередная уборка (_sweep):
+        # скрытое докладывается в первой записи нового окна
+        self.clock.now += 50
+        self.passed(5)
+        self.clock.now += 10
+        self.assertFalse(self.f.filter(record()))  # уборка прошла, окно ещё живо
+        self.clock.now += 55
+        rec = record()
+        self.assertTrue(self.f.filter(rec))
+        self.assertEqual(rec.suppressed, 3)
+        self.assertIn("(похожих скрыто: 3)", rec.getMessage())
+        self.assertEqual(self.f.pending, [])
+        # Новое окно: снова пропускаем burst штук
+        self.assertEqual(self.passed(3), [True, True, False])
+
+    def test_window_without_suppression_adds_nothing(self):
+        self.passed(3)
+        self.clock.now += 60
+        rec = record()
+        self.assertTrue(self.f.filter(rec))
+        self.assertFalse(hasattr(rec, "suppressed"))
+
+    def test_expired_window_goes_to_pending(self):
+        self.passed(5)
+        self.passed(4, msg="Other %s")
+        self.clock.now += 61
+        pending = self.f.take_pending()
+        self.assertEqual(sorted(pending), [
+            (("daily_send", logging.WARNING, "Network/API error user %s"), 2),
+            (("daily_send", logging.WARNING, "Other %s"), 1),
+        ])
+        self.assertEqual(self.f.take_pending(), [])
+        # Окно выкинуто: следующая запись не повторяет уже доложенный счётчик
+        rec = record()
+        self.assertTrue(self.f.filter(rec))
+        self.assertFalse(hasattr(rec, "suppressed"))
+
+    def test_sweep_runs_from_filter_once_per_window(self):
+        self.passed(5)
+        self.clock.now += 61
+        self.f.filter(record(msg="Unrelated"))
+        self.assertEqual(len(self.f.pending), 1)
+        self.assertNotIn(("daily_send", logging.WARNING, "Network/API error user %s"), self.f._seen)
+
+    def test_pending_is_capped(self):
+        for i in range(PENDING_SUPPRESSED_MAX + 20):
+            self.passed(4, msg=f"msg {i} %s")
+        self.clock.now += 61
+        pending = self.f.take_pending()
+        self.assertEqual(len(pending), PENDING_SUPPRESSED_MAX)
+        self.assertEqual(self.f._seen, {})
+        self.assertEqual(self.f.suppressed_total, PENDING_SUPPRESSED_MAX + 20)
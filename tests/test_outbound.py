@@ -0,0 +1,147 @@
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+import http_session
+import outbound
+from outbound import PriorityLimiter, INTERACTIVE, ADMIN, BROADCAST, RETRY
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class PauseAccountingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(outbound.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = PriorityLimiter(rate=10, burst=5)
+
+    def test_overlapping_pauses_count_wall_clock_once(self):
+        # Один флуд-лимит, пойманный тремя воркерами почти одновременно
+        self.limiter.pause(10)
+        self.clock.now += 0.5
+        self.limiter.pause(10)
+        self.limiter.pause(9)
+        self.assertAlmostEqual(self.limiter.paused_total, 10.5)
+        self.assertEqual(self.limiter.pauses, 2)
+
+    def test_separate_pauses_add_up(self):
+        self.limiter.pause(3)
+        self.clock.now += 60
+        self.limiter.pause(2)
+        self.assertAlmostEqual(self.limiter.paused_total, 5)
+
+
+class QueueTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Часы лимитера стоят, пока тест их не сдвинет: токены появляются только по tick().
+    rate большой, поэтому цикл выдачи спит доли миллисекунды реального времени.
+    """
+
+    RATE = 1000
+
+    async def asyncSetUp(self):
+        self.clock = FakeClock()
+        # Подменяем модуль time только в outbound: часы event loop должны идти
+        patcher = mock.patch.object(outbound, "time", types.SimpleNamespace(monotonic=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = PriorityLimiter(rate=self.RATE, burst=1)
+        self.order = []
+        self.tasks = []
+        await self.limiter.acquire(INTERACTIVE)  # ведро пусто, дальше все встают в очередь
+
+    async def asyncTearDown(self):
+        for task in self.tasks + [self.limiter._pump]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*[t for t in self.tasks + [self.limiter._pump] if t], return_exceptions=True)
+
+    def wait(self, name, priority):
+        async def waiter():
+            await self.limiter.acquire(priority)
+            self.order.append(name)
+        task = asyncio.create_task(waiter())
+        self.tasks.append(task)
+        return task
+
+    async def settle(self):
+        # Даём циклу выдачи проснуться и раздать то, что накопилось
+        for _ in range(5):
+            await asyncio.sleep(0.002)
+
+    async def tick(self, seconds=1.5 / RATE):
+        self.clock.now += seconds
+        await self.settle()
+
+    async def test_interactive_jumps_ahead_of_queued_broadcast_and_retry(self):
+        self.wait("broadcast-1", BROADCAST)
+        self.wait("retry", RETRY)
+        self.wait("broadcast-2", BROADCAST)
+        await self.settle()
+        self.wait("admin", ADMIN)
+        self.wait("interactive", INTERACTIVE)
+        await self.settle()
+        self.assertEqual(self.limiter.depths(), {"interactive": 1, "admin": 1, "broadcast": 2, "retry": 1})
+        for _ in range(5):
+            await self.tick()
+        self.assertEqual(self.order, ["interactive", "admin", "broadcast-1", "broadcast-2", "retry"])
+        self.assertEqual(self.limiter.granted(), {"interactive": 2, "admin": 1, "broadcast": 2, "retry": 1})
+
+    async def test_cancelled_waiter_does_not_take_a_token(self):
+        cancelled = self.wait("cancelled", INTERACTIVE)
+        self.wait("broadcast", BROADCAST)
+        await self.settle()
+        cancelled.cancel()
+        await self.settle()
+        self.assertEqual(self.limiter.depths()["interactive"], 0)
+        await self.tick()
+        self.assertEqual(self.order, ["broadcast"])
+        self.assertEqual(self.limiter.depths()["broadcast"], 0)
+        self.assertEqual(self.limiter.granted()["interactive"], 1)
+
+    async def test_pause_stops_every_class_and_refills_from_zero(self):
+        self.limiter.burst = 5
+        await self.tick(1.0)  # ведро снова полное: 5 токенов
+        self.limiter.pause(0.05)
+        for name, priority in (("interactive", INTERACTIVE), ("admin", ADMIN), ("retry", RETRY)):
+            self.wait(name, priority)
+        await self.tick(0.03)
+        self.assertEqual(self.order, [])
+        # Пауза кончилась: ведро наполняется с нуля, полторы нормы — один токен, не всплеск
+        await self.tick(0.02 + 1.5 / self.RATE)
+        for _ in range(10):
+            if self.order:
+                break
+            await self.settle()
+        self.assertEqual(self.order, ["interactive"])
+        await self.tick()
+        await self.tick()
+        self.assertEqual(self.order, ["interactive", "admin", "retry"])
+
+
+class ApiTimeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_counts_only_the_request(self):
+        clock = FakeClock()
+        session = http_session.TunedAiohttpSession()
+
+        async def make_request(bot, method):
+            clock.now += 0.25
+
+        http_session.api_time.set(0.0)
+        with mock.patch.object(http_session.time, "monotonic", clock):
+            clock.now += 5  # ожидание токена до middleware не попадает в замер
+            await session._count_requests(make_request, None, None)
+            await session._count_requests(make_request, None, None)
+        self.assertAlmostEqual(http_session.api_time.get(), 0.5)
+        await session.close()
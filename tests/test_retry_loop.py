@@ -0,0 +1,82 @@
+import asyncio
+import sqlite3
+import unittest
+from unittest import mock
+
+import daily_send
+import models
+from broadcast_report import SKIPPED
+from leader import LeaseLost
+from retry_queue import schedule_retry
+
+
+ACTIVE_ROW = (None, "A1", 0, 0, "", None, None, "active", None)
+
+
+def pending_ids():
+    with models.get_conn() as conn:
+        return [r[0] for r in conn.execute("SELECT user_id FROM send_retries ORDER BY user_id")]
+
+
+class RetryLoopTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        models.init_db()
+        with models.get_conn() as conn:
+            conn.execute("DELETE FROM send_retries")
+            conn.commit()
+        for uid in (1, 2):
+            schedule_retry(uid, "A1", 0, "test")
+        with models.get_conn() as conn:
+            conn.execute("UPDATE send_retries SET next_attempt_at = 0")
+            conn.commit()
+
+    async def run_loop(self, seconds: float = 0.2):
+        with mock.patch.object(daily_send, "RETRY_POLL_INTERVAL", 0.01):
+            task = asyncio.create_task(daily_send.run_retry_loop(None))
+            await asyncio.sleep(seconds)
+            self.assertFalse(task.done(), "цикл повторов не должен завершаться")
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def test_db_error_does_not_stop_loop(self):
+        calls = []
+
+        async def get_user(uid):
+            calls.append(uid)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return (uid,) + ACTIVE_ROW[1:]
+
+        send_one = mock.AsyncMock(return_value="sent")
+        with mock.patch.object(daily_send.db, "get_user", get_user), \
+                mock.patch.object(daily_send, "send_one", send_one):
+            await self.run_loop()
+        # Первый пользователь пропущен из-за ошибки, но цикл жив и шлёт дальше
+        self.assertGreater(len(calls), 2)
+        self.assertTrue(send_one.await_count >= 2)
+
+    async def test_skipped_retry_is_cleared(self):
+        async def get_user(uid):
+            return (uid,) + ACTIVE_ROW[1:]
+
+        with mock.patch.object(daily_send.db, "get_user", get_user), \
+                mock.patch.object(daily_send, "send_one", mock.AsyncMock(return_value=SKIPPED)):
+            await self.run_loop()
+        self.assertEqual(pending_ids(), [])
+
+
+class MarkDeliveredTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_no_cards_when_fence_rejects(self):
+        with mock.patch.object(daily_send.db, "mark_sent", mock.AsyncMock(return_value=False)), \
+                mock.patch.object(daily_send, "add_lesson_cards") as add_cards:
+            with self.assertRaises(LeaseLost):
+                await daily_send.mark_delivered(1, "A1", 0)
+        add_cards.assert_not_called()
+
+    async def test_cards_after_accepted_mark(self):
+        with mock.patch.object(daily_send.db, "mark_sent", mock.AsyncMock(return_value=True)), \
+                mock.patch.object(daily_send, "add_lesson_cards") as add_cards:
+            await daily_send.mark_delivered(1, "A1", 0)
+        add_cards.assert_called_once()
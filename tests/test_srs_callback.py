@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+
+import bot
+from srs import GRADE_GOOD
+
+
+def fake_callback(data):
+    callback = mock.Mock()
+    callback.from_user.id = 1
+    callback.data = data
+    callback.answer = mock.AsyncMock()
+    callback.message.edit_text = mock.AsyncMock()
+    return callback
+
+
+class GradeValidationTest(unittest.IsolatedAsyncioTestCase):
+
+    async def press(self, data):
+        callback = fake_callback(data)
+        with mock.patch.object(bot, "grade_card") as grade, \
+                mock.patch.object(bot, "next_due_card", return_value=None):
+            await bot.srs_callback_handler(callback)
+        return callback, grade
+
+    async def test_known_grade(self):
+        _, grade = await self.press(f"srs:grade:7:{GRADE_GOOD}")
+        grade.assert_called_once_with(7, 1, GRADE_GOOD)
+
+    async def test_forged_grades_rejected(self):
+        for data in ("srs:grade:7:100", "srs:grade:7:-5", "srs:grade:7:x", "srs:grade:7", "srs:grade:x:5", "srs:drop:7:5"):
+            with self.subTest(data=data):
+                callback, grade = await self.press(data)
+                grade.assert_not_called()
+                self.assertTrue(callback.answer.await_args.kwargs.get("show_alert"))
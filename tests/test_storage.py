@@ -0,0 +1,225 @@
+"""
+Один набор проверок для всех реализаций storage.Storage.
+SQLite — всегда; PostgreSQL — только если задан TEST_DATABASE_URL (одноразовая база:
+таблицы очищаются перед каждым тестом).
+"""
+import os
+import time
+import unittest
+
+import models
+from models import today_day
+from storage import Storage, SqliteStorage, PostgresStorage
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+DAY = 86400
+
+
+class StorageContract:
+    """Смешивается с IsolatedAsyncioTestCase; make_storage и clear задаёт реализация."""
+
+    def make_storage(self) -> Storage:
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+    async def asyncSetUp(self):
+        self.db = self.make_storage()
+        await self.db.open()
+        await self.clear()
+        await self.db.sync_level_totals({"A1": 3})
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    async def test_register_is_idempotent(self):
+        await self.db.register_user(1, "2024-01-01", "u", "User")
+        await self.db.register_user(1, "2025-01-01", "other", "Other")
+        row = await self.db.get_user(1)
+        self.assertEqual(row[0], 1)
+        self.assertEqual(row[2], 0)
+        self.assertEqual(row[4], "2024-01-01")
+        self.assertEqual(row[7], "active")
+        self.assertIsNone(await self.db.get_user(2))
+
+    async def test_get_users(self):
+        for uid in (1, 2, 3):
+            await self.db.register_user(uid, "2024-01-01")
+        rows = await self.db.get_users([1, 3, 99])
+        self.assertEqual(sorted(rows), [1, 3])
+        self.assertEqual(rows[3][0], 3)
+
+    async def test_sync_level_totals_reports_change(self):
+        self.assertFalse(await self.db.sync_level_totals({"A1": 3}))
+        self.assertTrue(await self.db.sync_level_totals({"A1": 4}))
+
+    async def test_due_users_exclude_finished_and_blocked(self):
+        for uid in (1, 2, 3):
+            await self.db.register_user(uid, "2024-01-01")
+        await self.db.mark_blocked(2)
+        day = today_day()
+        for _ in range(3):
+            await self.db.mark_sent(3, day=day - 10)
+        self.assertEqual(await self.db.get_due_users(day), [1])
+        # Новые уроки снова делают закончившего eligible
+        await self.db.sync_level_totals({"A1": 5})
+        self.assertEqual(sorted(await self.db.get_due_users(day)), [1, 3])
+
+    async def test_iter_due_users_pages(self):
+        for uid in range(1, 8):
+            await self.db.register_user(uid, "2024-01-01")
+        pages = [page async for page in self.db.iter_due_users(today_day(), batch=3)]
+        self.assertEqual(pages, [[1, 2, 3], [4, 5, 6], [7]])
+
+    async def test_mark_sent_advances_and_schedules(self):
+        await self.db.register_user(1, "2024-01-01")
+        day = today_day()
+        await self.db.mark_sent(1, ts=day * DAY + 100, day=day)
+        row = await self.db.get_user(1)
+        self.assertEqual(row[2], 1)
+        self.assertEqual(row[5], day * DAY + 100)
+        self.assertEqual(await self.db.get_due_users(day), [])
+        self.assertEqual(await self.db.get_due_users(day + 1), [1])
+
+    async def test_mark_sent_many(self):
+        for uid in (1, 2):
+            await self.db.register_user(uid, "2024-01-01")
+        await self.db.mark_sent_many([1, 2])
+        rows = await self.db.get_users([1, 2])
+        self.assertEqual([rows[1][2], rows[2][2]], [1, 1])
+
+    async def test_claim_manual_lesson_limits(self):
+        await self.db.register_user(1, "2024-01-01")
+        ts = today_day() * DAY + 10
+        self.assertEqual(await self.db.claim_manual_lesson(1, 2, ts), ("A1", 0))
+        self.assertEqual(await self.db.claim_manual_lesson(1, 2, ts + 1), ("A1", 1))
+        self.assertIsNone(await self.db.claim_manual_lesson(1, 2, ts + 2))
+        # Новый день сбрасывает счётчик; после последнего урока уровня выдавать нечего
+        self.assertEqual(await self.db.claim_manual_lesson(1, 2, ts + DAY), ("A1", 2))
+        self.assertIsNone(await self.db.claim_manual_lesson(1, 2, ts + DAY + 1))
+        self.assertIsNone(await self.db.claim_manual_lesson(99, 2, ts))
+
+    async def test_claim_manual_lesson_needs_active(self):
+        await self.db.register_user(1, "2024-01-01")
+        await self.db.mark_blocked(1)
+        self.assertIsNone(await self.db.claim_manual_lesson(1, 2))
+
+    async def test_block_and_reactivate(self):
+        for uid in (1, 2, 3):
+            await self.db.register_user(uid, "2024-01-01")
+        await self.db.mark_blocked_many([1, 2])
+        self.assertEqual(await self.db.get_active_users(), [3])
+        await self.db.reactivate_if_blocked(1)
+        row = await self.db.get_user(1)
+        self.assertEqual(row[7], "active")
+        self.assertIsNotNone(row[8])
+        self.assertEqual(sorted(await self.db.get_active_users()), [1, 3])
+
+    async def test_set_level_resets_progress(self):
+        await self.db.register_user(1, "2024-01-01")
+        await self.db.mark_sent(1)
+        await self.db.set_level(1, "A2")
+        row = await self.db.get_user(1)
+        self.assertEqual((row[1], row[2]), ("A2", 0))
+
+    async def test_delete_user(self):
+        await self.db.register_user(1, "2024-01-01")
+        await self.db.delete_user(1)
+        self.assertIsNone(await self.db.get_user(1))
+
+    async def test_lease(self):
+        self.assertEqual(await self.db.acquire_lease("t", "a", 30), 1)
+        self.assertIsNone(await self.db.acquire_lease("t", "b", 30))
+        self.assertEqual(await self.db.acquire_lease("t", "a", 30), 1)
+        await self.db.release_lease("t", "b")
+        self.assertIsNone(await self.db.acquire_lease("t", "b", 30))
+        await self.db.release_lease("t", "a")
+        # Поколение растёт при смене владельца и не сбрасывается освобождением
+        self.assertEqual(await self.db.acquire_lease("t", "b", 30), 2)
+
+    async def test_lease_expires(self):
+        self.assertEqual(await self.db.acquire_lease("t", "a", -5), 1)
+        self.assertEqual(await self.db.acquire_lease("t", "b", 30), 2)
+
+    async def test_mark_sent_fenced(self):
+        await self.db.register_user(1, "2024-01-01")
+        gen = await self.db.acquire_lease("t", "a", 30)
+        self.assertTrue(await self.db.mark_sent(1, fence=("t", "a", gen)))
+        # Аренда истекла, её забрал b: запись a с прежним токеном отклоняется
+        await self.db.acquire_lease("t", "a", -5)
+        new_gen = await self.db.acquire_lease("t", "b", 30)
+        self.assertFalse(await self.db.mark_sent(1, fence=("t", "a", gen)))
+        self.assertFalse(await self.db.mark_sent_many([1], fence=("t", "b", gen)))
+        self.assertEqual((await self.db.get_user(1))[2], 1)
+        self.assertTrue(await self.db.mark_sent_many([1], fence=("t", "b", new_gen)))
+        self.assertEqual((await self.db.get_user(1))[2], 2)
+
+    async def test_activity_keeps_user_daily(self):
+        await self.db.register_user(1, "2024-01-01")
+        await self.db.register_user(2, "2024-01-01")
+        later = int(time.time()) + 20 * DAY
+        # Через 20 дней: 2 ничего не нажимал, 1 пользовался квизом/повторением
+        await self.db.touch_activity(1, later)
+        await self.db.update_engagement_tiers(later)
+        self.assertEqual(dict(await self.db.get_tier_counts()), {"daily": 1, "few_days": 1})
+        await self.db.update_engagement_tiers(later + 50 * DAY)
+        self.assertEqual(dict(await self.db.get_tier_counts()), {"few_days": 1, "weekly": 1})
+
+    async def test_activity_pulls_next_lesson_to_tomorrow(self):
+        await self.db.register_user(1, "2024-01-01")
+        now = int(time.time())
+        await self.db.update_engagement_tiers(now + 70 * DAY)
+        day = today_day(now + 70 * DAY)
+        await self.db.mark_sent(1, ts=day * DAY, day=day)
+        self.assertEqual(await self.db.get_due_users(day + 1), [])
+        await self.db.touch_activity(1, day * DAY + 60)
+        # Сегодняшний урок уже получен — не раньше завтра, но и не через неделю
+        self.assertEqual(await self.db.get_due_users(day), [])
+        self.assertEqual(await self.db.get_due_users(day + 1), [1])
+
+    async def test_progress_text(self):
+        await self.db.register_user(1, "2024-01-01")
+        self.assertIn("A1", await self.db.get_progress_text(1, 3))
+
+
+class SqliteStorageTest(StorageContract, unittest.IsolatedAsyncioTestCase):
+
+    def make_storage(self):
+        return SqliteStorage()
+
+    async def test_never_active_user_is_tiered(self):
+        await self.db.register_user(1, "2024-01-01")
+        with models.get_conn() as conn:
+            conn.execute("UPDATE users SET last_active_at = NULL")
+            conn.commit()
+        await self.db.update_engagement_tiers()
+        self.assertEqual(dict(await self.db.get_tier_counts()), {"weekly": 1})
+
+    async def clear(self):
+        models.event_log.flush()
+        with models.get_conn() as conn:
+            for table in ("users", "events", "level_totals", "leases") + models.USER_DATA_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            conn.commit()
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL не задан")
+class PostgresStorageTest(StorageContract, unittest.IsolatedAsyncioTestCase):
+
+    def make_storage(self):
+        return PostgresStorage(TEST_DATABASE_URL, min_size=1, max_size=2)
+
+    async def clear(self):
+        await self.db.pool.execute("TRUNCATE users, events, level_totals, leases")
+
+
+class AbstractStorageTest(unittest.TestCase):
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class Partial(Storage):
+            async def get_user(self, user_id):
+                return None
+
+        with self.assertRaises(TypeError):
+            Partial()